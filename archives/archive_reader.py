@@ -0,0 +1,525 @@
+"""
+Archive Reader
+
+Read access to datasets stored as zip, tar or tar.gz archives, without
+extracting them. A path inside an archive is written as if the archive was a
+folder: `/data/coco.zip/train/labels/a.txt` is the member `train/labels/a.txt`
+of `/data/coco.zip`. The path-level functions (`open_binary`, `read_bytes`,
+`stat`, `scan_tree`, ...) accept both these paths and regular paths, so the
+tools only swap their `open`/`os.stat`/`os.scandir` calls for them.
+
+Random access:
+- **zip**: the central directory is read once, when the archive is opened.
+  Stored (uncompressed) members are read at their data offset with `pread`,
+  deflated members through `zipfile`.
+- **tar**: the member index (name, size, mtime, data offset) is built once by
+  walking the headers (`iter_tar_entries`, ustar, GNU and pax), seeking over
+  the data. Every member is then read at its offset with `pread`, like a
+  stored zip member.
+- **tar.gz**: the gzip stream can only be read forward, so the index pass
+  decompresses the archive once, and keeps the content of the small members
+  (label files, yaml) in memory, up to a budget. Larger members are read by
+  seeking in the stream: forward seeks decompress and discard, backward seeks
+  restart from the beginning, so many of them must be read serially in archive
+  order (see `sequential_order`).
+
+Uncompressed members of at least `MMAP_THRESHOLD` bytes are read through a
+memory map of the archive (no read buffer copy, and only the pages touched by
+an image header read are loaded); smaller ones with a single `pread`.
+
+Open archives are cached per process (worker processes open their own).
+"""
+
+import io
+import os
+import gzip
+import mmap
+import time
+import shutil
+import struct
+import zipfile
+import threading
+from collections import namedtuple
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+# Uncompressed members of at least this size are read through a memory map
+MMAP_THRESHOLD = 1 << 20
+# Members of a compressed tar kept in memory by the index pass (size each, total)
+SMALL_MEMBER_SIZE = 64 << 10
+SMALL_MEMBER_BUDGET = 256 << 20
+BUFFER_SIZE = io.DEFAULT_BUFFER_SIZE
+# Read buffer of the tar index pass: seeks over the data of small members stay in it
+TAR_INDEX_BUFFER = 1 << 16
+
+# The fields of `os.stat_result` the tools use (atime is the mtime, archives have none)
+MemberStat = namedtuple('MemberStat', ['st_size', 'st_mtime_ns', 'st_atime_ns'])
+# `stored`: the data is uncompressed at `offset` in the archive file (-1: not resolved yet).
+# Otherwise `offset` is the data offset in the decompressed tar stream (None for zip).
+ArchiveMember = namedtuple('ArchiveMember', ['name', 'size', 'mtime_ns', 'offset', 'stored', 'order'])
+
+# Zip local file header: signature ... file name length, extra field length
+_ZIP_LOCAL_HEADER = struct.Struct('<4s22xHH')
+_TAR_BLOCK = 512
+_TAR_FILE_TYPES = (b'0', b'\0', b'7')
+_TAR_FOLDER_TYPE = b'5'
+# GNU long name / long link name, pax extended / global header: they describe the next entry
+_TAR_META_TYPES = (b'L', b'K', b'x', b'g')
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def archive_extension(path: str):
+    """The archive extension of `path` (lowercase), None when it is not an archive name."""
+    lower = path.lower()
+    for extension in ARCHIVE_EXTENSIONS:
+        if lower.endswith(extension):
+            return extension
+    return None
+
+
+def _member_name(name: str) -> str:
+    """Member key of an archive entry name (no leading '/' or './')."""
+    name = name.lstrip('/')
+    return name[2:] if name.startswith('./') else name
+
+
+def _tar_string(field: bytes) -> str:
+    return field.split(b'\0', 1)[0].decode('utf-8', 'surrogateescape')
+
+
+def _tar_number(field: bytes) -> int:
+    if field[0] & 0x80:
+        # base-256, for values that do not fit the octal field
+        return int.from_bytes(field[1:], 'big')
+    field = field.split(b'\0', 1)[0].strip()
+    return int(field, 8) if field else 0
+
+
+def _pax_records(data: bytes) -> dict:
+    """'<length> <key>=<value>\\n' records of a pax extended header."""
+    records = {}
+    position = 0
+    while position < len(data):
+        space = data.find(b' ', position)
+        if space < 0:
+            break
+        length = int(data[position:space])
+        if length <= 0:
+            break
+        key, _, value = data[space + 1:position + length - 1].partition(b'=')
+        records[key.decode('utf-8', 'surrogateescape')] = value.decode('utf-8', 'surrogateescape')
+        position += length
+    return records
+
+
+def iter_tar_entries(f):
+    """
+    Walks the headers of the tar stream `f` (seekable, positioned at its start),
+    seeking over the data. The ustar, GNU long name and pax formats are read.
+
+    Yields:
+        tuple: (name, type flag, size, mtime in seconds, data offset) of every
+            entry. `f` is positioned at the data when it is yielded, the data
+            may be read before the next entry is requested.
+    """
+    offset = 0
+    long_name, pax = None, {}
+    while True:
+        f.seek(offset)
+        header = f.read(_TAR_BLOCK)
+        if len(header) < _TAR_BLOCK or header == bytes(_TAR_BLOCK):
+            return
+        name = _tar_string(header[0:100])
+        if header[257:262] == b'ustar':
+            prefix = _tar_string(header[345:500])
+            if prefix:
+                name = f'{prefix}/{name}'
+        size = _tar_number(header[124:136])
+        mtime = _tar_number(header[136:148])
+        flag = header[156:157]
+        data = offset + _TAR_BLOCK
+        if flag in _TAR_META_TYPES:
+            payload = f.read(size)
+            if flag == b'L':
+                long_name = _tar_string(payload)
+            elif flag == b'x':
+                pax = _pax_records(payload)
+            offset = data + -(-size // _TAR_BLOCK) * _TAR_BLOCK
+            continue
+        name = pax.get('path', long_name or name)
+        size = int(pax.get('size', size))
+        mtime = float(pax.get('mtime', mtime))
+        long_name, pax = None, {}
+        offset = data + -(-size // _TAR_BLOCK) * _TAR_BLOCK
+        yield name, flag, size, mtime, data
+
+
+class ArchiveReader:
+    """
+    Index and member reads of one archive.
+
+    Parameters:
+        path (str): zip, tar, tar.gz or tgz file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.kind = archive_extension(path)
+        if self.kind is None:
+            raise ValueError(f'Not an archive: {path}')
+        self.members = {}
+        self.folders = {''}
+        self._small = {}
+        self._lock = threading.Lock()
+        self._zip = self._stream = self._mmap = None
+        self._file = open(path, 'rb')
+        if self.kind == '.zip':
+            self._index_zip()
+        else:
+            self._index_tar()
+
+    @property
+    def sequential(self) -> bool:
+        """True when the members can only be read efficiently in archive order (compressed tar)."""
+        return self.kind in ('.tar.gz', '.tgz')
+
+    def _add(self, name: str, size: int, mtime_ns: int, offset, stored: bool):
+        name = _member_name(name)
+        self.members[name] = ArchiveMember(name, size, mtime_ns, offset, stored, len(self.members))
+        folder = os.path.dirname(name)
+        while folder not in self.folders:
+            self.folders.add(folder)
+            folder = os.path.dirname(folder)
+
+    def _index_zip(self):
+        self._zip = zipfile.ZipFile(self._file)
+        for info in self._zip.infolist():
+            if info.is_dir():
+                self.folders.add(_member_name(info.filename).rstrip('/'))
+                continue
+            mtime_ns = int(time.mktime(info.date_time + (0, 0, -1))) * 1_000_000_000
+            # The data offset of a stored member is resolved on its first read
+            stored = info.compress_type == zipfile.ZIP_STORED
+            self._add(info.filename, info.file_size, mtime_ns, -1 if stored else None, stored)
+
+    def _zip_offset(self, member: ArchiveMember) -> int:
+        info = self._zip.getinfo(member.name)
+        _, name_length, extra_length = _ZIP_LOCAL_HEADER.unpack(self._pread(_ZIP_LOCAL_HEADER.size, info.header_offset))
+        offset = info.header_offset + _ZIP_LOCAL_HEADER.size + name_length + extra_length
+        self.members[member.name] = member._replace(offset=offset)
+        return offset
+
+    def _index_tar(self):
+        if self.sequential:
+            # Kept open: the members that are not kept in memory are read from it
+            self._stream = f = gzip.GzipFile(fileobj=open(self.path, 'rb'))
+        else:
+            f = open(self.path, 'rb', buffering=TAR_INDEX_BUFFER)
+        budget = SMALL_MEMBER_BUDGET
+        try:
+            for name, flag, size, mtime, offset in iter_tar_entries(f):
+                name = _member_name(name)
+                if flag == _TAR_FOLDER_TYPE:
+                    self.folders.add(name.rstrip('/'))
+                    continue
+                if flag not in _TAR_FILE_TYPES:
+                    continue
+                self._add(name, size, int(mtime) * 1_000_000_000, offset, not self.sequential)
+                # The stream is right at the data of this member, reading it now costs nothing extra
+                if self.sequential and size <= min(SMALL_MEMBER_SIZE, budget):
+                    self._small[name] = f.read(size)
+                    budget -= size
+        finally:
+            if not self.sequential:
+                f.close()
+
+    def _pread(self, size: int, offset: int) -> bytes:
+        if hasattr(os, 'pread'):
+            return os.pread(self._file.fileno(), size, offset)
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def _map(self) -> mmap.mmap:
+        with self._lock:
+            if self._mmap is None:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._mmap
+
+    def member(self, name: str) -> ArchiveMember:
+        member = self.members.get(name)
+        if member is None:
+            raise FileNotFoundError(f'No member {name} in {self.path}')
+        if member.stored and member.offset == -1:
+            self._zip_offset(member)
+            member = self.members[name]
+        return member
+
+    def _reader_at(self, member: ArchiveMember):
+        """read(size, offset within the member) of a stored member, or of a member of the compressed tar stream."""
+        if not member.stored:
+            def read_at(size, position):
+                with self._lock:
+                    self._stream.seek(member.offset + position)
+                    return self._stream.read(size)
+        elif member.size >= MMAP_THRESHOLD:
+            def read_at(size, position):
+                start = member.offset + position
+                return self._map()[start:start + size]
+        else:
+            def read_at(size, position):
+                return self._pread(size, member.offset + position)
+        return read_at
+
+    def isdir(self, name: str) -> bool:
+        return name.rstrip('/') in self.folders
+
+    def stat(self, name: str) -> MemberStat:
+        member = self.member(name)
+        return MemberStat(member.size, member.mtime_ns, member.mtime_ns)
+
+    def scan(self, folder: str, extensions: tuple) -> list:
+        """
+        Lists the members under `folder` whose lowercase extension is in `extensions`.
+
+        Returns:
+            list: (path relative to `folder`, member) pairs.
+        """
+        prefix = folder.strip('/') + '/' if folder.strip('/') else ''
+        return [
+            (name[len(prefix):], member) for name, member in self.members.items()
+            if name.startswith(prefix) and name.lower().endswith(extensions)
+        ]
+
+    def read(self, name: str) -> bytes:
+        """Whole content of a member."""
+        member = self.member(name)
+        if name in self._small:
+            return self._small[name]
+        if member.stored or self._stream is not None:
+            return self._reader_at(member)(member.size, 0)
+        with self._zip.open(name) as f:
+            return f.read()
+
+    def open(self, name: str):
+        """Binary, seekable file object over a member."""
+        member = self.member(name)
+        if name in self._small:
+            return io.BytesIO(self._small[name])
+        if member.stored or self._stream is not None:
+            return io.BufferedReader(_MemberFile(self._reader_at(member), member.size), BUFFER_SIZE)
+        return self._zip.open(name)
+
+    def copy_to(self, name: str, destination) -> int:
+        """Writes the content of a member to the binary file `destination`, returns its size."""
+        member = self.member(name)
+        if member.stored and member.size >= MMAP_THRESHOLD:
+            # Straight from the page cache, without an intermediate buffer
+            with memoryview(self._map())[member.offset:member.offset + member.size] as view:
+                destination.write(view)
+            return member.size
+        with self.open(name) as f:
+            shutil.copyfileobj(f, destination)
+        return member.size
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._zip is not None:
+            self._zip.close()
+        if self._stream is not None:
+            self._stream.fileobj.close()
+            self._stream.close()
+        self._file.close()
+
+
+class _MemberFile(io.RawIOBase):
+    """Raw, seekable file over the `size` bytes of a member, read with `read_at(size, position)`."""
+
+    def __init__(self, read_at, size: int):
+        self.read_at = read_at
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.size
+        self.position = max(0, position)
+        return self.position
+
+    def readinto(self, buffer):
+        count = max(0, min(len(buffer), self.size - self.position))
+        if count == 0:
+            return 0
+        data = self.read_at(count, self.position)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+# -------------------------------------------------------
+# Path-level functions
+# -------------------------------------------------------
+
+def split_archive_path(path: str):
+    """
+    (archive file, member path inside it) when `path` is an archive or a path
+    inside one ('' is the root of the archive), None otherwise.
+    """
+    path = path.replace('\\', '/')
+    lower = path.lower()
+    for extension in ARCHIVE_EXTENSIONS:
+        start = 0
+        while True:
+            index = lower.find(extension, start)
+            if index < 0:
+                break
+            end = index + len(extension)
+            start = end
+            if end < len(path) and path[end] != '/':
+                continue
+            archive = path[:end]
+            if archive in _archives or os.path.isfile(archive):
+                return archive, path[end + 1:].strip('/')
+    return None
+
+
+def get_archive(archive_path: str) -> ArchiveReader:
+    """The open reader of an archive, opened (and indexed) on first use in this process."""
+    reader = _archives.get(archive_path)
+    if reader is None:
+        with _archives_lock:
+            reader = _archives.get(archive_path)
+            if reader is None:
+                reader = ArchiveReader(archive_path)
+                _archives[archive_path] = reader
+    return reader
+
+
+def _resolve(path: str):
+    """(reader, member name) of a path inside an archive, None for a regular path."""
+    location = split_archive_path(path)
+    if location is None:
+        return None
+    archive, name = location
+    return get_archive(archive), name
+
+
+def extracted_path(path: str) -> str:
+    """
+    The path `path` would have if its archive was extracted next to it (the
+    archive path without its extension). Regular paths are returned as they are.
+    Output folders of paths inside archives go there.
+    """
+    location = split_archive_path(path)
+    if location is None:
+        return path
+    archive, name = location
+    folder = archive[:-len(archive_extension(archive))]
+    return f'{folder}/{name}' if name else folder
+
+
+def open_binary(path: str):
+    """`open(path, 'rb')`, also for members of archives."""
+    resolved = _resolve(path)
+    if resolved is None:
+        return open(path, 'rb')
+    reader, name = resolved
+    return reader.open(name)
+
+
+def open_text(path: str, encoding: str = 'utf-8'):
+    """`open(path, 'r')`, also for members of archives."""
+    resolved = _resolve(path)
+    if resolved is None:
+        return open(path, 'r', encoding=encoding)
+    reader, name = resolved
+    return io.TextIOWrapper(reader.open(name), encoding=encoding)
+
+
+def read_bytes(path: str) -> bytes:
+    """Whole content of a file or archive member."""
+    resolved = _resolve(path)
+    if resolved is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    reader, name = resolved
+    return reader.read(name)
+
+
+def stat(path: str):
+    """`os.stat` of a file, `MemberStat` of an archive member (FileNotFoundError when missing)."""
+    resolved = _resolve(path)
+    if resolved is None:
+        return os.stat(path)
+    reader, name = resolved
+    return reader.stat(name)
+
+
+def isdir(path: str) -> bool:
+    """`os.path.isdir`, also for folders inside archives (an archive itself is a folder)."""
+    resolved = _resolve(path)
+    if resolved is None:
+        return os.path.isdir(path)
+    reader, name = resolved
+    return reader.isdir(name)
+
+
+def scan_tree(root: str, extensions: tuple) -> list:
+    """
+    Lists the members under the folder `root` of an archive whose lowercase
+    extension is in `extensions`.
+
+    Returns:
+        list: (relative path with '/' separators, path, `MemberStat`) tuples.
+    """
+    reader, folder = _resolve(root)
+    root = root.replace('\\', '/').rstrip('/')
+    return [
+        (rel_path, f'{root}/{rel_path}', MemberStat(member.size, member.mtime_ns, member.mtime_ns))
+        for rel_path, member in reader.scan(folder, extensions)
+    ]
+
+
+def copy_file(path: str, destination_path: str) -> int:
+    """Copies a file or archive member to `destination_path`, returns the number of bytes."""
+    resolved = _resolve(path)
+    if resolved is None:
+        shutil.copyfile(path, destination_path)
+        return os.path.getsize(destination_path)
+    reader, name = resolved
+    with open(destination_path, 'wb') as f:
+        return reader.copy_to(name, f)
+
+
+def sequential_order(paths: list):
+    """
+    Positions of `paths` in the order they are stored, when they are members of
+    a compressed tar (read them serially in that order: its stream can only be
+    read forward). None when they can be read in any order, by any number of
+    threads.
+    """
+    if not paths:
+        return None
+    resolved = _resolve(paths[0])
+    if resolved is None or not resolved[0].sequential:
+        return None
+    reader = resolved[0]
+
+    def order(position):
+        member = reader.members.get(_resolve(paths[position])[1])
+        return member.order if member is not None else -1
+
+    return sorted(range(len(paths)), key=order)
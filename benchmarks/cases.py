@@ -0,0 +1,151 @@
+"""
+Benchmark Cases
+
+One function per tool. Each runs in its own (spawned) process with the tool
+folder on `sys.path`, times the stages of the tool on a synthetic dataset, and
+returns the stage records (see `recorder.py`).
+"""
+
+import os
+import sys
+import json
+import shutil
+import logging
+import importlib.util
+
+from recorder import StageRecorder
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONVERTER_FOLDER = os.path.join(REPO_ROOT, 'coco_to_yolo_converter')
+HEALTH_FOLDER = os.path.join(REPO_ROOT, 'dataset_health_checker')
+
+
+def _load_tool_main(folder: str, module_name: str):
+    """Imports `<folder>/main.py` under `module_name` (both tools have a `main.py`)."""
+    sys.path.insert(0, folder)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(folder, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_converter_case(work_dir: str, images_folder: str, annotations_path: str, num_annotations: int,
+                       workers: int = 1) -> list:
+    """Stages of the COCO to YOLO converter: JSON parsing, label writing and end-to-end runs."""
+    os.chdir(work_dir)
+    converter = _load_tool_main(CONVERTER_FOLDER, 'converter_main')
+    from coco_stream import iter_coco_sections
+    from image_index import ImageIndex
+    from label_writer import LabelWriter
+    from conversion import ConversionStats, convert_annotation
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s',
+                        filename=os.path.join(work_dir, 'converter.log'), filemode='w')
+
+    recorder = StageRecorder('converter')
+    json_bytes = os.path.getsize(annotations_path)
+
+    with recorder.stage('parse_json', items=num_annotations, nbytes=json_bytes):
+        with open(annotations_path, 'r') as f:
+            annotations = json.load(f)
+
+    with recorder.stage('parse_streaming', items=num_annotations, nbytes=json_bytes):
+        for _ in iter_coco_sections(annotations_path):
+            pass
+
+    labels_folder = os.path.join(work_dir, 'converter_labels')
+    shutil.rmtree(labels_folder, ignore_errors=True)
+    os.makedirs(labels_folder)
+    image_index = ImageIndex(images_folder)
+    for image in annotations['images']:
+        image_index.add_coco_image(image)
+    with recorder.stage('write_labels', items=num_annotations):
+        stats = ConversionStats()
+        with LabelWriter(labels_folder) as writer:
+            for annotation in annotations['annotations']:
+                convert_annotation(annotation, image_index, writer, stats)
+    del annotations, image_index
+
+    runs = [('end_to_end', []), ('end_to_end_streaming', ['--streaming'])]
+    if workers > 1:
+        runs.append((f'end_to_end_workers_{workers}', ['--workers', str(workers)]))
+    for stage_name, extra in runs:
+        output_path = os.path.join(work_dir, 'converter_output')
+        shutil.rmtree(output_path, ignore_errors=True)
+        sys.argv = [
+            'main.py', '--images_folder', images_folder, '--annotations_path', annotations_path,
+            '--output_path', output_path, '--no_resume', '--no_size_cache',
+        ] + extra
+        with recorder.stage(stage_name, items=num_annotations, nbytes=json_bytes):
+            converter.main(converter.parse_args())
+    return recorder.records
+
+
+def run_health_case(work_dir: str, dataset_path: str, num_boxes: int, workers: int = 1) -> list:
+    """Stages of the dataset health checker: index, parse, heatmap, metrics, image stats, plotting, end-to-end."""
+    os.chdir(work_dir)
+    health = _load_tool_main(HEALTH_FOLDER, 'health_main')
+    import numpy as np
+    from dataset_index import index_split
+    from label_loader import load_labels
+    from heatmaps import center_heatmap, footprint_difference, integrate_footprint, DEFAULT_RESOLUTION
+    from aggregate import ShardSummary
+    from image_stats import collect_image_stats
+    from heatmap_png import save_heatmap_png
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        filename=os.path.join(work_dir, 'health.log'), filemode='w')
+
+    recorder = StageRecorder('health')
+    splits = [os.path.join(dataset_path, split_name) for split_name in ('train', 'val')]
+
+    with recorder.stage('index') as record:
+        indexes = [index_split(split_path) for split_path in splits]
+        record['items'] = sum(len(split_index.images) for split_index in indexes)
+
+    label_files = [label_file for split_index in indexes for label_file in split_index.label_files]
+    with recorder.stage('parse', items=len(label_files), nbytes=sum(f.size for f in label_files)):
+        boxes = load_labels([label_file.path for label_file in label_files]).boxes
+
+    with recorder.stage('heatmap', items=len(boxes)):
+        footprint = footprint_difference(boxes['xc'], boxes['yc'], boxes['w'], boxes['h'], DEFAULT_RESOLUTION)
+        heatmap_bboxes = integrate_footprint(footprint)
+        heatmap_centers = center_heatmap(boxes['xc'], boxes['yc'], DEFAULT_RESOLUTION)
+
+    with recorder.stage('metrics', items=len(boxes)):
+        summary = ShardSummary.from_boxes(boxes, [label_file.name for label_file in label_files], [], [], 10)
+        class_counts = summary.class_counts
+        health.compute_gini_index(class_counts)
+        health.compute_entropy_class_distribution(class_counts)
+        health.compute_std_class_counts(class_counts)
+        summary.moments.std()
+
+    images = [
+        os.path.join(split_path, 'images', image)
+        for split_path, split_index in zip(splits, indexes) for image in split_index.images
+    ]
+    with recorder.stage('image_stats', items=len(images)):
+        collect_image_stats(images)
+
+    plots_folder = os.path.join(work_dir, 'health_plots')
+    os.makedirs(plots_folder, exist_ok=True)
+    with recorder.stage('plotting', items=2):
+        health.save_heatmap_plot(heatmap_bboxes.astype(np.float32), 'BBox Heatmap', 'Number of bounding boxes',
+                                 os.path.join(plots_folder, 'heatmap_bboxes.png'))
+        health.save_heatmap_plot(heatmap_centers.astype(np.float32), 'Centers Heatmap', 'Number of centers',
+                                 os.path.join(plots_folder, 'heatmap_centers.png'))
+    with recorder.stage('plotting_fast', items=2):
+        save_heatmap_png(heatmap_bboxes, os.path.join(plots_folder, 'heatmap_bboxes_fast.png'), 'BBox Heatmap')
+        save_heatmap_png(heatmap_centers, os.path.join(plots_folder, 'heatmap_centers_fast.png'), 'Centers Heatmap')
+    del boxes
+
+    shutil.rmtree(os.path.join(dataset_path, 'health'), ignore_errors=True)
+    runs = [
+        ('end_to_end', False, 'matplotlib'),
+        ('end_to_end_cache_cold', True, 'matplotlib'),
+        ('end_to_end_cache_warm', True, 'matplotlib'),
+        ('end_to_end_fast_plots', True, 'fast'),
+        ('end_to_end_no_plots', True, 'none'),
+    ]
+    for stage_name, use_cache, plots in runs:
+        with recorder.stage(stage_name, items=num_boxes):
+            health.analyze_dataset(dataset_path, workers=workers, use_cache=use_cache, plots=plots)
+    return recorder.records
@@ -0,0 +1,145 @@
+"""
+Benchmark Suite
+
+Generates synthetic datasets (see `synthetic.py`) and times every stage of both
+tools on them (see `cases.py`): parsing, label writing, heatmaps, metrics,
+image stats, plotting and end-to-end runs, with their throughput and peak
+memory. Each tool runs in its own process, so peak memory is not shared.
+
+Every run appends one JSON line to the results file: the commit, the machine,
+the dataset configuration and one record per stage, so runs can be compared
+across commits. Everything runs offline; the `small` scale takes well under a
+minute on a laptop.
+
+--------------------------------------------------------------------
+Usage Example:
+    python main.py --scale small
+    python main.py --scale medium --workers 4 --output results.jsonl
+    python main.py --images 20000 --classes 10 --class-skew 0 --box-size small --only health
+--------------------------------------------------------------------
+"""
+
+import os
+import json
+import time
+import platform
+import argparse
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from synthetic import SyntheticConfig, generate_coco, generate_yolo, BOX_SIZE_MIX
+from cases import run_converter_case, run_health_case, REPO_ROOT
+
+SCALES = {
+    'tiny': dict(images=200, boxes_per_image=5.0, classes=10),
+    'small': dict(images=5_000, boxes_per_image=7.0, classes=80),
+    'medium': dict(images=50_000, boxes_per_image=7.0, classes=80),
+    'large': dict(images=200_000, boxes_per_image=7.3, classes=80),
+}
+TOOLS = ('converter', 'health')
+
+
+def git_commit():
+    """(commit hash, dirty flag) of the repository, (None, None) outside of git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run_in_child(function, *args) -> list:
+    """Runs a benchmark case in a fresh spawned process and returns its stage records."""
+    # Executor workers are not daemonic, so the tools can start their own pools
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(function, *args).result()
+
+
+def print_table(records: list):
+    header = f'{"tool":<10} {"stage":<28} {"seconds":>10} {"items/s":>14} {"MB/s":>10} {"peak MB":>10}'
+    print(header)
+    print('-' * len(header))
+    for r in records:
+        items_per_s = f'{r["items_per_s"]:,.0f}' if r.get('items_per_s') is not None else '-'
+        mb_per_s = f'{r["mb_per_s"]:.1f}' if r.get('mb_per_s') is not None else '-'
+        peak = f'{r["peak_rss_mb"]:.1f}' if r.get('peak_rss_mb') is not None else '-'
+        print(f'{r["tool"]:<10} {r["stage"]:<28} {r["seconds"]:>10.3f} {items_per_s:>14} {mb_per_s:>10} {peak:>10}')
+
+
+def main(args):
+    scale = dict(SCALES[args.scale])
+    for key in ('images', 'boxes_per_image', 'classes', 'class_skew', 'box_size', 'malformed_rate', 'seed'):
+        value = getattr(args, key)
+        if value is not None:
+            scale[key] = value
+    config = SyntheticConfig(**scale)
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+
+    records = []
+    generation = {}
+    if 'converter' in args.only:
+        start = time.perf_counter()
+        images_folder, annotations_path, num_annotations = generate_coco(work_dir, config)
+        generation['coco_seconds'] = round(time.perf_counter() - start, 3)
+        records += run_in_child(run_converter_case, work_dir, images_folder, annotations_path, num_annotations,
+                                args.workers)
+    if 'health' in args.only:
+        start = time.perf_counter()
+        dataset_path, num_boxes = generate_yolo(work_dir, config)
+        generation['yolo_seconds'] = round(time.perf_counter() - start, 3)
+        records += run_in_child(run_health_case, work_dir, dataset_path, num_boxes, args.workers)
+
+    commit, dirty = git_commit()
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'dirty': dirty,
+        'scale': args.scale,
+        'workers': args.workers,
+        'config': config.to_dict(),
+        'generation': generation,
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+        },
+        'stages': records,
+    }
+    with open(args.output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + '\n')
+    print_table(records)
+    print(f'Results appended to {args.output}')
+    return result
+
+
+# -------------------------------------------------------
+# Entry Point
+# -------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the converter and the health checker')
+    parser.add_argument('--scale', type=str, default='small', choices=list(SCALES),
+                        help='Size of the synthetic datasets (default: small)')
+    parser.add_argument('--images', type=int, help='Number of images (overrides the scale)')
+    parser.add_argument('--boxes-per-image', type=float, help='Mean number of boxes per image')
+    parser.add_argument('--classes', type=int, help='Number of classes')
+    parser.add_argument('--class-skew', type=float, help='Zipf exponent of the class frequencies (0 = uniform)')
+    parser.add_argument('--box-size', type=str, choices=list(BOX_SIZE_MIX), help='Box size distribution')
+    parser.add_argument('--malformed-rate', type=float, help='Share of malformed YOLO label lines')
+    parser.add_argument('--seed', type=int, help='Seed of the synthetic datasets')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes used by the tools in the end-to-end stages (default: 1)')
+    parser.add_argument('--only', type=str, nargs='+', default=list(TOOLS), choices=TOOLS,
+                        help='Tools to benchmark (default: both)')
+    parser.add_argument('--work-dir', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'work'),
+                        help='Folder of the generated datasets and tool outputs (datasets are reused across runs)')
+    parser.add_argument('--output', type=str, default='results.jsonl',
+                        help='JSON lines file the results are appended to (default: results.jsonl)')
+    main(parser.parse_args())
@@ -0,0 +1,51 @@
+"""
+Stage Recorder
+
+Times benchmark stages and records their throughput and peak memory.
+
+The peak resident set size of a stage is the process high-water mark
+(`VmHWM`), reset at the start of every stage on Linux (`/proc/self/clear_refs`).
+Elsewhere it falls back to `ru_maxrss`, the peak since the process started
+(each benchmark case runs in its own process, so it still isolates cases).
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'profiling'))
+from stage_profiler import peak_rss_mb, reset_peak_rss
+
+
+class StageRecorder:
+    """
+    Collects one record per stage: seconds, items, items/s, bytes, MB/s and peak RSS.
+
+    Usage:
+        recorder = StageRecorder('health')
+        with recorder.stage('parse', items=n_files, nbytes=total_size):
+            ...
+    """
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.records = []
+
+    @contextmanager
+    def stage(self, name: str, items: int = None, nbytes: int = None):
+        reset_peak_rss()
+        record = {'tool': self.tool, 'stage': name, 'items': items, 'bytes': nbytes}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            record['seconds'] = round(seconds, 6)
+            record['peak_rss_mb'] = peak_rss_mb()
+            # `items` and `bytes` may be filled in by the stage itself
+            if record['items'] is not None and seconds > 0:
+                record['items_per_s'] = round(record['items'] / seconds, 3)
+            if record['bytes'] is not None and seconds > 0:
+                record['mb_per_s'] = round(record['bytes'] / seconds / (1024 * 1024), 3)
+            self.records.append(record)
@@ -0,0 +1,226 @@
+"""
+Synthetic Datasets
+
+Generates reproducible COCO (JSON + images folder) and YOLO (`data.yaml`,
+`train/` and `val/` with `images/` and `labels/`) datasets at any scale, for
+the benchmarks of both tools. Everything is drawn from a seeded NumPy generator:
+- image sizes from a few common resolutions
+- boxes per image from a Poisson distribution
+- classes uniform or Zipf-like skewed (`class_skew`)
+- box sizes from a COCO-like small/medium/large mix or a single size band
+- optional malformed lines, empty label files and missing label files (YOLO)
+
+Images are minimal PNG files (signature, IHDR with the image size, IEND): they
+list, link and report their size like real images, without the disk cost.
+"""
+
+import os
+import json
+import zlib
+import struct
+import numpy as np
+
+RESOLUTIONS = np.array([(640, 480), (640, 427), (500, 375), (1280, 720), (1920, 1080)])
+# Side of the box relative to the image side, per size band
+BOX_SIZE_BANDS = {'small': (0.01, 0.06), 'medium': (0.06, 0.2), 'large': (0.2, 0.8)}
+# COCO has roughly 41% small, 34% medium and 25% large objects
+BOX_SIZE_MIX = {'coco': (0.41, 0.34, 0.25), 'small': (1, 0, 0), 'medium': (0, 1, 0), 'large': (0, 0, 1)}
+COMPLETE_MARKER = '.complete'
+
+
+class SyntheticConfig:
+    """
+    Scale and distributions of a synthetic dataset.
+
+    Attributes:
+        images (int): Number of images.
+        boxes_per_image (float): Mean of the Poisson number of boxes per image.
+        classes (int): Number of classes.
+        class_skew (float): Zipf exponent of the class frequencies (0 = uniform).
+        box_size (str): Size distribution, one of `BOX_SIZE_MIX`.
+        val_fraction (float): Share of the images in the YOLO `val` split.
+        malformed_rate (float): Share of YOLO label lines replaced by garbage.
+        empty_rate (float): Share of YOLO label files left empty.
+        missing_rate (float): Share of YOLO images without a label file.
+        seed (int): Seed of every random draw.
+    """
+
+    def __init__(self, images=1000, boxes_per_image=7.0, classes=80, class_skew=1.0, box_size='coco',
+                 val_fraction=0.2, malformed_rate=0.0, empty_rate=0.01, missing_rate=0.01, seed=0):
+        if box_size not in BOX_SIZE_MIX:
+            raise ValueError(f'Unknown box size distribution {box_size}, expected one of {list(BOX_SIZE_MIX)}')
+        self.images = images
+        self.boxes_per_image = boxes_per_image
+        self.classes = classes
+        self.class_skew = class_skew
+        self.box_size = box_size
+        self.val_fraction = val_fraction
+        self.malformed_rate = malformed_rate
+        self.empty_rate = empty_rate
+        self.missing_rate = missing_rate
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    def key(self) -> str:
+        """Short stable identifier of the configuration (names the generated folders)."""
+        digest = zlib.crc32(json.dumps(self.to_dict(), sort_keys=True).encode('utf-8'))
+        return f'{self.images}img_{digest:08x}'
+
+
+class SyntheticBoxes:
+    """Boxes of a synthetic dataset: image index, class id and normalized YOLO coordinates."""
+
+    def __init__(self, sizes, image, class_id, xc, yc, w, h):
+        self.sizes = sizes
+        self.image = image
+        self.class_id = class_id
+        self.xc = xc
+        self.yc = yc
+        self.w = w
+        self.h = h
+
+
+def generate_boxes(config: SyntheticConfig) -> SyntheticBoxes:
+    """Draws the image sizes and every box of the dataset."""
+    rng = np.random.default_rng(config.seed)
+    sizes = RESOLUTIONS[rng.integers(0, len(RESOLUTIONS), config.images)]
+    counts = rng.poisson(config.boxes_per_image, config.images)
+    image = np.repeat(np.arange(config.images), counts)
+    n = len(image)
+
+    weights = 1.0 / np.arange(1, config.classes + 1) ** config.class_skew
+    class_id = rng.choice(config.classes, size=n, p=weights / weights.sum())
+
+    bands = rng.choice(3, size=n, p=BOX_SIZE_MIX[config.box_size])
+    low = np.array([BOX_SIZE_BANDS[b][0] for b in ('small', 'medium', 'large')])[bands]
+    high = np.array([BOX_SIZE_BANDS[b][1] for b in ('small', 'medium', 'large')])[bands]
+    side = rng.uniform(low, high)
+    aspect = np.exp(rng.normal(0.0, 0.4, n))
+    w = np.clip(side * np.sqrt(aspect), 0.002, 1.0)
+    h = np.clip(side / np.sqrt(aspect), 0.002, 1.0)
+    # Centers keep the whole box inside the image
+    xc = rng.uniform(w / 2, 1 - w / 2)
+    yc = rng.uniform(h / 2, 1 - h / 2)
+    return SyntheticBoxes(sizes, image, class_id, xc, yc, w, h)
+
+
+def _png_header(width: int, height: int) -> bytes:
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IEND', b'')
+
+
+def _write_images(images_folder: str, file_names: list, sizes: np.ndarray):
+    os.makedirs(images_folder, exist_ok=True)
+    headers = {}
+    for file_name, (width, height) in zip(file_names, sizes.tolist()):
+        content = headers.get((width, height))
+        if content is None:
+            content = headers[(width, height)] = _png_header(width, height)
+        with open(os.path.join(images_folder, file_name), 'wb') as f:
+            f.write(content)
+
+
+def _is_complete(folder: str) -> bool:
+    return os.path.exists(os.path.join(folder, COMPLETE_MARKER))
+
+
+def _mark_complete(folder: str, config: SyntheticConfig):
+    with open(os.path.join(folder, COMPLETE_MARKER), 'w') as f:
+        json.dump(config.to_dict(), f)
+
+
+def generate_coco(root: str, config: SyntheticConfig):
+    """
+    Writes a COCO dataset under `root/coco_<key>/` (reused when already complete).
+
+    Returns:
+        tuple: (images folder, annotations JSON path, number of annotations).
+    """
+    folder = os.path.join(root, f'coco_{config.key()}')
+    images_folder = os.path.join(folder, 'images')
+    annotations_path = os.path.join(folder, 'annotations.json')
+    boxes = generate_boxes(config)
+    if _is_complete(folder):
+        return images_folder, annotations_path, len(boxes.image)
+
+    file_names = [f'{i:012d}.png' for i in range(config.images)]
+    _write_images(images_folder, file_names, boxes.sizes)
+
+    widths, heights = boxes.sizes[:, 0], boxes.sizes[:, 1]
+    img_w, img_h = widths[boxes.image], heights[boxes.image]
+    bw, bh = boxes.w * img_w, boxes.h * img_h
+    x0, y0 = boxes.xc * img_w - bw / 2, boxes.yc * img_h - bh / 2
+    coco = {
+        'info': {'description': 'synthetic benchmark dataset', **config.to_dict()},
+        'licenses': [],
+        'images': [
+            {'id': i + 1, 'file_name': file_names[i], 'width': int(widths[i]), 'height': int(heights[i])}
+            for i in range(config.images)
+        ],
+        'annotations': [
+            {'id': k + 1, 'image_id': int(i) + 1, 'category_id': int(c) + 1,
+             'bbox': [round(x, 2), round(y, 2), round(w, 2), round(h, 2)], 'area': round(w * h, 2), 'iscrowd': 0}
+            for k, (i, c, x, y, w, h) in enumerate(zip(
+                boxes.image.tolist(), boxes.class_id.tolist(), x0.tolist(), y0.tolist(), bw.tolist(), bh.tolist()
+            ))
+        ],
+        'categories': [{'id': c + 1, 'name': f'class_{c}', 'supercategory': 'synthetic'} for c in range(config.classes)],
+    }
+    with open(annotations_path, 'w') as f:
+        json.dump(coco, f)
+    _mark_complete(folder, config)
+    return images_folder, annotations_path, len(boxes.image)
+
+
+def generate_yolo(root: str, config: SyntheticConfig):
+    """
+    Writes a YOLO dataset under `root/yolo_<key>/` (reused when already complete).
+
+    Returns:
+        tuple: (dataset path, number of boxes).
+    """
+    folder = os.path.join(root, f'yolo_{config.key()}')
+    boxes = generate_boxes(config)
+    if _is_complete(folder):
+        return folder, len(boxes.image)
+
+    rng = np.random.default_rng([config.seed, 1])
+    is_val = rng.random(config.images) < config.val_fraction
+    missing = rng.random(config.images) < config.missing_rate
+    empty = rng.random(config.images) < config.empty_rate
+    malformed = rng.random(len(boxes.image)) < config.malformed_rate
+
+    lines = [
+        f'{c} {xc:.6f} {yc:.6f} {w:.6f} {h:.6f}\n' if not bad else f'{c} {xc:.6f} oops\n'
+        for c, xc, yc, w, h, bad in zip(
+            boxes.class_id.tolist(), boxes.xc.tolist(), boxes.yc.tolist(), boxes.w.tolist(), boxes.h.tolist(),
+            malformed.tolist()
+        )
+    ]
+    ends = np.cumsum(np.bincount(boxes.image, minlength=config.images)).tolist()
+
+    for split_name, in_split in (('train', ~is_val), ('val', is_val)):
+        ids = np.flatnonzero(in_split)
+        file_names = [f'{i:012d}.png' for i in ids.tolist()]
+        _write_images(os.path.join(folder, split_name, 'images'), file_names, boxes.sizes[ids])
+        labels_folder = os.path.join(folder, split_name, 'labels')
+        os.makedirs(labels_folder, exist_ok=True)
+        for i in ids.tolist():
+            if missing[i]:
+                continue
+            start = ends[i - 1] if i else 0
+            with open(os.path.join(labels_folder, f'{i:012d}.txt'), 'w') as f:
+                if not empty[i]:
+                    f.write(''.join(lines[start:ends[i]]))
+
+    with open(os.path.join(folder, 'data.yaml'), 'w') as f:
+        f.write('names:\n')
+        for c in range(config.classes):
+            f.write(f'- class_{c}\n')
+        f.write(f'nc: {config.classes}\n')
+    _mark_complete(folder, config)
+    return folder, len(boxes.image)
@@ -0,0 +1,120 @@
+"""
+incremental reader for COCO annotation json files.
+
+`json.load` materializes the whole file as python objects before anything can be done with it, which on
+instances_train2017.json (and bigger in-house exports) means several GB of dicts. this module walks the top level
+object by hand and decodes one element of each top level array at a time with the C json scanner, so memory is
+bounded by the size of the biggest single element instead of the size of the file.
+
+usage:
+```
+for section, item in iter_coco_sections('instances_train2017.json'):
+    if section == 'annotations':
+        ...
+```
+top level arrays (images, annotations, categories, licenses) are yielded element by element, any other top level
+value (info, ...) is yielded whole. the file can be a member of a zip or tar archive (`coco.zip/annotations/x.json`).
+"""
+
+import os
+import sys
+import json
+
+# archive members are read like files (shared with the health checker)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = ' \t\n\r'
+
+
+class _StreamReader:
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        # drop what was already consumed so the buffer never grows past the current element
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        data = self.f.read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f'Malformed COCO json: expected {char!r} but found {found!r}')
+        self.pos += 1
+
+    def decode_value(self):
+        self.peek()
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number (or literal) that ends exactly at the buffer end may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # grow the read size so huge elements are not re-scanned once per chunk
+            self._fill(read_size)
+            read_size *= 2
+
+
+def iter_coco_sections(annotations_path, chunk_size=CHUNK_SIZE):
+    """
+    yields (section, item) pairs from a COCO json file without loading it whole.
+    elements of top level arrays are yielded one by one, other top level values are yielded as they are.
+    """
+    with archive_reader.open_text(annotations_path) as f:
+        reader = _StreamReader(f, chunk_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            section = reader.decode_value()
+            reader.expect(':')
+            if reader.peek() == '[':
+                reader.pos += 1
+                if reader.peek() == ']':
+                    reader.pos += 1
+                else:
+                    while True:
+                        yield section, reader.decode_value()
+                        separator = reader.peek()
+                        reader.pos += 1
+                        if separator == ']':
+                            break
+                        if separator != ',':
+                            raise ValueError(f'Malformed COCO json: unexpected {separator!r} in "{section}"')
+            else:
+                yield section, reader.decode_value()
+
+            separator = reader.peek()
+            reader.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError(f'Malformed COCO json: unexpected {separator!r} after "{section}"')
@@ -0,0 +1,87 @@
+"""
+conversion of single COCO annotations to normalized YOLO boxes, shared by the sequential path of `main.py` and the
+shard workers of `sharding.py`.
+"""
+
+import logging
+from collections import Counter
+
+
+def annotation_to_yolo_box(annotation, image_index):
+    """
+    converts a single COCO annotation to a normalized YOLO box (class id, x_center, y_center, width, height), returns
+    None if the image size can not be found
+    """
+    image_id = annotation['image_id']
+    image_name = image_index.file_name(image_id)
+    logging.debug(f'Processing image {image_name}')
+
+    category_id = annotation['category_id']
+    bbox = annotation['bbox']
+
+    # normalize the values
+    width, height = bbox[2], bbox[3]
+    x_center = bbox[0] + width / 2
+    y_center = bbox[1] + height / 2
+
+    # get the image size from the annotation, the images table or (once per image) the image header
+    image_width, image_height = 0, 0
+    try:
+        image_width, image_height = annotation['width'], annotation['height']
+    except:
+        size = image_index.size(image_id)
+        if size is not None:
+            image_width, image_height = size
+        else:
+            logging.info(f'Could not find image width and height for image {image_name} in the annotation file')
+            logging.error(f'Could not find image width and height for image {image_name}')
+            logging.error(f'Skipping this image: {image_name}')
+            return None
+
+    x_center /= image_width
+    y_center /= image_height
+    width /= image_width
+    height /= image_height
+
+    return category_id, x_center, y_center, width, height
+
+
+
+class ConversionStats:
+    """counters of a conversion run, stats of different shards are combined with `merge`"""
+
+    def __init__(self):
+        self.annotations = 0
+        self.converted = 0
+        self.class_counts = Counter()
+        self.skipped_images = set()
+
+    def merge(self, other):
+        self.annotations += other.annotations
+        self.converted += other.converted
+        self.class_counts.update(other.class_counts)
+        self.skipped_images.update(other.skipped_images)
+        return self
+
+    def log_summary(self, elapsed):
+        rate = self.annotations / elapsed if elapsed > 0 else 0.0
+        logging.info(f'Annotations processed: {self.annotations} ({self.converted} converted)')
+        logging.info(f'Images skipped (size not found): {len(self.skipped_images)}')
+        logging.info(f'Instances per category: {dict(sorted(self.class_counts.items()))}')
+        logging.info(f'Throughput: {rate:.1f} annotations/s ({elapsed:.2f}s)')
+
+
+def convert_annotation(annotation, image_index, writer, stats, tracker=None):
+    image_id = annotation['image_id']
+    label_name = image_index.label_name(image_id)
+    box = annotation_to_yolo_box(annotation, image_index)
+    if tracker is not None:
+        tracker.update(label_name, annotation, box is not None)
+    stats.annotations += 1
+    if box is None:
+        stats.skipped_images.add(image_id)
+    else:
+        stats.converted += 1
+        stats.class_counts[annotation['category_id']] += 1
+    # the label file is created even when the annotation has to be skipped
+    writer.add(label_name, box)
@@ -0,0 +1,39 @@
+"""
+exports the binary label store written by main.py (`--label_format bin`) back to standard YOLO txt label files, one
+per image in the format: class x_center y_center width height, for the training tools that only read those.
+
+usage:
+```
+python export_labels.py --store_path yolo/label_store --labels_path yolo/labels
+```
+"""
+
+import os
+import time
+import argparse
+import logging
+
+from label_store import export_txt
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export a binary label store to YOLO txt label files')
+    parser.add_argument('--store_path', type=str, help='path to the label store folder (<output_path>/label_store of the converter)', required=True)
+    parser.add_argument('--labels_path', type=str, help='path to the folder the label files are written to (default: labels next to the store)', default=None)
+    return parser.parse_args()
+
+
+def main(args):
+    store_path = args.store_path.replace('\\', '/').rstrip('/')
+    labels_path = (args.labels_path or os.path.join(os.path.dirname(store_path), 'labels')).replace('\\', '/')
+    logging.info(f'Store path: {store_path}')
+    logging.info(f'Labels path: {labels_path}')
+    start = time.perf_counter()
+    label_files, boxes = export_txt(store_path, labels_path)
+    logging.info(f'Exported {label_files} label files ({boxes} boxes) in {time.perf_counter() - start:.2f}s')
+    print(f'Exported {label_files} label files ({boxes} boxes) to {labels_path}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s', filename='main.log', filemode='a')
+    main(parse_args())
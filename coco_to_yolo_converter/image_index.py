@@ -0,0 +1,135 @@
+"""
+image size index for the COCO -> YOLO conversion.
+
+the index is built once from the `images` table of the COCO file (id -> width, height, file_name), so the size of an
+image is never looked up per annotation. images that are not in the table (or have no width/height there) are
+resolved by reading only the image header with PIL, once per image and in a thread pool.
+
+sizes read from image headers can be cached on disk. the cache is keyed on the annotation file (size and mtime) and
+the images folder, so repeated conversions of the same annotation file skip all image I/O.
+
+the images folder (and the annotation file) can be inside a zip or tar archive, see `archives/archive_reader.py`.
+"""
+
+import os
+import sys
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+# archive members are read like files (shared with the health checker)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+DEFAULT_HEADER_WORKERS = 8
+
+
+def read_image_size(image_path):
+    """reads (width, height) from the image header, PIL does not decode the pixels until they are accessed"""
+    try:
+        with archive_reader.open_binary(image_path) as f, Image.open(f) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+class ImageIndex:
+    def __init__(self, images_folder, header_workers=DEFAULT_HEADER_WORKERS):
+        self.images_folder = images_folder
+        self.header_workers = header_workers
+        # image_id -> (width, height, file_name), width/height may be None
+        self.images = {}
+        # image_id -> (width, height) or None, sizes that were read from the image headers
+        self.header_sizes = {}
+        self.cache_hits = 0
+
+    def add_coco_image(self, image):
+        self.images[image['id']] = (image.get('width'), image.get('height'), image.get('file_name'))
+
+    def file_name(self, image_id):
+        entry = self.images.get(image_id)
+        if entry is not None and entry[2]:
+            return entry[2]
+        # the image name MUST have 12 characters, so it will be left padded with zeros
+        return f'{image_id}'.zfill(12) + '.jpg'
+
+    def label_name(self, image_id):
+        return os.path.splitext(self.file_name(image_id))[0] + '.txt'
+
+    def image_path(self, image_id):
+        # path join with /
+        return os.path.join(self.images_folder, self.file_name(image_id)).replace('\\', '/')
+
+    def _table_size(self, image_id):
+        entry = self.images.get(image_id)
+        if entry is not None and entry[0] and entry[1]:
+            return entry[0], entry[1]
+        return None
+
+    def size(self, image_id):
+        """(width, height) of the image, or None if it can not be found"""
+        size = self._table_size(image_id)
+        if size is not None:
+            return size
+        if image_id not in self.header_sizes:
+            self.header_sizes[image_id] = read_image_size(self.image_path(image_id))
+        return self.header_sizes[image_id]
+
+    def missing_sizes(self, image_ids=None):
+        """ids (from the table, or from `image_ids`) whose size is neither in the table nor already read"""
+        candidates = self.images.keys() if image_ids is None else image_ids
+        return [
+            image_id for image_id in candidates
+            if image_id not in self.header_sizes and self._table_size(image_id) is None
+        ]
+
+    def prefetch(self, image_ids):
+        """reads the headers of `image_ids` in a thread pool, each image is read at most once"""
+        image_ids = list(dict.fromkeys(image_ids))
+        if not image_ids:
+            return
+        logging.info(f'Reading image headers for {len(image_ids)} images without size in the annotation file')
+        paths = [self.image_path(image_id) for image_id in image_ids]
+        order = archive_reader.sequential_order(paths)
+        if order is not None:
+            # a compressed tar stream only reads forward: one pass, in archive order
+            for position in order:
+                self.header_sizes[image_ids[position]] = read_image_size(paths[position])
+            return
+        with ThreadPoolExecutor(max_workers=self.header_workers) as executor:
+            for image_id, size in zip(image_ids, executor.map(read_image_size, paths)):
+                self.header_sizes[image_id] = size
+
+    def _cache_key(self, annotations_path):
+        stat = archive_reader.stat(annotations_path)
+        return {
+            'annotations_path': os.path.abspath(annotations_path),
+            'annotations_size': stat.st_size,
+            'annotations_mtime_ns': stat.st_mtime_ns,
+            'images_folder': os.path.abspath(self.images_folder),
+        }
+
+    def load_cache(self, cache_path, annotations_path):
+        if not os.path.exists(cache_path):
+            return
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f'Ignoring unreadable image size cache {cache_path}: {e}')
+            return
+        if cache.get('key') != self._cache_key(annotations_path):
+            logging.info('Image size cache is stale, it will be rebuilt')
+            return
+        for image_id, size in cache['sizes']:
+            self.header_sizes[image_id] = tuple(size)
+        self.cache_hits = len(cache['sizes'])
+        logging.info(f'Loaded {self.cache_hits} image sizes from {cache_path}')
+
+    def save_cache(self, cache_path, annotations_path):
+        # only sizes that were actually found are cached, missing images are looked up again on the next run
+        sizes = [[image_id, list(size)] for image_id, size in self.header_sizes.items() if size is not None]
+        with open(cache_path, 'w') as f:
+            json.dump({'key': self._cache_key(annotations_path), 'sizes': sizes}, f)
+        logging.info(f'Saved {len(sizes)} image sizes to {cache_path}')
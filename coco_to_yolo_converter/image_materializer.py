@@ -0,0 +1,192 @@
+"""
+populates the `images/` output folder with the cheapest strategy the filesystem allows.
+
+strategies, tried in this order with `auto`:
+1. hardlink: no data is moved at all (only works on the same filesystem)
+2. reflink: copy-on-write clone (btrfs, xfs, apfs...), through the FICLONE ioctl or `os.copy_file_range`, which lets
+   the kernel (or an nfs 4.2 server) copy without going through user space
+3. copy: buffered copy with `shutil.copyfile`
+
+a strategy that fails once with an error meaning "not supported here" is not tried again for the rest of the run. the
+copies run in a thread pool, files whose destination is already up to date (same inode, or same size and mtime) are
+skipped.
+
+images inside a zip or tar archive can not be linked, they are extracted one by one (large uncompressed members
+straight from a memory map of the archive). members of a compressed tar are extracted by one thread in archive order,
+its stream only reads forward.
+"""
+
+import os
+import sys
+import time
+import errno
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+# archive members are read like files (shared with the health checker)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+STRATEGIES = ('auto', 'hardlink', 'reflink', 'copy', 'none')
+DEFAULT_COPY_WORKERS = 8
+
+# linux ioctl number of FICLONE (_IOW(0x94, 9, int))
+_FICLONE = 0x40049409
+# errors that mean the strategy is not available for this pair of folders, not that this file failed
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EMLINK,
+    getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP),
+}
+
+
+def _hardlink(src, dst, src_stat):
+    os.link(src, dst)
+    return 0
+
+
+def _reflink(src, dst, src_stat):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                # a clone shares the data blocks, nothing is moved
+                return 0
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+        if not hasattr(os, 'copy_file_range'):
+            raise OSError(errno.ENOSYS, 'copy_file_range is not available')
+        remaining = src_stat.st_size
+        while remaining > 0:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+    return src_stat.st_size
+
+
+def _copy(src, dst, src_stat):
+    shutil.copyfile(src, dst)
+    return src_stat.st_size
+
+
+_METHODS = {'hardlink': _hardlink, 'reflink': _reflink, 'copy': _copy}
+
+
+def _is_up_to_date(src_stat, dst):
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    # archive members have no inode
+    if hasattr(src_stat, 'st_ino') and (dst_stat.st_dev, dst_stat.st_ino) == (src_stat.st_dev, src_stat.st_ino):
+        return True
+    return dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+
+class ImageMaterializer:
+    def __init__(self, output_folder, strategy='auto', workers=DEFAULT_COPY_WORKERS):
+        if strategy not in STRATEGIES:
+            raise ValueError(f'Unknown image strategy {strategy}, expected one of {STRATEGIES}')
+        self.output_folder = output_folder
+        self.workers = workers
+        self.candidates = ['hardlink', 'reflink', 'copy'] if strategy == 'auto' else [strategy]
+        self.lock = threading.Lock()
+        self.counts = {'hardlink': 0, 'reflink': 0, 'copy': 0, 'extract': 0, 'up_to_date': 0, 'missing': 0, 'failed': 0}
+        self.bytes_moved = 0
+        self.bytes_materialized = 0
+
+    def _disable(self, method, error):
+        with self.lock:
+            if method in self.candidates and len(self.candidates) > 1:
+                self.candidates.remove(method)
+                logging.info(f'Image strategy {method} not available here ({error}), falling back to {self.candidates[0]}')
+
+    def _materialize_or_log(self, src, dst):
+        try:
+            return self._materialize(src, dst)
+        except OSError as e:
+            logging.error(f'Could not materialize {src} -> {dst}: {e}')
+            return 'failed', 0, 0
+
+    def _link_or_copy(self, src, tmp, src_stat):
+        while True:
+            method = self.candidates[0]
+            try:
+                return method, _METHODS[method](src, tmp, src_stat)
+            except OSError as e:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                if e.errno in _UNSUPPORTED_ERRNOS and method != 'copy':
+                    self._disable(method, e)
+                    if self.candidates[0] != method:
+                        continue
+                raise
+
+    @staticmethod
+    def _extract(src, tmp):
+        # members of an archive can not be linked
+        try:
+            return archive_reader.copy_file(src, tmp)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _materialize(self, src, dst):
+        try:
+            src_stat = archive_reader.stat(src)
+        except FileNotFoundError:
+            logging.debug(f'Image not found: {src}')
+            return 'missing', 0, 0
+        if _is_up_to_date(src_stat, dst):
+            return 'up_to_date', 0, 0
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        # written under a temporary name and renamed, so an interrupted copy never looks up to date
+        tmp = f'{dst}.tmp{threading.get_ident()}'
+        if archive_reader.split_archive_path(src) is not None:
+            method, moved = 'extract', self._extract(src, tmp)
+        else:
+            method, moved = self._link_or_copy(src, tmp, src_stat)
+        if method != 'hardlink':
+            os.utime(tmp, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        os.replace(tmp, dst)
+        return method, moved, src_stat.st_size
+
+    def materialize(self, file_names, images_folder):
+        """links or copies `images_folder/<file_name>` to `output_folder/<file_name>` for every file name"""
+        start = time.perf_counter()
+        jobs = [
+            (os.path.join(images_folder, file_name), os.path.join(self.output_folder, file_name))
+            for file_name in file_names
+        ]
+        workers = self.workers
+        order = archive_reader.sequential_order([src for src, _ in jobs])
+        if order is not None:
+            jobs, workers = [jobs[position] for position in order], 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = executor.map(lambda job: self._materialize_or_log(*job), jobs)
+            for outcome, moved, size in tqdm(futures, total=len(jobs), desc='Materializing images', unit='img'):
+                self.counts[outcome] += 1
+                self.bytes_moved += moved
+                self.bytes_materialized += size
+        self.log_summary(time.perf_counter() - start)
+
+    def log_summary(self, elapsed):
+        mb_moved = self.bytes_moved / (1024 * 1024)
+        rate = mb_moved / elapsed if elapsed > 0 else 0.0
+        logging.info(f'Images: {self.counts}')
+        logging.info(f'Image bytes materialized: {self.bytes_materialized / (1024 * 1024):.1f} MB, '
+                     f'moved: {mb_moved:.1f} MB in {elapsed:.2f}s ({rate:.1f} MB/s)')
+        if self.counts['missing']:
+            logging.warning(f'{self.counts["missing"]} images listed in the annotations were not found')
+        if self.counts['failed']:
+            logging.error(f'{self.counts["failed"]} images could not be materialized')
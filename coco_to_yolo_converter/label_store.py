@@ -0,0 +1,267 @@
+"""
+binary label store, a packed alternative to one txt label file per image (`--label_format bin` or `both`).
+
+the label files are grouped into `num_shards` shard files by a stable hash of their name, so a dataset of hundreds of
+thousands of images is a handful of files instead of as many inodes, and readers get the boxes as fixed-width records
+instead of parsing text. `<store>/shard_XXXX.bin` layout (little endian):
+- header (`HEADER`): magic, version, record size, number of label files, number of boxes, size of the names block
+- image offset index: number of label files + 1 uint64, the boxes of the i-th label file are the records
+  `offsets[i]:offsets[i + 1]` (an empty label file has no records)
+- records (`RECORD`): class id int32, x_center, y_center, width, height float32, in label file order and in line
+  order within a label file
+- names block: the label file names (relative to the labels folder, utf-8), one per line, sorted
+
+`<store>/store.json` (version, number of shards, label files, boxes) is written last, a store without it is incomplete.
+the coordinates are rounded to float32 (7 significant digits, far below a pixel), `export_txt` writes them back as
+standard YOLO label files with the shortest decimal that round-trips.
+
+the writer spills the records of each shard to `<store>/.parts/part_XXXX/` (one part per conversion process, the shard
+workers of `sharding.py` write their own), `finalize_store` then merges the parts into the shard files. every label
+file is written by a single part, so the store does not depend on the number of workers.
+"""
+
+import os
+import json
+import glob
+import mmap
+import shutil
+import struct
+import zlib
+import logging
+
+from label_writer import DEFAULT_MAX_BUFFERED_ANNOTATIONS
+
+STORE_FOLDER = 'label_store'
+STORE_META = 'store.json'
+STORE_VERSION = 1
+DEFAULT_STORE_SHARDS = 16
+
+MAGIC = b'YOLOLBL\0'
+# magic, version, record size, label files, boxes, names block size
+HEADER = struct.Struct('<8sIIQQQ')
+# class id, x_center, y_center, width, height
+RECORD = struct.Struct('<iffff')
+# spilled records are prefixed with the id of their label file within the part shard
+_SPILL = struct.Struct('<I')
+_FLOAT32 = struct.Struct('<f')
+
+
+def store_shard_of(label_name, num_shards):
+    """stable shard of a label file, from its name relative to the labels folder"""
+    return zlib.crc32(label_name.encode('utf-8')) % num_shards
+
+
+def shard_path(store_folder, shard):
+    return os.path.join(store_folder, f'shard_{shard:04d}.bin')
+
+
+def shard_layout(num_images, num_boxes):
+    """byte offsets of the image offset index, the records and the names block of a shard file"""
+    offsets_start = HEADER.size
+    records_start = offsets_start + 8 * (num_images + 1)
+    names_start = records_start + RECORD.size * num_boxes
+    return offsets_start, records_start, names_start
+
+
+def read_header(data, path=''):
+    """(label files, boxes, names block size) from the start of a shard file, raises ValueError on anything else"""
+    if len(data) < HEADER.size:
+        raise ValueError(f'{path} is not a label store shard (truncated header)')
+    magic, version, record_size, num_images, num_boxes, names_size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != STORE_VERSION or record_size != RECORD.size:
+        raise ValueError(f'{path} is not a label store shard of version {STORE_VERSION}')
+    if len(data) < shard_layout(num_images, num_boxes)[2] + names_size:
+        raise ValueError(f'{path} is truncated')
+    return num_images, num_boxes, names_size
+
+
+def load_meta(store_folder):
+    """the `store.json` of a complete store, None when the store is missing or incomplete"""
+    try:
+        with open(os.path.join(store_folder, STORE_META), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != STORE_VERSION:
+        return None
+    return meta
+
+
+def reset_store(store_folder):
+    """marks the store incomplete and removes its shard files and spilled parts, before a new conversion"""
+    os.makedirs(store_folder, exist_ok=True)
+    if os.path.exists(os.path.join(store_folder, STORE_META)):
+        os.remove(os.path.join(store_folder, STORE_META))
+    for path in glob.glob(os.path.join(glob.escape(store_folder), 'shard_*')):
+        os.remove(path)
+    shutil.rmtree(os.path.join(store_folder, '.parts'), ignore_errors=True)
+
+
+class LabelStoreWriter:
+    """
+    same interface as `LabelWriter`, but the boxes are packed into the spill files of one part of the store.
+
+    the spill files of a part shard are `shard_XXXX.rec` (label file id + record) and `shard_XXXX.names` (the label
+    files in id order, a label file is listed even when it gets no box).
+    """
+
+    def __init__(self, store_folder, num_shards=DEFAULT_STORE_SHARDS, part=0,
+                 max_buffered_annotations=DEFAULT_MAX_BUFFERED_ANNOTATIONS):
+        self.num_shards = num_shards
+        self.max_buffered_annotations = max_buffered_annotations
+        self.part_folder = os.path.join(store_folder, '.parts', f'part_{part:04d}')
+        # label file name -> id, per shard
+        self.ids = [{} for _ in range(num_shards)]
+        self.new_names = [[] for _ in range(num_shards)]
+        self.records = [bytearray() for _ in range(num_shards)]
+        self.buffered = 0
+        self.boxes = 0
+
+    def add(self, label_name, box):
+        """buffers a (class id, x_center, y_center, width, height) box for `label_name`, None only lists the file"""
+        shard = store_shard_of(label_name, self.num_shards)
+        ids = self.ids[shard]
+        label_id = ids.get(label_name)
+        if label_id is None:
+            label_id = ids[label_name] = len(ids)
+            self.new_names[shard].append(label_name)
+        if box is not None:
+            self.records[shard] += _SPILL.pack(label_id) + RECORD.pack(*box)
+            self.boxes += 1
+        self.buffered += 1
+        if self.buffered >= self.max_buffered_annotations:
+            self.flush()
+
+    def flush(self):
+        if self.buffered == 0:
+            return
+        os.makedirs(self.part_folder, exist_ok=True)
+        for shard in range(self.num_shards):
+            names, records = self.new_names[shard], self.records[shard]
+            if not names and not records:
+                continue
+            base = os.path.join(self.part_folder, f'shard_{shard:04d}')
+            if names:
+                with open(base + '.names', 'a', encoding='utf-8', newline='\n') as f:
+                    f.write(''.join(f'{name}\n' for name in names))
+            if records:
+                with open(base + '.rec', 'ab') as f:
+                    f.write(records)
+            self.new_names[shard] = []
+            self.records[shard] = bytearray()
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        label_files = sum(len(ids) for ids in self.ids)
+        logging.info(f'Spilled {self.boxes} boxes of {label_files} label files to the label store')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _read_part_shard(base):
+    """(label file names in id order, spilled bytes) of one part shard"""
+    names, spilled = [], b''
+    if os.path.exists(base + '.names'):
+        with open(base + '.names', 'r', encoding='utf-8', newline='\n') as f:
+            names = f.read().split('\n')[:-1]
+    if os.path.exists(base + '.rec'):
+        with open(base + '.rec', 'rb') as f:
+            spilled = f.read()
+    return names, spilled
+
+
+def _replace_file(path, chunks):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+def finalize_store(store_folder, num_shards=DEFAULT_STORE_SHARDS):
+    """merges the spilled parts into the shard files and writes `store.json`, returns (label files, boxes)"""
+    part_folders = sorted(glob.glob(os.path.join(glob.escape(store_folder), '.parts', 'part_*')))
+    entry_size = _SPILL.size + RECORD.size
+    total_images, total_boxes = 0, 0
+    for shard in range(num_shards):
+        # label file name -> packed records, the parts hold disjoint label files
+        grouped = {}
+        for part_folder in part_folders:
+            names, spilled = _read_part_shard(os.path.join(part_folder, f'shard_{shard:04d}'))
+            for name in names:
+                grouped.setdefault(name, bytearray())
+            view = memoryview(spilled)
+            for start in range(0, len(spilled), entry_size):
+                label_id = _SPILL.unpack_from(view, start)[0]
+                grouped[names[label_id]] += view[start + _SPILL.size:start + entry_size]
+
+        names = sorted(grouped)
+        offsets = [0]
+        for name in names:
+            offsets.append(offsets[-1] + len(grouped[name]) // RECORD.size)
+        names_block = ''.join(f'{name}\n' for name in names).encode('utf-8')
+        header = HEADER.pack(MAGIC, STORE_VERSION, RECORD.size, len(names), offsets[-1], len(names_block))
+        _replace_file(shard_path(store_folder, shard), [
+            header, struct.pack(f'<{len(offsets)}Q', *offsets), *(grouped[name] for name in names), names_block,
+        ])
+        total_images += len(names)
+        total_boxes += offsets[-1]
+
+    shutil.rmtree(os.path.join(store_folder, '.parts'), ignore_errors=True)
+    meta = {'version': STORE_VERSION, 'shards': num_shards, 'label_files': total_images, 'boxes': total_boxes}
+    tmp_path = os.path.join(store_folder, STORE_META + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(store_folder, STORE_META))
+    return total_images, total_boxes
+
+
+def iter_store(store_folder):
+    """yields (label file name, list of (class id, x_center, y_center, width, height)) for every label file"""
+    meta = load_meta(store_folder)
+    if meta is None:
+        raise ValueError(f'{store_folder} is not a complete label store')
+    for shard in range(meta['shards']):
+        path = shard_path(store_folder, shard)
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            num_images, num_boxes, names_size = read_header(data, path)
+            offsets_start, records_start, names_start = shard_layout(num_images, num_boxes)
+            offsets = struct.unpack_from(f'<{num_images + 1}Q', data, offsets_start)
+            names = data[names_start:names_start + names_size].decode('utf-8').split('\n')[:-1]
+            for i, name in enumerate(names):
+                start = records_start + offsets[i] * RECORD.size
+                end = records_start + offsets[i + 1] * RECORD.size
+                yield name, list(RECORD.iter_unpack(data[start:end]))
+
+
+def format_float32(value):
+    """shortest decimal that reads back as the same float32"""
+    for digits in range(6, 10):
+        text = f'{value:.{digits}g}'
+        if _FLOAT32.unpack(_FLOAT32.pack(float(text)))[0] == value:
+            return text
+    return repr(value)
+
+
+def export_txt(store_folder, labels_folder):
+    """writes every label file of the store as a standard YOLO txt file, returns (label files, boxes)"""
+    folders = set()
+    images, boxes = 0, 0
+    for label_name, records in iter_store(store_folder):
+        # label names may contain sub folders
+        folder = os.path.dirname(label_name)
+        if folder not in folders:
+            os.makedirs(os.path.join(labels_folder, folder), exist_ok=True)
+            folders.add(folder)
+        with open(os.path.join(labels_folder, label_name), 'w') as f:
+            f.write(''.join(
+                f'{class_id} {" ".join(format_float32(v) for v in coords)}\n' for class_id, *coords in records
+            ))
+        images += 1
+        boxes += len(records)
+    return images, boxes
@@ -0,0 +1,100 @@
+"""
+group-by-image writer for YOLO label files.
+
+COCO stores the annotations of an image scattered all over the annotations array, so writing them as they come means
+one open/append/close per annotation. `LabelWriter` buffers the lines of each label file in memory and writes every
+file with a single buffered write when flushed.
+
+- the first write of a file during a run truncates it, so rerunning into an existing output folder does not duplicate
+  lines
+- once `max_buffered_annotations` annotations are buffered everything is flushed, so memory stays bounded on datasets
+  where grouping all of them would not fit. files that receive more lines after a flush are appended to, so the final
+  content is the same as if everything had been grouped at once
+- `on_flush` is called with the names of the files written by each flush (used to checkpoint the manifest)
+
+`WriterGroup` fans the boxes out to several writers, the label files and the binary label store (see `label_store.py`).
+"""
+
+import os
+import logging
+
+DEFAULT_MAX_BUFFERED_ANNOTATIONS = 1_000_000
+
+
+def yolo_line(box):
+    """label file line of a (class id, x_center, y_center, width, height) box"""
+    category_id, x_center, y_center, width, height = box
+    return f'{category_id} {x_center} {y_center} {width} {height}\n'
+
+
+class LabelWriter:
+    def __init__(self, labels_folder, max_buffered_annotations=DEFAULT_MAX_BUFFERED_ANNOTATIONS, on_flush=None):
+        self.labels_folder = labels_folder
+        self.max_buffered_annotations = max_buffered_annotations
+        self.on_flush = on_flush
+        self.buffers = {}
+        self.buffered = 0
+        # label files already written during this run, later flushes append to them instead of truncating
+        self.written = set()
+        self.flushes = 0
+        self.folders = set()
+
+    def add(self, label_name, box):
+        """buffers the line of a box for `label_name`, None only makes sure the (possibly empty) file is created"""
+        lines = self.buffers.setdefault(label_name, [])
+        if box is not None:
+            lines.append(yolo_line(box))
+        self.buffered += 1
+        if self.buffered >= self.max_buffered_annotations:
+            self.flush()
+
+    def flush(self):
+        if not self.buffers:
+            return
+        logging.debug(f'Flushing {len(self.buffers)} label files ({self.buffered} annotations)')
+        for label_name, lines in self.buffers.items():
+            mode = 'a' if label_name in self.written else 'w'
+            # COCO file names may contain sub folders
+            folder = os.path.dirname(label_name)
+            if folder and folder not in self.folders:
+                os.makedirs(os.path.join(self.labels_folder, folder), exist_ok=True)
+                self.folders.add(folder)
+            with open(os.path.join(self.labels_folder, label_name), mode) as f:
+                f.write(''.join(lines))
+            self.written.add(label_name)
+        if self.on_flush is not None:
+            self.on_flush(list(self.buffers))
+        self.buffers = {}
+        self.buffered = 0
+        self.flushes += 1
+
+    def close(self):
+        self.flush()
+        logging.info(f'Wrote {len(self.written)} label files in {self.flushes} flush(es)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class WriterGroup:
+    """passes every box to each of `writers`, and closes them together"""
+
+    def __init__(self, writers):
+        self.writers = writers
+
+    def add(self, label_name, box):
+        for writer in self.writers:
+            writer.add(label_name, box)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,7 +1,13 @@
 """
 reads on args the path for a coco dataset image folder and its correspondending annotation json file and converts it to the YOLO format:
-- a folder with the images
+- a folder with the images (hardlinked, reflinked or copied, see --image_mode)
 - a txt file for each image with the annotations in the format: class x_center y_center width heigh
+- and/or (see --label_format) a binary label store in label_store/: the boxes of every image packed into a few shard
+  files of fixed-width records (see label_store.py), read by the health checker without parsing, and exported back
+  to txt files with export_labels.py
+the images folder and the annotation file can be read straight from a zip, tar or tar.gz archive, a path inside an
+archive is written as if the archive was a folder (e.g. `--images_folder coco.zip/train2017`), nothing is extracted
+but the images materialized in the output folder.
 it will also create a yaml file with the classes names at the output folder with the following format:
 
 yaml file example:
@@ -21,24 +27,76 @@ nc: 7
 import os
 import sys
 import json
+import time
 import argparse
 import logging
 from tqdm import tqdm
-from PIL import Image
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s', filename='main.log', filemode='w')
+from coco_stream import iter_coco_sections
+from label_writer import LabelWriter, WriterGroup, DEFAULT_MAX_BUFFERED_ANNOTATIONS
+from label_store import STORE_FOLDER, DEFAULT_STORE_SHARDS, LabelStoreWriter, load_meta, reset_store, finalize_store
+from image_index import ImageIndex, DEFAULT_HEADER_WORKERS
+from conversion import ConversionStats, convert_annotation
+from sharding import ShardSpiller, run_shards
+from image_materializer import ImageMaterializer, STRATEGIES, DEFAULT_COPY_WORKERS
+from manifest import MANIFEST_NAME, Manifest, DigestTracker, hash_file, compute_digests
 
+# stage timers and profiling hooks shared with the other tools
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'profiling'))
+from stage_profiler import StageProfiler, PROFILERS, peak_rss_mb
+
+# archive members are read like files (shared with the health checker)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+# --label_format choices -> formats recorded in the manifest
+LABEL_FORMATS = {'txt': ['txt'], 'bin': ['bin'], 'both': ['txt', 'bin']}
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Convert COCO dataset to YOLO format')
-    parser.add_argument('--images_folder', type=str, help='path to the dataset folder', required=True)
-    parser.add_argument('--annotations_path', type=str, help='path to the annotations json file', required=True)
+    parser.add_argument('--images_folder', type=str, help='path to the dataset folder (may be inside a zip/tar/tar.gz archive, e.g. coco.zip/train2017)', required=True)
+    parser.add_argument('--annotations_path', type=str, help='path to the annotations json file (may be inside an archive, e.g. coco.zip/annotations/instances_train2017.json)', required=True)
     parser.add_argument('--output_path', type=str, help='path to the output folder (both images and annotations folder will be created inside it)', required=True)
+    parser.add_argument('--label_format', type=str, default='txt', choices=list(LABEL_FORMATS), help=f'txt writes a label file per image in <output_path>/labels, bin a sharded binary label store in <output_path>/{STORE_FOLDER} (export_labels.py turns it back into txt files), both writes both')
+    parser.add_argument('--store_shards', type=int, default=DEFAULT_STORE_SHARDS, help='number of shard files of the binary label store')
+    parser.add_argument('--streaming', action='store_true', help='read the annotations json incrementally instead of loading it whole (bounded memory)')
+    parser.add_argument('--max_buffered_annotations', type=int, default=DEFAULT_MAX_BUFFERED_ANNOTATIONS, help='number of annotations kept in memory before the grouped label files are flushed to disk')
+    parser.add_argument('--header_workers', type=int, default=DEFAULT_HEADER_WORKERS, help='threads used to read image headers for images without size in the annotation file')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes, annotations are sharded by image id (the output does not depend on it)')
+    parser.add_argument('--image_mode', type=str, default='auto', choices=STRATEGIES, help='how images are put in <output_path>/images: auto tries hardlink, then reflink, then copy (none leaves the folder empty)')
+    parser.add_argument('--copy_workers', type=int, default=DEFAULT_COPY_WORKERS, help='threads used to copy images')
+    parser.add_argument('--no_resume', action='store_true', help='ignore the manifest of a previous run and convert everything again')
+    parser.add_argument('--size_cache', type=str, default=None, help='path of the image size cache (default: <output_path>/.image_sizes.json)')
+    parser.add_argument('--no_size_cache', action='store_true', help='do not read or write the image size cache')
+    parser.add_argument('--trace', type=str, default='trace.ndjson', help='NDJSON file the per-stage timings, throughput and peak memory are appended to (empty string disables it)')
+    parser.add_argument('--profile_stage', type=str, action='append', default=[], help='stage to capture with --profiler (hash, read, digests, convert, shards, store, materialize), repeatable, "all" for every stage')
+    parser.add_argument('--profiler', type=str, default='cprofile', choices=PROFILERS, help='cprofile writes a .prof file, sample writes collapsed stacks (.folded) with a lower overhead')
+    parser.add_argument('--profile_folder', type=str, default='profiles', help='folder of the profile files')
     
     return parser.parse_args()
 
 
 
+def iter_loaded_sections(annotations):
+    """yields (section, item) pairs from an already loaded COCO dict, in the same shape as iter_coco_sections"""
+    for section in ('categories', 'images', 'annotations'):
+        for item in annotations.get(section, []):
+            yield section, item
+
+
+def write_classes_yaml(output_path, categories):
+    classes = []
+    for category in categories.values():
+        classes.append(category)
+    logging.info('Writing classes to yaml file')
+    with open(os.path.join(output_path, 'classes.yaml'), 'w') as f:
+        f.write('names:\n')
+        for class_name in classes:
+            f.write(f'- {class_name}\n')
+        f.write(f'nc: {len(classes)}\n')
+    logging.info('Classes written to yaml file')
+
+
 def main(args):
     
     images_folder = args.images_folder.replace('\\', '/')
@@ -47,93 +105,192 @@ def main(args):
     logging.info(f'Dataset path: {images_folder}')
     logging.info(f'Annotations path: {annotations_path}')
     logging.info(f'Output path: {output_path}')
+    profiler = StageProfiler('converter', args.trace, args.profile_stage, args.profiler, args.profile_folder)
+    logging.info(f'Run id: {profiler.run_id}')
     
     # create output folders
+    formats = LABEL_FORMATS[args.label_format]
     images_output_path = os.path.join(output_path, 'images')
     annotations_output_path = os.path.join(output_path, 'labels')
+    store_path = os.path.join(output_path, STORE_FOLDER) if 'bin' in formats else None
     os.makedirs(images_output_path, exist_ok=True)
-    os.makedirs(annotations_output_path, exist_ok=True)
+    if 'txt' in formats:
+        os.makedirs(annotations_output_path, exist_ok=True)
     
+    image_index = ImageIndex(images_folder, args.header_workers)
+    size_cache = args.size_cache or os.path.join(output_path, '.image_sizes.json')
+    if not args.no_size_cache:
+        image_index.load_cache(size_cache, annotations_path)
+
+    # a manifest of a previous run tells which label files are already up to date
+    logging.info('Hashing annotation file')
+    annotations_size = archive_reader.stat(annotations_path).st_size
+    with profiler.stage('hash', bytes_read=annotations_size):
+        source_hash = hash_file(annotations_path)
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    previous = None if args.no_resume else Manifest.load(manifest_path)
+    labels_up_to_date = (
+        previous is not None and previous.complete and previous.source_hash == source_hash
+        and set(formats) <= set(previous.formats) and (store_path is None or load_meta(store_path) is not None)
+    )
+    if labels_up_to_date:
+        logging.info('Label files are up to date with the annotation file (see manifest), nothing to convert')
+
     # read annotations
-    logging.info('Opening annotations')
-    with open(annotations_path, 'r') as f:
-        logging.info('Reading annotations')
-        annotations = json.load(f)
-    logging.info('Annotations read successfully')
+    if args.streaming:
+        # categories, images and annotations are decoded one element at a time, so memory stays bounded
+        logging.info('Streaming annotations')
+        open_sections = lambda: iter_coco_sections(annotations_path)
+    else:
+        logging.info('Opening annotations')
+        with archive_reader.open_text(annotations_path) as f, profiler.stage('read', bytes_read=annotations_size):
+            logging.info('Reading annotations')
+            annotations = json.load(f)
+        logging.info('Annotations read successfully')
+        open_sections = lambda: iter_loaded_sections(annotations)
+
+    manifest = previous if labels_up_to_date else Manifest(manifest_path, source_hash)
+    if not labels_up_to_date:
+        manifest.formats = formats
+    up_to_date = set()
+    if store_path is not None and not labels_up_to_date:
+        # the store is rebuilt from every annotation, so no label file can be skipped
+        logging.info('Writing the binary label store, every label is converted')
+        reset_store(store_path)
+    elif previous is not None and not labels_up_to_date:
+        logging.info('Found the manifest of a previous run, computing annotation digests')
+        with profiler.stage('digests') as record:
+            digests = compute_digests(tqdm(open_sections(), desc='Digests', unit='item'), image_index)
+            record['items'] = len(digests)
+        up_to_date = {name for name, digest in digests.items() if previous.images.get(name) == digest}
+        manifest.images = {name: previous.images[name] for name in up_to_date}
+        # images that do not have annotations anymore
+        stale = set(previous.images) - set(digests)
+        for label_name in stale:
+            label_path = os.path.join(annotations_output_path, label_name)
+            if os.path.exists(label_path):
+                os.remove(label_path)
+        logging.info(f'{len(up_to_date)} label files up to date, {len(digests) - len(up_to_date)} to (re)write, '
+                     f'{len(stale)} stale removed')
+    manifest.save()
+    manifest.remove_parts()
+    tracker = DigestTracker(manifest, image_index)
     
-    # get all categories
-    logging.info('Getting all unique categories')
+
+    # write annotations to txt files and/or the label store (the positions, and sizes are normalized)
+    # categories are collected along the way, COCO exports usually store them after the annotations
+    logging.info(f'Initializing writing annotations ({", ".join(formats)})')
     categories = {}
-    for category in tqdm(annotations['categories']):
-        categories[category['id']] = category['name']
-    
-    # write classes to yaml file
-    classes = []
-    for category in categories.values():
-        classes.append(category)
-    logging.info('Writing classes to yaml file')
-    with open(os.path.join(output_path, 'classes.yaml'), 'w') as f:
-        f.write('names:\n')
-        for class_name in classes:
-            f.write(f'- {class_name}\n')
-        f.write(f'nc: {len(classes)}\n')
-    logging.info('Classes written to yaml file')
-    
-    # write annotations to txt files (the positions, and sizes are normalized)
-    logging.info('Initializing writing annotations to txt files')
-    logging.info(f'Unique keys of an annotation: {annotations["annotations"][0].keys()}')
-    for annotation in tqdm(annotations['annotations']):
-        image_id = annotation['image_id']
-        image_name = f'{image_id}'
-        # the image name MUST have 12 characters, so it will be left padded with zeros
-        image_name = image_name.zfill(12) + '.jpg'
-        # path join with /
-        image_path = os.path.join(images_folder, image_name).replace('\\', '/')
-        logging.debug(f'Processing image {image_name}')
-        logging.debug(f'Image path: {image_path}')
-                
-        # write annotation (it can happen to have multiple annotations for the same image, so it will append to the file)
-        annotation_path = os.path.join(annotations_output_path, f'{str(image_id).zfill(12)}.txt')
-        with open(annotation_path, 'a') as f:
-            category_id = annotation['category_id']
-            # category = categories[category_id]
-            bbox = annotation['bbox']
-
-            # normalize the values
-            width, height = bbox[2], bbox[3]
-            x_center = bbox[0] + width / 2
-            y_center = bbox[1] + height / 2
-            
-            # get the image width from the image file
-            image_width, image_height = 0, 0
-            try:
-                image_width, image_height = annotation['width'], annotation['height']
-            except:
-                try:
-                    image = Image.open(image_path)
-                    image_width, image_height = image.size
-                except:
-                    logging.info(f'Could not find image width and height for image {image_name} in the annotation file')
-                    logging.error(f'Could not find image width and height for image {image_name}')
-                    logging.error(f'Skipping this image: {image_name}')
-                    continue
-                
-            x_center /= image_width
-            y_center /= image_height
-            width /= image_width
-            height /= image_height
-        
-            
-            f.write(f'{category_id} {x_center} {y_center} {width} {height}\n')
-            
+    # ids of the annotated images, used to materialize images that are not in the images table
+    annotated_ids = set()
+    first_annotation = True
+    stats = ConversionStats()
+    start = time.perf_counter()
+    # with several workers the annotations are only routed to per-shard spill files here, the shards are converted
+    # afterwards in a process pool
+    spiller = None
+    if args.workers > 1:
+        spiller = ShardSpiller(os.path.join(output_path, '.shards'), args.workers)
+    # it can happen to have multiple annotations for the same image, so lines are grouped per label file
+    # and each file is written at once
+    writers = []
+    if 'txt' in formats:
+        writers.append(LabelWriter(annotations_output_path, args.max_buffered_annotations, on_flush=tracker.checkpoint))
+    if store_path is not None:
+        writers.append(LabelStoreWriter(store_path, args.store_shards, 0, args.max_buffered_annotations))
+    progress = tqdm(open_sections(), unit='item')
+    with profiler.stage('convert') as record, WriterGroup(writers) as writer:
+        for section, item in progress:
+            if section == 'categories':
+                categories[item['id']] = item['name']
+                continue
+            if section == 'images':
+                image_index.add_coco_image(item)
+                continue
+            if section != 'annotations':
+                continue
+            annotation = item
+            annotated_ids.add(annotation['image_id'])
+            if labels_up_to_date:
+                continue
+            if up_to_date and image_index.label_name(annotation['image_id']) in up_to_date:
+                continue
+            if spiller is not None:
+                spiller.add(annotation)
+                continue
+            if first_annotation:
+                logging.info(f'Unique keys of an annotation: {annotation.keys()}')
+                logging.info(f'Indexed {len(image_index.images)} images from the images table')
+                # sizes missing from the table are read from the image headers in parallel, before they are needed
+                missing = image_index.missing_sizes()
+                if not args.streaming:
+                    missing += image_index.missing_sizes(
+                        {a['image_id'] for a in annotations['annotations'] if a['image_id'] not in image_index.images}
+                    )
+                image_index.prefetch(missing)
+                first_annotation = False
+
+            convert_annotation(annotation, image_index, writer, stats, tracker)
+        record['items'] = progress.n
+
+    if spiller is not None:
+        spiller.close()
+        logging.info(f'Indexed {len(image_index.images)} images from the images table')
+        logging.info(f'Converting {args.workers} shards with {args.workers} workers')
+        with profiler.stage('shards', workers=args.workers) as record:
+            stats = run_shards(
+                spiller.paths, image_index, annotations_output_path if 'txt' in formats else None, args.workers,
+                args.max_buffered_annotations, manifest, store_path, args.store_shards
+            )
+            record['items'] = stats.annotations
+        spiller.remove()
+        manifest = Manifest.load(manifest_path)
+
+    if store_path is not None and not labels_up_to_date:
+        logging.info(f'Merging the label store into {args.store_shards} shard files')
+        with profiler.stage('store') as record:
+            label_files, boxes = finalize_store(store_path, args.store_shards)
+            record['items'] = boxes
+        logging.info(f'Label store written: {label_files} label files, {boxes} boxes')
+
+    manifest.complete = True
+    manifest.save()
+    manifest.remove_parts()
             
-    logging.info('Finished writing annotations to txt files')
+    logging.info('Finished writing annotations')
+    stats.log_summary(time.perf_counter() - start)
     
+    if args.image_mode != 'none':
+        logging.info(f'Materializing images into {images_output_path} (strategy: {args.image_mode})')
+        image_ids = list(image_index.images) + [i for i in annotated_ids if i not in image_index.images]
+        materializer = ImageMaterializer(images_output_path, args.image_mode, args.copy_workers)
+        with profiler.stage('materialize', items=len(image_ids)) as record:
+            materializer.materialize([image_index.file_name(i) for i in image_ids], images_folder)
+            # links and kernel-side copies do not show in the I/O counters
+            record['bytes_written'] = materializer.bytes_moved
+
+    if not args.no_size_cache and image_index.header_sizes:
+        image_index.save_cache(size_cache, annotations_path)
+
+    # write classes to yaml file
+    logging.info(f'Found {len(categories)} categories')
+    write_classes_yaml(output_path, categories)
     
+    rss = profiler.run_peak_rss_mb()
+    if rss is not None:
+        logging.info(f'Peak RSS: {rss:.1f} MB')
+    else:
+        logging.info('Peak RSS: not available on this platform')
+    if args.workers > 1 and rss is not None:
+        logging.info(f'Peak RSS of a worker: {peak_rss_mb(children=True):.1f} MB')
+    print(profiler.finish())
     logging.info('Finished')
     
     
 if __name__ == '__main__':
+    # configured here and not at import time, so the spawned shard workers do not touch the log. runs are appended,
+    # the run id of each matches its records in the trace
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s', filename='main.log', filemode='a')
     args = parse_args()
     main(args)
     
\ No newline at end of file
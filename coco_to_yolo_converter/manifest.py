@@ -0,0 +1,157 @@
+"""
+output manifest for resumable and incremental conversions.
+
+the manifest (`<output_path>/.manifest.json`) records a hash of the source annotation file and, for every label file
+written, a digest of the annotations (and images table entry) it was generated from. it is checkpointed every time
+the label writer flushes, so a conversion that dies halfway leaves a manifest of what was completed.
+
+on a rerun:
+- same source hash and a complete manifest that wrote the requested label formats (txt files, binary store): nothing
+  to convert
+- otherwise the digests of the new annotation file are computed in a first pass, label files whose digest matches
+  the manifest are kept as they are, the others are regenerated, and label files of images that no longer have
+  annotations are removed
+
+a label file that was only partially written when the run died has the digest of the annotations written so far,
+which can not match the digest of all its annotations, so it is regenerated. the binary label store is always
+rebuilt from every annotation, so the per-file digests only apply to runs that do not write it.
+"""
+
+import os
+import sys
+import json
+import glob
+import hashlib
+import logging
+
+# archive members are read like files (shared with the health checker)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+MANIFEST_NAME = '.manifest.json'
+MANIFEST_VERSION = 1
+
+
+def hash_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with archive_reader.open_binary(path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _annotation_bytes(annotation):
+    return json.dumps(annotation, sort_keys=True).encode('utf-8')
+
+
+def _final_digest(annotations_hasher, image_entry):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps(image_entry).encode('utf-8'))
+    h.update(annotations_hasher.digest())
+    return h.hexdigest()
+
+
+class Manifest:
+    def __init__(self, path, source_hash):
+        self.path = path
+        self.source_hash = source_hash
+        self.complete = False
+        # label formats written by the run ('txt', 'bin')
+        self.formats = ['txt']
+        # label file name -> digest of what it was generated from
+        self.images = {}
+
+    @classmethod
+    def load(cls, path):
+        """loads the manifest at `path` together with the per-shard parts left by an interrupted run"""
+        manifest = None
+        for part_path in [path] + sorted(glob.glob(glob.escape(path) + '.part*')):
+            if not os.path.exists(part_path):
+                continue
+            try:
+                with open(part_path, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f'Ignoring unreadable manifest {part_path}: {e}')
+                continue
+            if data.get('version') != MANIFEST_VERSION:
+                continue
+            if manifest is None:
+                manifest = cls(path, data['source_hash'])
+                manifest.complete = data['complete']
+                # manifests written before the binary store only had label files
+                manifest.formats = data.get('formats', ['txt'])
+            elif data['source_hash'] != manifest.source_hash:
+                continue
+            else:
+                manifest.complete = False
+            manifest.images.update(data['images'])
+        return manifest
+
+    def save(self):
+        data = {
+            'version': MANIFEST_VERSION,
+            'source_hash': self.source_hash,
+            'complete': self.complete,
+            'formats': self.formats,
+            'images': self.images,
+        }
+        # written next to the manifest and renamed, so a crash while saving never leaves a truncated manifest
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def remove_parts(self):
+        for part_path in glob.glob(glob.escape(self.path) + '.part*'):
+            os.remove(part_path)
+
+
+class DigestTracker:
+    """keeps the running digest of every label file and checkpoints them in the manifest when the writer flushes"""
+
+    def __init__(self, manifest, image_index):
+        self.manifest = manifest
+        self.image_index = image_index
+        self.hashers = {}
+        self.label_ids = {}
+
+    def update(self, label_name, annotation, converted):
+        if label_name not in self.hashers:
+            self.hashers[label_name] = hashlib.blake2b(digest_size=16)
+            self.label_ids[label_name] = annotation['image_id']
+        hasher = self.hashers[label_name]
+        if hasher is None:
+            return
+        if not converted:
+            # label files of images that could not be converted are never recorded, so they are retried
+            self.hashers[label_name] = None
+            return
+        hasher.update(_annotation_bytes(annotation))
+
+    def checkpoint(self, label_names):
+        for label_name in label_names:
+            hasher = self.hashers.get(label_name)
+            if hasher is None:
+                self.manifest.images.pop(label_name, None)
+                continue
+            image_entry = self.image_index.images.get(self.label_ids[label_name])
+            self.manifest.images[label_name] = _final_digest(hasher, image_entry)
+        self.manifest.save()
+
+
+def compute_digests(sections, image_index):
+    """first pass over (section, item) pairs, returns label file name -> digest of all its annotations"""
+    hashers = {}
+    for section, item in sections:
+        if section == 'images':
+            image_index.add_coco_image(item)
+        elif section == 'annotations':
+            label_name = image_index.label_name(item['image_id'])
+            if label_name not in hashers:
+                hashers[label_name] = (item['image_id'], hashlib.blake2b(digest_size=16))
+            hashers[label_name][1].update(_annotation_bytes(item))
+    return {
+        label_name: _final_digest(hasher, image_index.images.get(image_id))
+        for label_name, (image_id, hasher) in hashers.items()
+    }
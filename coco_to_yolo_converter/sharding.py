@@ -0,0 +1,136 @@
+"""
+multi-process sharded conversion.
+
+the annotations are routed by image id into `num_shards` spill files while the COCO file is read, so all annotations of
+an image end up in the same shard, in their original order. every shard is then converted by a worker of a process
+pool, which writes a disjoint set of label files. this makes the label files identical whatever the number of workers.
+
+each worker returns its `ConversionStats`, the image sizes it had to read from image headers and its log records. the
+main process merges the stats and replays the log records shard by shard, so `main.log` stays readable. workers
+checkpoint their label digests in their own manifest part, merged by the main process at the end of the run. with a
+binary label store, every worker spills its boxes to its own part of the store, merged by `finalize_store`.
+"""
+
+import os
+import json
+import shutil
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+from conversion import ConversionStats, convert_annotation
+from image_index import ImageIndex
+from label_writer import LabelWriter, WriterGroup
+from label_store import LabelStoreWriter
+from manifest import Manifest, DigestTracker
+
+
+class ShardSpiller:
+    """routes annotations by image id to one json-lines spill file per shard"""
+
+    def __init__(self, shard_folder, num_shards):
+        self.shard_folder = shard_folder
+        self.num_shards = num_shards
+        os.makedirs(shard_folder, exist_ok=True)
+        self.paths = [os.path.join(shard_folder, f'shard_{i:04d}.jsonl') for i in range(num_shards)]
+        self.files = [open(path, 'w') for path in self.paths]
+
+    def add(self, annotation):
+        shard = hash(annotation['image_id']) % self.num_shards
+        self.files[shard].write(json.dumps(annotation) + '\n')
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    def remove(self):
+        shutil.rmtree(self.shard_folder, ignore_errors=True)
+
+
+class _RecordCollector(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+_worker_index = None
+
+
+def _init_worker(images_folder, images, header_sizes, header_workers):
+    global _worker_index
+    _worker_index = ImageIndex(images_folder, header_workers)
+    _worker_index.images = images
+    _worker_index.header_sizes = header_sizes
+
+
+def _iter_shard(shard_path):
+    with open(shard_path, 'r') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def convert_shard(shard_path, labels_folder, max_buffered_annotations, manifest_part_path, source_hash,
+                  store_folder=None, store_shards=None, part=0):
+    """
+    converts one spill file into label files (unless `labels_folder` is None) and part `part` of the label store at
+    `store_folder` (if any), returns (stats, header sizes read, log records)
+    """
+    root = logging.getLogger()
+    collector = _RecordCollector()
+    previous_handlers = root.handlers
+    root.handlers = [collector]
+    try:
+        stats = ConversionStats()
+        known_sizes = set(_worker_index.header_sizes)
+        # first pass only collects the image ids, so the missing headers of this shard are read in parallel
+        image_ids = {annotation['image_id'] for annotation in _iter_shard(shard_path)}
+        _worker_index.prefetch(_worker_index.missing_sizes(image_ids))
+        tracker = DigestTracker(Manifest(manifest_part_path, source_hash), _worker_index)
+        writers = []
+        if labels_folder is not None:
+            writers.append(LabelWriter(labels_folder, max_buffered_annotations, on_flush=tracker.checkpoint))
+        if store_folder is not None:
+            writers.append(LabelStoreWriter(store_folder, store_shards, part, max_buffered_annotations))
+        with WriterGroup(writers) as writer:
+            for annotation in _iter_shard(shard_path):
+                convert_annotation(annotation, _worker_index, writer, stats, tracker)
+        new_sizes = {
+            image_id: size for image_id, size in _worker_index.header_sizes.items() if image_id not in known_sizes
+        }
+    finally:
+        root.handlers = previous_handlers
+    return stats, new_sizes, collector.records
+
+
+def run_shards(shard_paths, image_index, labels_folder, workers, max_buffered_annotations, manifest,
+               store_folder=None, store_shards=None):
+    """
+    converts the spill files in a process pool and merges the results in shard order (see `convert_shard` for
+    `labels_folder`, `store_folder` and `store_shards`)
+    """
+    stats = ConversionStats()
+    initargs = (image_index.images_folder, image_index.images, image_index.header_sizes, image_index.header_workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        results = executor.map(
+            convert_shard,
+            shard_paths,
+            [labels_folder] * len(shard_paths),
+            [max_buffered_annotations] * len(shard_paths),
+            [f'{manifest.path}.part{i:04d}' for i in range(len(shard_paths))],
+            [manifest.source_hash] * len(shard_paths),
+            [store_folder] * len(shard_paths),
+            [store_shards] * len(shard_paths),
+            range(len(shard_paths)),
+        )
+        for shard_path, (shard_stats, new_sizes, records) in tqdm(
+            zip(shard_paths, results), total=len(shard_paths), desc='Converting shards', unit='shard'
+        ):
+            logging.info(f'Merging {os.path.basename(shard_path)}: {shard_stats.annotations} annotations')
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+            stats.merge(shard_stats)
+            image_index.header_sizes.update(new_sizes)
+    return stats
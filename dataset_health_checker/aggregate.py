@@ -0,0 +1,597 @@
+"""
+Mergeable Split Aggregates
+
+The label files of a split are assigned to `NUM_SHARDS` shards by a stable
+hash of their name (relative to the `labels` folder), so shard membership does
+not depend on the number of workers and does not shift when files are added or
+removed. Each shard is parsed and reduced to a compact `ShardSummary`:
+- counters (label files, annotations, empty label files, malformed lines)
+- class counts
+- spatial grid histogram of the box centers (int64)
+- running center moments (Welford)
+- box quality: boxes per image histogram, box size counts (from the size of
+  the image of every label file, when known), near-duplicate and overlapping
+  boxes (see `box_quality.py`)
+
+The heatmaps are too large to keep per shard and are accumulated as int64
+totals (footprint difference array and center heatmap) instead.
+
+Integer parts are merged by addition, which is exact and order independent.
+Floating point moments are folded in shard order at the end, so the result is
+bit-identical whatever the number of workers and whatever order the partial
+aggregates are merged in. No per-box data outlives its task, so memory does not
+grow with the number of boxes.
+
+With a cache folder (see `label_cache.py`), each processed shard also stores its
+boxes and file index, and only the shards whose files (or image sizes) changed
+are processed on the next run: their summaries are replaced and the heatmap
+totals are updated with the difference between their new and cached boxes. A warm run therefore
+gives exactly the same metrics as a cold one.
+"""
+
+import math
+import zlib
+import logging
+import numpy as np
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+from label_loader import load_labels, BOX_DTYPE
+from box_quality import boxes_per_image, box_size_counts, find_duplicates
+from label_cache import ShardCache
+from heatmaps import center_heatmap, footprint_difference, integrate_footprint, DEFAULT_RESOLUTION
+
+DEFAULT_GRID_SIZE = 10
+NUM_SHARDS = 256
+# Boxes a task buffers before adding their heatmap contributions
+HEATMAP_FLUSH_BOXES = 2_000_000
+
+
+class CenterMoments:
+    """
+    Numerically stable running moments of box centers: count, means and sums
+    of squared deviations (Welford), plus the mean distance from the image
+    center. Two states are combined with Chan's parallel update, so memory is
+    constant whatever the number of boxes.
+    """
+
+    def __init__(self, count=0, mean_x=0.0, mean_y=0.0, m2_x=0.0, m2_y=0.0, mean_dist=0.0):
+        self.count = count
+        self.mean_x = mean_x
+        self.mean_y = mean_y
+        self.m2_x = m2_x
+        self.m2_y = m2_y
+        self.mean_dist = mean_dist
+
+    @classmethod
+    def from_centers(cls, xc: np.ndarray, yc: np.ndarray) -> 'CenterMoments':
+        if len(xc) == 0:
+            return cls()
+        mean_x = float(xc.mean())
+        mean_y = float(yc.mean())
+        dist = np.sqrt((xc - 0.5) ** 2 + (yc - 0.5) ** 2)
+        return cls(
+            len(xc),
+            mean_x, mean_y,
+            float(((xc - mean_x) ** 2).sum()), float(((yc - mean_y) ** 2).sum()),
+            float(dist.mean()),
+        )
+
+    def merge(self, other: 'CenterMoments') -> 'CenterMoments':
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.__dict__.update(other.__dict__)
+            return self
+        count = self.count + other.count
+        weight = other.count / count
+        delta_x = other.mean_x - self.mean_x
+        delta_y = other.mean_y - self.mean_y
+        self.m2_x += other.m2_x + delta_x * delta_x * self.count * weight
+        self.m2_y += other.m2_y + delta_y * delta_y * self.count * weight
+        self.mean_x += delta_x * weight
+        self.mean_y += delta_y * weight
+        self.mean_dist += (other.mean_dist - self.mean_dist) * weight
+        self.count = count
+        return self
+
+    def std(self) -> float:
+        """Combined standard deviation sqrt(std_x^2 + std_y^2) of the centers."""
+        if self.count == 0:
+            return 0.0
+        return math.sqrt((self.m2_x + self.m2_y) / self.count)
+
+    def mean_distance(self) -> float:
+        """Average distance of the centers from the image center (0.5, 0.5)."""
+        return self.mean_dist
+
+    def to_list(self) -> list:
+        return [self.count, self.mean_x, self.mean_y, self.m2_x, self.m2_y, self.mean_dist]
+
+
+def grid_histogram(xc: np.ndarray, yc: np.ndarray, grid_size: int = DEFAULT_GRID_SIZE) -> np.ndarray:
+    """Counts box centers per cell of a `grid_size x grid_size` grid (row = y), out-of-range centers are clamped."""
+    gx = np.clip((xc * grid_size).astype(np.int64), 0, grid_size - 1)
+    gy = np.clip((yc * grid_size).astype(np.int64), 0, grid_size - 1)
+    counts = np.bincount(gy * grid_size + gx, minlength=grid_size * grid_size)
+    return counts.reshape(grid_size, grid_size)
+
+
+def grid_entropy(grid: np.ndarray) -> float:
+    """
+    Shannon entropy of a grid histogram, rounded like the other health
+    parameters. The histogram holds box counts, or weighted counts (the
+    approximate mode), which may be fractional.
+    """
+    if not np.array_equal(grid, np.floor(grid)):
+        # Weighted counts: float64 probabilities over the weighted total
+        grid_probs = grid.flatten() / grid.sum()
+        return round(float(-sum([p * math.log(p + 1e-9) for p in grid_probs])), 6)
+    total_boxes = int(grid.sum())
+    if total_boxes == 0:
+        return 0.0
+    # float32 probabilities, a per-cell `math.log` and a float32 rounding: the
+    # arithmetic of the original per-box computation, so `spatial_entropy`
+    # does not drift (the second round gives the float the float32 prints as)
+    grid_probs = grid.flatten().astype(np.float32) / (total_boxes + 1e-9)
+    entropy = -sum([p * math.log(p + 1e-9) for p in grid_probs])
+    return round(float(round(entropy, 6)), 6)
+
+
+def shard_of(label_name: str) -> int:
+    """Stable shard of a label file, from its name relative to the labels folder."""
+    return zlib.crc32(label_name.encode('utf-8')) % NUM_SHARDS
+
+
+def shard_signature(files: list, image_sizes: np.ndarray) -> str:
+    """Identifies the names, sizes and mtimes of the files of a shard, and the sizes of their images."""
+    crc = 0
+    for _, name, size, mtime_ns in files:
+        crc = zlib.crc32(f'{name}\0{size}\0{mtime_ns}\n'.encode('utf-8'), crc)
+    crc = zlib.crc32(np.ascontiguousarray(image_sizes, dtype=np.float64).tobytes(), crc)
+    return f'{len(files)}-{crc:08x}'
+
+
+def unknown_sizes(count: int) -> np.ndarray:
+    """Image sizes of `count` label files whose images were not read."""
+    return np.full((count, 2), np.nan)
+
+
+def make_shards(files: list, image_sizes: np.ndarray = None) -> dict:
+    """
+    Groups (label_path, label_name, size, mtime_ns) tuples by shard index,
+    keeping their order. Returns shard index -> (files, (n, 2) width and
+    height of their images, NaN when unknown).
+    """
+    if image_sizes is None:
+        image_sizes = unknown_sizes(len(files))
+    positions = {}
+    for position, entry in enumerate(files):
+        positions.setdefault(shard_of(entry[1]), []).append(position)
+    return {i: ([files[p] for p in shard], image_sizes[shard]) for i, shard in positions.items()}
+
+
+class ShardSummary:
+    """Everything the health metrics need from one shard, except the heatmaps."""
+
+    def __init__(self, label_files=0, total_annotations=0, empty_labels=None, malformed=None,
+                 class_counts=None, spatial_grid=None, moments=None, boxes_per_image=None, size_counts=None,
+                 duplicates=None, overlapping_pairs=0):
+        self.label_files = label_files
+        self.total_annotations = total_annotations
+        # Label names (relative to the labels folder)
+        self.empty_labels = empty_labels or []
+        # (label name, line number, line)
+        self.malformed = malformed or []
+        self.class_counts = class_counts or {}
+        self.spatial_grid = spatial_grid
+        self.moments = moments or CenterMoments()
+        # Number of boxes -> number of label files
+        self.boxes_per_image = boxes_per_image or {}
+        # [small, medium, large]
+        self.size_counts = size_counts or [0, 0, 0]
+        # (label name, box a, box b, class id, IoU)
+        self.duplicates = duplicates or []
+        self.overlapping_pairs = overlapping_pairs
+
+    @classmethod
+    def from_boxes(cls, boxes: np.ndarray, label_names: list, empty_labels: list, malformed: list,
+                   grid_size: int, image_sizes: np.ndarray = None) -> 'ShardSummary':
+        """
+        Summary of the boxes of a shard, in file order (`image` is the position
+        of their file in `label_names`). `image_sizes` are the (n, 2) width and
+        height of the image of every file (NaN when unknown), for the box sizes.
+        """
+        class_ids, counts = np.unique(boxes['class_id'], return_counts=True)
+        finite = np.isfinite(boxes['xc']) & np.isfinite(boxes['yc'])
+        xc, yc = boxes['xc'][finite], boxes['yc'][finite]
+        sized = finite & np.isfinite(boxes['w']) & np.isfinite(boxes['h'])
+        duplicates, overlapping = find_duplicates(boxes[sized], label_names)
+        return cls(
+            len(label_names), len(boxes), empty_labels, malformed,
+            dict(zip(class_ids.tolist(), counts.tolist())),
+            grid_histogram(xc, yc, grid_size),
+            CenterMoments.from_centers(xc, yc),
+            boxes_per_image(boxes['image'], len(label_names)),
+            box_size_counts(
+                boxes['w'][sized], boxes['h'][sized],
+                image_sizes[boxes['image'][sized]] if image_sizes is not None else None,
+            ),
+            duplicates, overlapping,
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            'label_files': self.label_files,
+            'total_annotations': self.total_annotations,
+            'empty_labels': self.empty_labels,
+            'malformed': [list(m) for m in self.malformed],
+            'class_counts': [[c, n] for c, n in self.class_counts.items()],
+            'spatial_grid': self.spatial_grid.tolist(),
+            'moments': self.moments.to_list(),
+            'boxes_per_image': [[b, n] for b, n in self.boxes_per_image.items()],
+            'size_counts': self.size_counts,
+            'duplicates': [list(d) for d in self.duplicates],
+            'overlapping_pairs': self.overlapping_pairs,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ShardSummary':
+        return cls(
+            data['label_files'], data['total_annotations'], data['empty_labels'],
+            [tuple(m) for m in data['malformed']],
+            {c: n for c, n in data['class_counts']},
+            np.array(data['spatial_grid'], dtype=np.int64),
+            CenterMoments(*data['moments']),
+            {b: n for b, n in data['boxes_per_image']},
+            data['size_counts'],
+            [tuple(d) for d in data['duplicates']],
+            data['overlapping_pairs'],
+        )
+
+
+class SplitAggregate:
+    """Partial (or complete) health aggregate of a split."""
+
+    def __init__(self, resolution: int = DEFAULT_RESOLUTION, grid_size: int = DEFAULT_GRID_SIZE):
+        self.resolution = resolution
+        self.grid_size = grid_size
+        # shard index -> ShardSummary
+        self.shards = {}
+        self.footprint_diff = np.zeros((resolution + 1, resolution + 1), dtype=np.int64)
+        self.heatmap_centers = np.zeros((resolution, resolution), dtype=np.int64)
+
+    def add_heatmaps(self, boxes: np.ndarray, sign: int = 1):
+        """Adds (or removes, with `sign=-1`) the heatmap contributions of `boxes`."""
+        if len(boxes) == 0:
+            return
+        footprint = footprint_difference(boxes['xc'], boxes['yc'], boxes['w'], boxes['h'], self.resolution)
+        centers = center_heatmap(boxes['xc'], boxes['yc'], self.resolution)
+        if sign < 0:
+            self.footprint_diff -= footprint
+            self.heatmap_centers -= centers
+        else:
+            self.footprint_diff += footprint
+            self.heatmap_centers += centers
+
+    def merge(self, other: 'SplitAggregate') -> 'SplitAggregate':
+        # Partial aggregates of a split always cover disjoint shards
+        self.shards.update(other.shards)
+        self.footprint_diff += other.footprint_diff
+        self.heatmap_centers += other.heatmap_centers
+        return self
+
+    def _ordered_shards(self) -> list:
+        return [self.shards[i] for i in sorted(self.shards)]
+
+    @property
+    def label_files(self) -> int:
+        return sum(s.label_files for s in self.shards.values())
+
+    @property
+    def total_annotations(self) -> int:
+        return sum(s.total_annotations for s in self.shards.values())
+
+    @property
+    def empty_labels(self) -> list:
+        return sorted(name for s in self.shards.values() for name in s.empty_labels)
+
+    @property
+    def malformed(self) -> list:
+        return sorted(m for s in self.shards.values() for m in s.malformed)
+
+    @property
+    def class_counts(self) -> Counter:
+        counts = Counter()
+        for s in self._ordered_shards():
+            counts.update(s.class_counts)
+        return counts
+
+    @property
+    def spatial_grid(self) -> np.ndarray:
+        grid = np.zeros((self.grid_size, self.grid_size), dtype=np.int64)
+        for s in self.shards.values():
+            grid += s.spatial_grid
+        return grid
+
+    @property
+    def boxes_per_image(self) -> Counter:
+        """Number of boxes -> number of label files."""
+        counts = Counter()
+        for s in self.shards.values():
+            counts.update(s.boxes_per_image)
+        return counts
+
+    @property
+    def size_counts(self) -> list:
+        """[small, medium, large] box counts."""
+        return [sum(s.size_counts[i] for s in self.shards.values()) for i in range(3)]
+
+    @property
+    def duplicates(self) -> list:
+        return sorted(d for s in self.shards.values() for d in s.duplicates)
+
+    @property
+    def overlapping_pairs(self) -> int:
+        return sum(s.overlapping_pairs for s in self.shards.values())
+
+    def heatmap_bboxes(self) -> np.ndarray:
+        return integrate_footprint(self.footprint_diff)
+
+    def center_moments(self) -> CenterMoments:
+        total = CenterMoments()
+        for s in self._ordered_shards():
+            total.merge(s.moments)
+        return total
+
+    def spatial_entropy(self) -> float:
+        """Entropy of the spatial grid histogram (see `compute_spatial_entropy`)."""
+        return grid_entropy(self.spatial_grid)
+
+
+def _update_shard(files: list, image_sizes: np.ndarray, cache: ShardCache, grid_size: int):
+    """
+    Parses the files of one shard, reusing the cached boxes of the files whose
+    size and mtime did not change. Returns (summary, new boxes, cached boxes).
+    """
+    cached = cache.load() if cache is not None else None
+    to_parse = list(range(len(files)))
+    empty = []
+    malformed = []
+    boxes_parts = []
+    old_boxes = np.zeros(0, dtype=BOX_DTYPE)
+
+    if cached is not None:
+        # A label file shared by several images is listed once per image, its
+        # k-th cached entry maps to its k-th entry
+        occurrences = Counter()
+        positions = {}
+        for p, (_, name, size, mtime_ns) in enumerate(files):
+            positions[name, occurrences[name]] = (p, size, mtime_ns)
+            occurrences[name] += 1
+        occurrences.clear()
+        new_positions = np.full(len(cached.files), -1, dtype=np.int64)
+        # Label name -> entries reused
+        reused = Counter()
+        for old_position, (name, size, mtime_ns, _, is_empty) in enumerate(cached.files):
+            current = positions.get((name, occurrences[name]))
+            occurrences[name] += 1
+            if current is not None and current[1:] == (size, mtime_ns):
+                new_positions[old_position] = current[0]
+                reused[name] += 1
+                if is_empty:
+                    empty.append(name)
+        reused_positions = set(new_positions[new_positions >= 0].tolist())
+        to_parse = [p for p in range(len(files)) if p not in reused_positions]
+        # The malformed lines of a shared label file are listed once per entry
+        cached_malformed = sorted({tuple(m) for m in cached.malformed if m[0] in reused})
+        malformed.extend(m for m in cached_malformed for _ in range(reused[m[0]]))
+        boxes_parts.append(cached.reuse(new_positions))
+        # Copy, the cache file is replaced below
+        old_boxes = np.array(cached.boxes)
+        cached = None
+
+    parsed = load_labels([files[p][0] for p in to_parse], to_parse)
+    boxes_parts.append(parsed.boxes)
+    empty.extend(files[p][1] for p in parsed.empty_images)
+    names = {files[p][0]: files[p][1] for p in to_parse}
+    malformed.extend((names[path], line_number, line) for path, line_number, line in parsed.malformed)
+
+    boxes = np.concatenate(boxes_parts)
+    # Back to file order, the stable sort keeps the line order within each file
+    boxes = boxes[np.argsort(boxes['image'], kind='stable')]
+    empty.sort()
+    malformed.sort()
+    if cache is not None:
+        cache.save(files, boxes, empty, malformed)
+    summary = ShardSummary.from_boxes(boxes, [entry[1] for entry in files], empty, malformed, grid_size, image_sizes)
+    return summary, boxes, old_boxes
+
+
+def process_shards(shards: list, cache_folder: str = None, resolution: int = DEFAULT_RESOLUTION,
+                   grid_size: int = DEFAULT_GRID_SIZE) -> SplitAggregate:
+    """
+    Worker entry point: processes a list of (shard_index, files, image_sizes),
+    where files are (label_path, label_name, size, mtime_ns) tuples and
+    image_sizes the (n, 2) width and height of their images.
+
+    Returns a partial aggregate with the summary of every shard and the change
+    of the heatmaps caused by these shards (their whole contribution without a
+    cache).
+    """
+    aggregate = SplitAggregate(resolution, grid_size)
+    added, removed = [], []
+    buffered = 0
+
+    def flush():
+        # One scatter-add per side, each call costs O(resolution^2) whatever the number of boxes
+        if added:
+            aggregate.add_heatmaps(np.concatenate(added), 1)
+        if removed:
+            aggregate.add_heatmaps(np.concatenate(removed), -1)
+        added.clear()
+        removed.clear()
+
+    for shard_index, files, image_sizes in shards:
+        cache = ShardCache(cache_folder, shard_index) if cache_folder else None
+        summary, boxes, old_boxes = _update_shard(files, image_sizes, cache, grid_size)
+        aggregate.shards[shard_index] = summary
+        added.append(boxes)
+        removed.append(old_boxes)
+        buffered += len(boxes) + len(old_boxes)
+        if buffered >= HEATMAP_FLUSH_BOXES:
+            flush()
+            buffered = 0
+    flush()
+    return aggregate
+
+
+def _run_tasks(executor: ProcessPoolExecutor, tasks: list, aggregates: dict, resolution: int, grid_size: int):
+    futures = {
+        executor.submit(process_shards, shards, cache_folder, resolution, grid_size): split_name
+        for split_name, shards, cache_folder in tasks
+    }
+    for future in tqdm(as_completed(futures), total=len(futures), desc='Aggregating', unit='task'):
+        aggregates[futures[future]].merge(future.result())
+
+
+def aggregate_splits(split_files: dict, workers: int = 1, resolution: int = DEFAULT_RESOLUTION,
+                     grid_size: int = DEFAULT_GRID_SIZE, cache_folders: dict = None,
+                     executor: ProcessPoolExecutor = None, image_sizes: dict = None) -> dict:
+    """
+    Aggregates the label files of every split, returns split key -> SplitAggregate.
+
+    Parameters:
+        split_files (dict): Split key (split name, or any hashable such as
+            (dataset, split)) -> list of (label_path, label_name, size, mtime_ns).
+        workers (int): Number of processes (1 runs everything in this process).
+        resolution (int): Heatmap cells per side.
+        grid_size (int): Cells per side of the spatial entropy grid.
+        cache_folders (dict): Split key -> cache folder. Shards whose signature
+            matches the cached state are taken from it, only the others are processed.
+        executor (ProcessPoolExecutor): Pool of `workers` processes shared by
+            several calls (batch analysis); by default a pool is started here.
+        image_sizes (dict): Split key -> (n, 2) width and height of the image
+            of every label file (NaN when unknown), for the box sizes; the
+            images of a split not listed are taken as square.
+
+    The shards to process are dealt round-robin into up to `workers` tasks per
+    split, and the tasks of all splits run concurrently in one process pool.
+    """
+    cache_folders = cache_folders or {}
+    image_sizes = image_sizes or {}
+    params = {'resolution': resolution, 'grid_size': grid_size, 'num_shards': NUM_SHARDS}
+    aggregates = {}
+    signatures = {}
+    tasks = []
+    for split_name, files in split_files.items():
+        shards = make_shards(files, image_sizes.get(split_name))
+        signatures[split_name] = {i: shard_signature(*shard) for i, shard in shards.items()}
+        aggregate = SplitAggregate(resolution, grid_size)
+        aggregates[split_name] = aggregate
+        to_process = sorted(shards)
+
+        cache_folder = cache_folders.get(split_name)
+        if cache_folder is not None:
+            state = ShardCache.load_state(cache_folder, params)
+            if state is None:
+                ShardCache.clear(cache_folder)
+            else:
+                aggregate.footprint_diff = state['footprint_diff']
+                aggregate.heatmap_centers = state['heatmap_centers']
+                for shard_index, summary in state['shards'].items():
+                    if state['signatures'].get(shard_index) == signatures[split_name].get(shard_index):
+                        aggregate.shards[shard_index] = ShardSummary.from_dict(summary)
+                # Changed shards, including the ones whose files were all removed
+                to_process = sorted((set(shards) | set(state['signatures'])) - set(aggregate.shards))
+            # The shard files no longer match the state until it is saved again
+            ShardCache.invalidate_state(cache_folder)
+            logging.info(f'{split_name}: {len(to_process)} of {len(shards)} shards changed since the cached run')
+
+        work = [(shard_index, *shards.get(shard_index, ([], unknown_sizes(0)))) for shard_index in to_process]
+        num_tasks = max(1, min(workers, len(work)))
+        for t in range(num_tasks):
+            tasks.append((split_name, work[t::num_tasks], cache_folder))
+
+    if workers <= 1:
+        for split_name, shards, cache_folder in tqdm(tasks, desc='Aggregating', unit='task'):
+            aggregates[split_name].merge(process_shards(shards, cache_folder, resolution, grid_size))
+    elif executor is not None:
+        _run_tasks(executor, tasks, aggregates, resolution, grid_size)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            _run_tasks(executor, tasks, aggregates, resolution, grid_size)
+
+    for split_name, aggregate in aggregates.items():
+        # Shards whose files were all removed
+        for shard_index in [i for i, s in aggregate.shards.items() if s.label_files == 0]:
+            del aggregate.shards[shard_index]
+        cache_folder = cache_folders.get(split_name)
+        if cache_folder is not None:
+            ShardCache.save_state(
+                cache_folder, params, signatures[split_name],
+                {i: s.to_dict() for i, s in aggregate.shards.items()},
+                aggregate.footprint_diff, aggregate.heatmap_centers,
+            )
+    return aggregates
+
+
+def label_file_shards(index) -> np.ndarray:
+    """Shard of every label file of a `SplitIndex`."""
+    return np.array([shard_of(label_file.name) for label_file in index.label_files], dtype=np.int64)
+
+
+def aggregate_boxes(index, boxes: np.ndarray, resolution: int = DEFAULT_RESOLUTION,
+                    grid_size: int = DEFAULT_GRID_SIZE, image_sizes: np.ndarray = None,
+                    file_shards: np.ndarray = None) -> SplitAggregate:
+    """
+    Reduces the boxes of a whole split, already in memory (COCO annotations,
+    binary label store), to a `SplitAggregate` with the same shards as
+    `aggregate_splits` would use for the label files. Partial aggregates of
+    disjoint groups of shards (see `file_shards`) merge into the same result.
+
+    Parameters:
+        index (SplitIndex): Images and (possibly virtual) label files of the split.
+        boxes (np.ndarray): Boxes with `BOX_DTYPE` in label file order, the
+            `image` field is the position of their file in `index.label_files`.
+        resolution (int): Heatmap cells per side.
+        grid_size (int): Cells per side of the spatial entropy grid.
+        image_sizes (np.ndarray): (n, 2) width and height of the image of every
+            label file (NaN when unknown), for the box sizes; None when no
+            image size is known.
+        file_shards (np.ndarray): Shard of every label file (`label_file_shards`,
+            computed by default), -1 for the files left out: only the shards
+            of the other files are summarized, and `boxes` holds their boxes only.
+    """
+    if image_sizes is None:
+        image_sizes = unknown_sizes(len(index.label_files))
+    if file_shards is None:
+        file_shards = label_file_shards(index)
+    aggregate = SplitAggregate(resolution, grid_size)
+    aggregate.add_heatmaps(boxes)
+
+    # Files of every shard, in file order, and the position of every file within its shard
+    included = np.flatnonzero(file_shards >= 0)
+    file_order = included[np.argsort(file_shards[included], kind='stable')]
+    shard_indices, file_starts = np.unique(file_shards[file_order], return_index=True)
+    local_positions = np.full(len(file_shards), -1, dtype=np.int64)
+    local_positions[file_order] = np.arange(len(file_order)) - np.repeat(
+        file_starts, np.diff(np.append(file_starts, len(file_order)))
+    )
+
+    box_shards = file_shards[boxes['image']]
+    box_order = np.argsort(box_shards, kind='stable')
+    boxes = boxes[box_order]
+    boxes['image'] = local_positions[boxes['image']]
+    with_boxes, box_starts = np.unique(box_shards[box_order], return_index=True)
+    shard_boxes = dict(zip(with_boxes.tolist(), np.split(boxes, box_starts[1:])))
+
+    no_boxes = np.zeros(0, dtype=BOX_DTYPE)
+    for shard_index, files in zip(shard_indices.tolist(), np.split(file_order, file_starts[1:])):
+        names = [index.label_files[position].name for position in files.tolist()]
+        shard = shard_boxes.get(shard_index, no_boxes)
+        counts = np.bincount(shard['image'], minlength=len(names))
+        empty = sorted(names[position] for position in np.flatnonzero(counts == 0).tolist())
+        aggregate.shards[shard_index] = ShardSummary.from_boxes(shard, names, empty, [], grid_size, image_sizes[files])
+    return aggregate
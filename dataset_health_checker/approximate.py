@@ -0,0 +1,403 @@
+"""
+Approximate Health Metrics
+
+Estimates the label metrics of a split from a random sample of its label
+files, with bootstrap confidence intervals, for datasets too large for a quick
+exact pass.
+
+- **Stratified sample**: the label files are split into strata by folder
+  (when there are few folders) and by label file size quartile (a proxy for
+  the number of boxes). Every stratum is shuffled once with the seed, and the
+  sample of a stratum is always a prefix of its shuffled files, so a larger
+  sample contains the smaller ones and the same seed gives the same sample.
+- **Progressive refinement**: the sample starts at `initial_sample` files and
+  grows every round, to the size at which the widest interval is expected to
+  reach the precision (intervals shrink like 1/sqrt(n)), and at least twice the
+  previous size; only the files added by a round are parsed (and the headers
+  of their images read, for the box sizes).
+- **Estimates**: every sampled file stands for N_h / n_h files of its stratum
+  (N_h files, n_h sampled). The weighted totals (class counts, spatial grid,
+  center sums, counters) go through the same metric functions as the exact
+  pass; with every file sampled the estimates are the exact metrics.
+- **Confidence intervals**: percentile bootstrap, resampling the sampled files
+  with replacement within every stratum (fully sampled strata are kept as is).
+- **Early stop**: refinement stops once the half-width of the interval of
+  every target metric is at most `precision`.
+"""
+
+import os
+import logging
+import numpy as np
+
+from label_loader import load_labels, BOX_DTYPE
+from aggregate import DEFAULT_GRID_SIZE
+from box_quality import overlapping_pairs, box_areas, SMALL_AREA, MEDIUM_AREA, DUPLICATE_IOU
+from image_stats import read_image_headers, DEFAULT_HEADER_WORKERS
+
+DEFAULT_INITIAL_SAMPLE = 1000
+DEFAULT_BOOTSTRAP = 200
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_PRECISION = 0.005
+SIZE_STRATA = 4
+# Folders are only used as strata when there are at most this many
+MAX_FOLDER_STRATA = 32
+# Files sampled in a stratum at least (when it has that many), so it has a variance
+MIN_STRATUM_SAMPLE = 2
+# A round grows the sample to the size its intervals predict, times this margin,
+# but at most by this factor
+EXPECTED_SIZE_MARGIN = 1.2
+MAX_GROWTH = 16
+# Sampled files whose features are built at once
+FEATURE_CHUNK = 8192
+# Bootstrap replicates multiplied at once
+REPLICATE_CHUNK = 50
+# Scalar file features, after the class and grid cell columns
+_SCALAR_COLUMNS = (
+    'centers', 'sum_x', 'sum_y', 'sum_x2', 'sum_y2', 'sum_dist', 'total_annotations', 'empty_annotations',
+    'small_boxes', 'medium_boxes', 'large_boxes', 'malformed_lines', 'duplicate_boxes', 'overlapping_pairs',
+)
+_SIZE_COLUMNS = ('small_boxes', 'medium_boxes', 'large_boxes')
+
+
+def stratify(label_files: list, size_strata: int = SIZE_STRATA) -> list:
+    """
+    Splits label files into strata by folder and size quantile.
+
+    Parameters:
+        label_files (list): `LabelFile` entries of a split.
+        size_strata (int): Number of size quantile buckets.
+
+    Returns:
+        list: One array of label file positions per stratum.
+    """
+    if not label_files:
+        return []
+    sizes = np.array([label_file.size for label_file in label_files], dtype=np.int64)
+    edges = np.quantile(sizes, np.linspace(0, 1, size_strata + 1)[1:-1])
+    buckets = np.searchsorted(edges, sizes, side='right')
+    folders = [os.path.dirname(label_file.name) for label_file in label_files]
+    if len(set(folders)) > MAX_FOLDER_STRATA:
+        folders = [''] * len(label_files)
+    strata = {}
+    for position, key in enumerate(zip(folders, buckets.tolist())):
+        strata.setdefault(key, []).append(position)
+    return [np.array(strata[key], dtype=np.int64) for key in sorted(strata)]
+
+
+class StratifiedSample:
+    """
+    Nested stratified random sample of label files.
+
+    Parameters:
+        strata (list): Arrays of label file positions (see `stratify`).
+        seed (int): Seed of the shuffles.
+    """
+
+    def __init__(self, strata: list, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.strata = [rng.permutation(stratum) for stratum in strata]
+        self.population = np.array([len(stratum) for stratum in strata], dtype=np.int64)
+        self.taken = np.zeros(len(strata), dtype=np.int64)
+
+    @property
+    def size(self) -> int:
+        return int(self.taken.sum())
+
+    @property
+    def complete(self) -> bool:
+        return bool((self.taken == self.population).all())
+
+    def grow(self, target: int) -> list:
+        """
+        Grows the sample to about `target` files, allocated to the strata in
+        proportion to their size. Returns (stratum, positions) of the added files.
+        """
+        total = int(self.population.sum())
+        target = min(target, total)
+        allocation = np.floor(target * self.population / max(total, 1)).astype(np.int64)
+        # Largest remainders get the files lost to rounding
+        remainders = target * self.population / max(total, 1) - allocation
+        for h in np.argsort(-remainders, kind='stable')[:target - int(allocation.sum())]:
+            allocation[h] += 1
+        allocation = np.maximum(allocation, np.minimum(self.population, MIN_STRATUM_SAMPLE))
+        allocation = np.minimum(np.maximum(allocation, self.taken), self.population)
+        added = []
+        for h, (start, end) in enumerate(zip(self.taken.tolist(), allocation.tolist())):
+            if end > start:
+                added.append((h, self.strata[h][start:end]))
+        self.taken = allocation
+        return added
+
+
+class SampleBoxes:
+    """
+    Parsed boxes of the sampled label files, with per-file counters. The
+    `image` field of the boxes is the position of their file in the sample.
+    """
+
+    def __init__(self, grid_size: int = DEFAULT_GRID_SIZE):
+        self.grid_size = grid_size
+        self.boxes = np.zeros(0, dtype=BOX_DTYPE)
+        self.stratum = np.zeros(0, dtype=np.int64)
+        # Width and height of the image of every sampled file, NaN when unknown
+        self.image_sizes = np.zeros((0, 2))
+        self.empty = np.zeros(0, dtype=bool)
+        self.malformed = np.zeros(0, dtype=np.int64)
+        self.duplicates = np.zeros(0, dtype=np.int64)
+        self.overlaps = np.zeros(0, dtype=np.int64)
+        # Weight-independent arrays of `weighted_totals`, computed once per sample
+        self._derived = None
+
+    @property
+    def num_files(self) -> int:
+        return len(self.stratum)
+
+    def add(self, paths: list, stratum: int, image_sizes: np.ndarray = None):
+        """
+        Parses the label files at `paths`, all from `stratum`, `image_sizes`
+        are the (n, 2) sizes of their images (None when unknown).
+        """
+        first = self.num_files
+        positions = np.arange(first, first + len(paths))
+        parsed = load_labels(paths, positions)
+        boxes = parsed.boxes
+
+        empty = np.zeros(len(paths), dtype=bool)
+        empty[np.asarray(parsed.empty_images, dtype=np.int64) - first] = True
+        malformed = np.zeros(len(paths), dtype=np.int64)
+        index_of = {path: i for i, path in enumerate(paths)}
+        for path, _, _ in parsed.malformed:
+            malformed[index_of[path]] += 1
+
+        # Near-duplicates and overlaps per file (pairs never span files)
+        sized = np.isfinite(boxes['xc']) & np.isfinite(boxes['yc']) & np.isfinite(boxes['w']) \
+            & np.isfinite(boxes['h'])
+        valid = boxes[sized]
+        half_w, half_h = valid['w'] / 2, valid['h'] / 2
+        a, b, iou = overlapping_pairs(valid['image'].astype(np.int64), valid['xc'] - half_w, valid['yc'] - half_h,
+                                      valid['xc'] + half_w, valid['yc'] + half_h)
+        duplicate = (valid['class_id'][a] == valid['class_id'][b]) & (iou >= DUPLICATE_IOU)
+        pair_files = valid['image'][a].astype(np.int64) - first
+        duplicates = np.bincount(pair_files[duplicate], minlength=len(paths))
+        overlaps = np.bincount(pair_files[~duplicate], minlength=len(paths))
+
+        self.boxes = np.concatenate([self.boxes, boxes])
+        self.stratum = np.concatenate([self.stratum, np.full(len(paths), stratum, dtype=np.int64)])
+        if image_sizes is None:
+            image_sizes = np.full((len(paths), 2), np.nan)
+        self.image_sizes = np.concatenate([self.image_sizes, image_sizes])
+        self.empty = np.concatenate([self.empty, empty])
+        self.malformed = np.concatenate([self.malformed, malformed])
+        self.duplicates = np.concatenate([self.duplicates, duplicates])
+        self.overlaps = np.concatenate([self.overlaps, overlaps])
+        self._derived = None
+
+    def _derive(self) -> dict:
+        if self._derived is not None:
+            return self._derived
+        boxes = self.boxes
+        class_ids, class_index = np.unique(boxes['class_id'], return_inverse=True)
+        finite = np.isfinite(boxes['xc']) & np.isfinite(boxes['yc'])
+        xc, yc = boxes['xc'], boxes['yc']
+        gx = np.clip(np.where(finite, xc * self.grid_size, 0).astype(np.int64), 0, self.grid_size - 1)
+        gy = np.clip(np.where(finite, yc * self.grid_size, 0).astype(np.int64), 0, self.grid_size - 1)
+        sized = finite & np.isfinite(boxes['w']) & np.isfinite(boxes['h'])
+        area = box_areas(np.where(sized, boxes['w'], 0), np.where(sized, boxes['h'], 0),
+                         self.image_sizes[boxes['image']])
+        with np.errstate(invalid='ignore'):
+            center_terms = np.stack([xc, yc, xc * xc, yc * yc, np.sqrt((xc - 0.5) ** 2 + (yc - 0.5) ** 2)])
+        num_classes, num_cells = len(class_ids), self.grid_size ** 2
+        self._derived = {
+            'class_ids': class_ids.tolist(),
+            'class_index': class_index.reshape(-1),
+            'finite': finite,
+            'cell': gy * self.grid_size + gx,
+            'center_terms': np.where(finite, center_terms, 0.0),
+            'sized': sized,
+            'size_class': (area >= SMALL_AREA).astype(np.int64) + (area >= MEDIUM_AREA),
+            # Column offsets of the file features: classes, grid cells, then the scalar columns
+            'grid_column': num_classes,
+            'scalar_column': num_classes + num_cells,
+            'columns': num_classes + num_cells + len(_SCALAR_COLUMNS),
+        }
+        return self._derived
+
+    def _features(self, start: int, end: int) -> np.ndarray:
+        """Per-file feature rows (see `_SCALAR_COLUMNS`) of the sampled files `start`..`end`."""
+        derived = self._derive()
+        first, last = np.searchsorted(self.boxes['image'], [start, end])
+        file = self.boxes['image'][first:last].astype(np.int64) - start
+        files, columns = end - start, derived['columns']
+        finite, sized = derived['finite'][first:last], derived['sized'][first:last]
+        size_column = derived['scalar_column'] + _SCALAR_COLUMNS.index(_SIZE_COLUMNS[0])
+        flat = np.concatenate([
+            file * columns + derived['class_index'][first:last],
+            file[finite] * columns + derived['grid_column'] + derived['cell'][first:last][finite],
+            file[sized] * columns + size_column + derived['size_class'][first:last][sized],
+        ])
+        features = np.bincount(flat, minlength=files * columns).astype(np.float64).reshape(files, columns)
+        scalars = features[:, derived['scalar_column']:]
+        column = {name: i for i, name in enumerate(_SCALAR_COLUMNS)}
+        scalars[:, column['centers']] = np.bincount(file[finite], minlength=files)
+        for name, terms in zip(_SCALAR_COLUMNS[1:6], derived['center_terms'][:, first:last]):
+            scalars[:, column[name]] = np.bincount(file[finite], weights=terms[finite], minlength=files)
+        scalars[:, column['total_annotations']] = np.bincount(file, minlength=files)
+        scalars[:, column['empty_annotations']] = self.empty[start:end]
+        scalars[:, column['malformed_lines']] = self.malformed[start:end]
+        scalars[:, column['duplicate_boxes']] = self.duplicates[start:end]
+        scalars[:, column['overlapping_pairs']] = self.overlaps[start:end]
+        return features
+
+    def weighted_totals(self, weights: np.ndarray) -> list:
+        """
+        Weighted totals of the sample for every row of `weights` (replicates x
+        sampled files), every file counting `weights[r, file]` times. The file
+        features are built and multiplied chunk by chunk, so memory is bounded.
+
+        Returns:
+            list: One dict per row: class_counts (dict, zero counts left out),
+                spatial_grid, center sums (centers, sum_x, sum_y, sum_x2,
+                sum_y2, sum_dist), label_files, total_annotations,
+                empty_annotations, malformed_lines, size_counts,
+                duplicate_boxes, overlapping_pairs.
+        """
+        derived = self._derive()
+        weights = np.atleast_2d(weights)
+        sums = np.zeros((len(weights), derived['columns']))
+        for start in range(0, self.num_files, FEATURE_CHUNK):
+            end = min(start + FEATURE_CHUNK, self.num_files)
+            sums += weights[:, start:end] @ self._features(start, end)
+
+        grid_column, scalar_column = derived['grid_column'], derived['scalar_column']
+        totals = []
+        for row, file_weights in zip(sums, weights):
+            scalars = dict(zip(_SCALAR_COLUMNS, row[scalar_column:].tolist()))
+            totals.append({
+                'class_counts': {c: n for c, n in zip(derived['class_ids'], row[:grid_column].tolist()) if n > 0},
+                'spatial_grid': row[grid_column:scalar_column].reshape(self.grid_size, self.grid_size),
+                **{name: scalars[name] for name in _SCALAR_COLUMNS if name not in _SIZE_COLUMNS},
+                'label_files': float(file_weights.sum()),
+                'size_counts': [scalars[name] for name in _SIZE_COLUMNS],
+            })
+        return totals
+
+    def totals(self, weights: np.ndarray) -> dict:
+        """Weighted totals for one weight per sampled file, see `weighted_totals`."""
+        return self.weighted_totals(weights)[0]
+
+
+class ApproximateMetrics:
+    """
+    Result of `approximate_split`.
+
+    Attributes:
+        estimates (dict): Metric -> estimate.
+        intervals (dict): Metric -> (low, high) bootstrap confidence interval.
+        sampled_files (int): Label files in the final sample.
+        label_files (int): Label files of the split.
+        rounds (list): (sampled files, widest half-width among the target metrics) per round.
+        converged (bool): The target precision was reached (or every file was sampled).
+    """
+
+    def __init__(self, estimates, intervals, sampled_files, label_files, rounds, converged):
+        self.estimates = estimates
+        self.intervals = intervals
+        self.sampled_files = sampled_files
+        self.label_files = label_files
+        self.rounds = rounds
+        self.converged = converged
+
+    def half_width(self, metric: str) -> float:
+        low, high = self.intervals[metric]
+        return (high - low) / 2
+
+
+def _bootstrap_draws(rng: np.random.Generator, replicates: int, weights: np.ndarray, resampled: list,
+                     sample: StratifiedSample) -> np.ndarray:
+    """
+    File weights of `replicates` bootstrap replicates (replicates x files):
+    the files of every incomplete stratum are drawn with replacement, `resampled`
+    holds (stratum, sampled files) of those strata.
+    """
+    draws = np.tile(weights, (replicates, 1))
+    for h, files in resampled:
+        picks = rng.integers(0, len(files), (replicates, len(files))) + len(files) * np.arange(replicates)[:, None]
+        counts = np.bincount(picks.ravel(), minlength=replicates * len(files)).reshape(replicates, len(files))
+        draws[:, files] = counts * (sample.population[h] / len(files))
+    return draws
+
+
+def approximate_split(label_files: list, metrics_fn, targets: tuple, precision: float = DEFAULT_PRECISION,
+                      confidence: float = DEFAULT_CONFIDENCE, initial_sample: int = DEFAULT_INITIAL_SAMPLE,
+                      max_sample: int = None, bootstrap: int = DEFAULT_BOOTSTRAP, seed: int = 0,
+                      grid_size: int = DEFAULT_GRID_SIZE, image_paths: list = None,
+                      header_workers: int = DEFAULT_HEADER_WORKERS) -> ApproximateMetrics:
+    """
+    Estimates the metrics of a split from a progressively refined sample.
+
+    Parameters:
+        label_files (list): `LabelFile` entries of the split.
+        metrics_fn (callable): Weighted totals (see `SampleBoxes.weighted_totals`) -> metric dict.
+        targets (tuple): Metrics whose interval half-width must reach `precision`.
+        precision (float): Largest accepted half-width of the target intervals.
+        confidence (float): Confidence level of the intervals.
+        initial_sample (int): Label files of the first round.
+        max_sample (int): Largest sample (default: every label file).
+        bootstrap (int): Bootstrap replicates per round.
+        seed (int): Seed of the sample and of the bootstrap.
+        grid_size (int): Cells per side of the spatial entropy grid.
+        image_paths (list): Image of every label file, the headers of the
+            sampled ones are read for the box sizes (None: the images are taken
+            as square).
+        header_workers (int): Number of threads reading image headers.
+
+    Returns:
+        ApproximateMetrics: Estimates, intervals and refinement history.
+    """
+    if precision <= 0:
+        raise ValueError(f'The precision must be positive, got {precision}')
+    sample = StratifiedSample(stratify(label_files), seed)
+    boxes = SampleBoxes(grid_size)
+    max_sample = min(max_sample or len(label_files), len(label_files))
+    alpha = 1 - confidence
+    target = max(1, initial_sample)
+    rounds = []
+    while True:
+        for h, positions in sample.grow(min(target, max_sample)):
+            image_sizes = None
+            if image_paths is not None:
+                headers = read_image_headers([image_paths[p] for p in positions.tolist()], header_workers)
+                image_sizes = np.array([header[1:] if header is not None else (np.nan, np.nan) for header in headers],
+                                       dtype=np.float64).reshape(-1, 2)
+            boxes.add([label_files[p].path for p in positions.tolist()], h, image_sizes)
+
+        weights = sample.population[boxes.stratum] / sample.taken[boxes.stratum]
+        estimates = metrics_fn(boxes.totals(weights))
+        rng = np.random.default_rng([seed, len(rounds)])
+        resampled = [
+            (h, np.flatnonzero(boxes.stratum == h)) for h in np.flatnonzero(sample.taken < sample.population).tolist()
+        ]
+        replicates = []
+        for first in range(0, bootstrap if resampled else 0, REPLICATE_CHUNK):
+            draws = _bootstrap_draws(rng, min(REPLICATE_CHUNK, bootstrap - first), weights, resampled, sample)
+            replicates.extend(metrics_fn(totals) for totals in boxes.weighted_totals(draws))
+        intervals = {}
+        for metric, estimate in estimates.items():
+            if replicates:
+                values = np.array([replicate[metric] for replicate in replicates], dtype=np.float64)
+                low, high = np.percentile(values, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+                intervals[metric] = (round(float(low), 6), round(float(high), 6))
+            else:
+                intervals[metric] = (estimate, estimate)
+
+        widest = max((intervals[m][1] - intervals[m][0]) / 2 for m in targets) if targets else 0.0
+        rounds.append((sample.size, widest))
+        logging.info(f'Approximate round {len(rounds)}: {sample.size} of {len(label_files)} label files, '
+                     f'widest half-width {widest:.6f} (target {precision})')
+        converged = widest <= precision or sample.complete
+        if converged or sample.size >= max_sample:
+            return ApproximateMetrics(estimates, intervals, sample.size, len(label_files), rounds, converged)
+        # The half-width shrinks like 1 / sqrt(sample size): grow to the size
+        # expected to reach the precision, at least doubling the sample
+        expected = sample.size * (widest / precision) ** 2 * EXPECTED_SIZE_MARGIN
+        target = int(max(sample.size * 2, min(expected, sample.size * MAX_GROWTH)))
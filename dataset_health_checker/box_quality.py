@@ -0,0 +1,163 @@
+"""
+Box Quality Metrics
+
+Box-level statistics of the label files, computed per shard and merged like
+the other shard summaries (see `aggregate.py`):
+- **Boxes per image**: histogram (number of boxes -> number of images)
+- **Box sizes**: small / medium / large counts, with the COCO area thresholds
+  (32² and 96² pixels) applied once the image of the box is resized so its
+  longer side is `SIZE_REFERENCE` (the usual letterboxed YOLO input), since
+  YOLO boxes are normalized; a box of an image of unknown size is measured as
+  if its image was square
+- **Near-duplicates**: pairs of boxes of the same image and class with an IoU
+  of at least `DUPLICATE_IOU`
+- **Heavy overlaps**: the other pairs of boxes of the same image with an IoU of
+  at least `OVERLAP_IOU`
+
+Overlapping pairs are found with a vectorized sort-and-sweep instead of the
+O(n²) pairwise IoU of every image: the boxes are sorted by (image, left edge),
+and every box is compared with its k-th successor for k = 1, 2, ... as long as
+that successor is in the same image and starts early enough to reach the IoU
+threshold. Each step is one NumPy pass over the boxes still active, so the cost
+is proportional to the number of pairs overlapping along x, not to the square of
+the boxes per image.
+"""
+
+import numpy as np
+
+# Input size the pixel area thresholds apply to (the usual YOLO training size)
+SIZE_REFERENCE = 640
+SMALL_AREA = 32 ** 2
+MEDIUM_AREA = 96 ** 2
+SIZE_CLASSES = ('small', 'medium', 'large')
+DUPLICATE_IOU = 0.9
+OVERLAP_IOU = 0.5
+
+
+def boxes_per_image(image: np.ndarray, num_images: int) -> dict:
+    """Histogram of the number of boxes of each of `num_images` images: boxes -> images."""
+    counts = np.bincount(image, minlength=num_images) if num_images else np.zeros(0, dtype=np.int64)
+    values, images = np.unique(counts, return_counts=True)
+    return dict(zip(values.tolist(), images.tolist()))
+
+
+def box_areas(w: np.ndarray, h: np.ndarray, image_sizes: np.ndarray = None,
+              reference: int = SIZE_REFERENCE) -> np.ndarray:
+    """
+    Pixel area of every box once its image is resized so its longer side is
+    `reference`.
+
+    Parameters:
+        w, h (np.ndarray): Normalized width and height of every box.
+        image_sizes (np.ndarray): (n, 2) width and height of the image of every
+            box, NaN (or None for all of them) when unknown: the image is then
+            taken as square.
+        reference (int): Longer side of the resized images.
+
+    Returns:
+        np.ndarray: Box areas in pixels.
+    """
+    area = w * h * (reference * reference)
+    if image_sizes is None or len(image_sizes) == 0:
+        return area
+    width, height = image_sizes[:, 0], image_sizes[:, 1]
+    known = (width > 0) & (height > 0)
+    # The shorter side shrinks by the aspect ratio
+    aspect = np.ones(len(area))
+    aspect[known] = np.minimum(width[known], height[known]) / np.maximum(width[known], height[known])
+    return area * aspect
+
+
+def box_size_counts(w: np.ndarray, h: np.ndarray, image_sizes: np.ndarray = None,
+                    reference: int = SIZE_REFERENCE) -> list:
+    """[small, medium, large] box counts, from `box_areas`."""
+    area = box_areas(w, h, image_sizes, reference)
+    small = int((area < SMALL_AREA).sum())
+    medium = int(((area >= SMALL_AREA) & (area < MEDIUM_AREA)).sum())
+    return [small, medium, len(area) - small - medium]
+
+
+def overlapping_pairs(image: np.ndarray, x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray,
+                      min_iou: float = OVERLAP_IOU):
+    """
+    Finds every pair of boxes of the same image whose IoU is at least `min_iou`.
+
+    Parameters:
+        image (np.ndarray): Image of every box.
+        x1, y1, x2, y2 (np.ndarray): Corners of every box.
+        min_iou (float): IoU threshold (> 0).
+
+    Returns:
+        tuple: (first, second, iou) arrays, `first` < `second` index the input
+            boxes, sorted by (first, second).
+    """
+    n = len(image)
+    order = np.lexsort((x1, image))
+    image, x1, y1, x2, y2 = image[order], x1[order], y1[order], x2[order], y2[order]
+    area = (x2 - x1) * (y2 - y1)
+    # An IoU of t needs an x overlap of at least t * width of either box, so a
+    # successor starting after `reach` can not (nor can the ones after it)
+    reach = x2 - min_iou * (x2 - x1)
+
+    firsts, seconds, ious = [], [], []
+    left = np.arange(n)
+    k = 1
+    while len(left):
+        right = left + k
+        keep = right < n
+        left, right = left[keep], right[keep]
+        keep = (image[right] == image[left]) & (x1[right] <= reach[left])
+        left, right = left[keep], right[keep]
+        if len(left) == 0:
+            break
+        inter_w = np.minimum(x2[left], x2[right]) - x1[right]
+        inter_h = np.minimum(y2[left], y2[right]) - np.maximum(y1[left], y1[right])
+        inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+        union = area[left] + area[right] - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        hit = iou >= min_iou
+        firsts.append(order[left[hit]])
+        seconds.append(order[right[hit]])
+        ious.append(iou[hit])
+        k += 1
+
+    if not firsts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    first, second, iou = np.concatenate(firsts), np.concatenate(seconds), np.concatenate(ious)
+    first, second = np.minimum(first, second), np.maximum(first, second)
+    pair_order = np.lexsort((second, first))
+    return first[pair_order], second[pair_order], iou[pair_order]
+
+
+def find_duplicates(boxes: np.ndarray, label_names: list):
+    """
+    Near-duplicate and heavily overlapping boxes of a shard.
+
+    Parameters:
+        boxes (np.ndarray): Finite boxes (`BOX_DTYPE`) in file and line order,
+            `image` is the position of their file in `label_names`.
+        label_names (list): Label file names.
+
+    Returns:
+        tuple: (duplicates, number of overlapping pairs that are not
+            duplicates). Duplicates are (label name, box a, box b, class id,
+            IoU) with the 0-based positions of the boxes among the boxes of
+            their file.
+    """
+    if len(boxes) == 0:
+        return [], 0
+    image = boxes['image'].astype(np.int64)
+    half_w, half_h = boxes['w'] / 2, boxes['h'] / 2
+    first, second, iou = overlapping_pairs(
+        image, boxes['xc'] - half_w, boxes['yc'] - half_h, boxes['xc'] + half_w, boxes['yc'] + half_h,
+    )
+    duplicate = (boxes['class_id'][first] == boxes['class_id'][second]) & (iou >= DUPLICATE_IOU)
+
+    # Position of every box within its file (the boxes are in file order)
+    starts = np.searchsorted(image, image, side='left')
+    in_file = np.arange(len(boxes)) - starts
+    duplicates = [
+        (label_names[image[a]], int(in_file[a]), int(in_file[b]), int(boxes['class_id'][a]), round(float(v), 6))
+        for a, b, v in zip(first[duplicate].tolist(), second[duplicate].tolist(), iou[duplicate].tolist())
+    ]
+    return duplicates, int((~duplicate).sum())
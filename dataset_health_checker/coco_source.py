@@ -0,0 +1,264 @@
+"""
+COCO Annotation Source
+
+Computes the health of a split straight from a COCO annotation file, without
+converting it to YOLO label files first. The annotations are read once (whole
+with `json.load`, or element by element with the streaming reader of the
+converter) into flat arrays, and the YOLO boxes are computed for all of them at
+once in NumPy, normalized with the `images` table.
+
+The result is the same `SplitIndex`, `SplitAggregate` and `ImageStats` the YOLO
+path builds from `coco_to_yolo_converter` output, and so are the metrics,
+heatmaps and CSVs:
+- the image size of an annotation comes from its own `width`/`height`, else
+  from the `images` table, else from the image header (only with an images
+  folder); annotations without a size are skipped, but their image still
+  counts as a (possibly empty) label file, like the converter writes it
+- the boxes are normalized with the same float64 operations, in the same
+  order, as the converter lines, so they equal the parsed label files exactly
+- every image is named after its `file_name` (`<id>.zfill(12).jpg` when it is
+  not in the table) and its label after the stem, so the shards, the file
+  order within a shard and therefore the merged center moments are the same
+
+Annotations with a non-positive image size are skipped too (the converter
+fails on them).
+"""
+
+import os
+import sys
+import json
+import logging
+import numpy as np
+from collections import Counter
+
+from label_loader import BOX_DTYPE
+from dataset_index import SplitIndex, LabelFile, LABEL_EXTENSION
+from image_stats import ImageStats, read_image_headers, collect_image_stats, DEFAULT_HEADER_WORKERS
+
+# Streaming COCO reader shared with the converter
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'coco_to_yolo_converter'))
+from coco_stream import iter_coco_sections
+
+# Archive members are read like files (shared with the converter)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+# Format of the images whose size comes from the table, by extension
+_EXTENSION_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+
+
+class CocoAnnotations:
+    """
+    Result of `read_coco`.
+
+    Attributes:
+        categories (dict): Category id -> name, in file order.
+        images (dict): Image id -> (width, height, file_name) from the `images`
+            table, any of them may be None.
+        image_ids (np.ndarray): Image id of every annotation (int64).
+        category_ids (np.ndarray): Category id of every annotation (int64).
+        bboxes (np.ndarray): (n, 4) COCO boxes (x, y, width, height) in pixels.
+        sizes (np.ndarray): (n, 2) image size stored in the annotation itself,
+            NaN when it has none.
+    """
+
+    def __init__(self, categories, images, image_ids, category_ids, bboxes, sizes):
+        self.categories = categories
+        self.images = images
+        self.image_ids = image_ids
+        self.category_ids = category_ids
+        self.bboxes = bboxes
+        self.sizes = sizes
+
+    def file_name(self, image_id) -> str:
+        """File name of an image, the converter default when the table has none."""
+        entry = self.images.get(image_id)
+        if entry is not None and entry[2]:
+            return entry[2]
+        return f'{image_id}'.zfill(12) + '.jpg'
+
+    def label_name(self, image_id) -> str:
+        return os.path.splitext(self.file_name(image_id))[0] + LABEL_EXTENSION
+
+    def table_size(self, image_id):
+        """(width, height) from the images table, None when missing or zero."""
+        entry = self.images.get(image_id)
+        if entry is not None and entry[0] and entry[1]:
+            return entry[0], entry[1]
+        return None
+
+    def all_image_ids(self) -> list:
+        """Every image of the split: the table images, then the annotated images missing from it."""
+        image_ids = list(self.images)
+        image_ids += [image_id for image_id in np.unique(self.image_ids).tolist() if image_id not in self.images]
+        return image_ids
+
+
+def _iter_loaded_sections(annotations: dict):
+    for section in ('categories', 'images', 'annotations'):
+        for item in annotations.get(section, []):
+            yield section, item
+
+
+def read_coco(annotations_path: str, streaming: bool = False) -> CocoAnnotations:
+    """
+    Reads a COCO annotation file into arrays.
+
+    Parameters:
+        annotations_path (str): COCO json file (or archive member).
+        streaming (bool): Decode it one element at a time (bounded memory)
+            instead of loading it whole.
+
+    Returns:
+        CocoAnnotations: Categories, images table and annotation arrays.
+    """
+    if streaming:
+        sections = iter_coco_sections(annotations_path)
+    else:
+        with archive_reader.open_text(annotations_path) as f:
+            sections = _iter_loaded_sections(json.load(f))
+
+    categories, images = {}, {}
+    image_ids, category_ids, bboxes, sizes = [], [], [], []
+    for section, item in sections:
+        if section == 'annotations':
+            image_ids.append(item['image_id'])
+            category_ids.append(item['category_id'])
+            bboxes.extend(item['bbox'][:4])
+            if 'width' in item and 'height' in item:
+                sizes.extend((item['width'], item['height']))
+            else:
+                sizes.extend((np.nan, np.nan))
+        elif section == 'images':
+            images[item['id']] = (item.get('width'), item.get('height'), item.get('file_name'))
+        elif section == 'categories':
+            categories[item['id']] = item['name']
+
+    return CocoAnnotations(
+        categories, images,
+        np.array(image_ids, dtype=np.int64),
+        np.array(category_ids, dtype=np.int64),
+        np.array(bboxes, dtype=np.float64).reshape(-1, 4),
+        np.array(sizes, dtype=np.float64).reshape(-1, 2),
+    )
+
+
+def _read_header_sizes(paths: list, workers: int) -> list:
+    return [header[1:] if header is not None else None for header in read_image_headers(paths, workers)]
+
+
+def index_coco(coco: CocoAnnotations) -> SplitIndex:
+    """
+    Builds the `SplitIndex` the converted split would have: every image, and a
+    label file for every annotated image (the label files are virtual, with no
+    path, size or mtime).
+    """
+    annotated = {coco.label_name(image_id) for image_id in np.unique(coco.image_ids).tolist()}
+    images = sorted({coco.file_name(image_id) for image_id in coco.all_image_ids()})
+
+    label_files, labeled_images, missing, duplicates = [], [], [], []
+    matched = set()
+    for image in images:
+        stem = os.path.splitext(image)[0]
+        if stem in matched:
+            duplicates.append(image)
+            continue
+        label_name = stem + LABEL_EXTENSION
+        if label_name not in annotated:
+            missing.append(image)
+            continue
+        matched.add(stem)
+        label_files.append(LabelFile(None, label_name, 0, 0))
+        labeled_images.append(image)
+    # Every annotated image is listed, so there are no orphan label files
+    return SplitIndex(images, label_files, labeled_images, missing, [], duplicates)
+
+
+def coco_boxes(coco: CocoAnnotations, index: SplitIndex, images_folder: str = None,
+               header_workers: int = DEFAULT_HEADER_WORKERS):
+    """
+    Converts every annotation to a YOLO box.
+
+    Parameters:
+        coco (CocoAnnotations): Annotations of the split.
+        index (SplitIndex): Result of `index_coco`, the `image` field of the
+            boxes is the position of their label file in `index.label_files`.
+        images_folder (str): Folder the image headers are read from for the
+            images without size (None: such annotations are skipped).
+        header_workers (int): Number of threads reading image headers.
+
+    Returns:
+        tuple: (boxes with `BOX_DTYPE` in label file and annotation order,
+            (n, 2) width and height of the image of every label file, NaN
+            when unknown, number of skipped annotations).
+    """
+    unique_ids, inverse = np.unique(coco.image_ids, return_inverse=True)
+    unique_ids = unique_ids.tolist()
+    positions = {label_file.name: p for p, label_file in enumerate(index.label_files)}
+    label_positions = np.array([positions[coco.label_name(image_id)] for image_id in unique_ids], dtype=np.int64)
+
+    # Image size of every annotated image: table, then header
+    image_sizes = np.full((len(unique_ids), 2), np.nan)
+    without_size = []
+    for i, image_id in enumerate(unique_ids):
+        size = coco.table_size(image_id)
+        if size is not None:
+            image_sizes[i] = size
+        else:
+            without_size.append(i)
+    if without_size and images_folder is not None:
+        logging.info(f'Reading image headers for {len(without_size)} images without size in the annotation file')
+        paths = [os.path.join(images_folder, coco.file_name(unique_ids[i])) for i in without_size]
+        for i, size in zip(without_size, _read_header_sizes(paths, header_workers)):
+            if size is not None:
+                image_sizes[i] = size
+
+    # The size stored in an annotation takes precedence
+    sizes = image_sizes[inverse]
+    has_own = ~np.isnan(coco.sizes).any(axis=1)
+    sizes[has_own] = coco.sizes[has_own]
+    valid = (sizes > 0).all(axis=1)
+    skipped = int((~valid).sum())
+    if skipped:
+        names = sorted({coco.file_name(image_id) for image_id in coco.image_ids[~valid].tolist()})
+        logging.warning(f'Skipped {skipped} annotations of {len(names)} images without width and height, '
+                        f'e.g. {names[:5]}')
+
+    # Size of the image of every label file, for the box sizes
+    label_sizes = np.full((len(index.label_files), 2), np.nan)
+    label_sizes[label_positions] = image_sizes
+    label_sizes[label_positions[inverse[valid]]] = sizes[valid]
+
+    bboxes, sizes = coco.bboxes[valid], sizes[valid]
+    boxes = np.empty(len(bboxes), dtype=BOX_DTYPE)
+    boxes['image'] = label_positions[inverse[valid]]
+    boxes['class_id'] = coco.category_ids[valid]
+    # Same operations, in the same order, as the converter
+    boxes['xc'] = (bboxes[:, 0] + bboxes[:, 2] / 2) / sizes[:, 0]
+    boxes['yc'] = (bboxes[:, 1] + bboxes[:, 3] / 2) / sizes[:, 1]
+    boxes['w'] = bboxes[:, 2] / sizes[:, 0]
+    boxes['h'] = bboxes[:, 3] / sizes[:, 1]
+    # Label file order, the stable sort keeps the annotation order within each file
+    return boxes[np.argsort(boxes['image'], kind='stable')], label_sizes, skipped
+
+
+def coco_image_stats(coco: CocoAnnotations, index: SplitIndex, images_folder: str = None,
+                     header_workers: int = DEFAULT_HEADER_WORKERS) -> ImageStats:
+    """
+    Image sizes of the split: from the image headers when `images_folder` is
+    given (like the YOLO path), otherwise from the images table (the images
+    without size there are reported as unreadable, the formats come from the
+    file extensions).
+    """
+    if images_folder is not None:
+        return collect_image_stats([os.path.join(images_folder, image) for image in index.images], header_workers)
+
+    sizes = {}
+    for image_id in coco.all_image_ids():
+        sizes.setdefault(coco.file_name(image_id), coco.table_size(image_id))
+    readable = [(image, sizes[image]) for image in index.images if sizes[image] is not None]
+    unreadable = [image for image in index.images if sizes[image] is None]
+    widths = np.array([size[0] for _, size in readable], dtype=np.int64)
+    heights = np.array([size[1] for _, size in readable], dtype=np.int64)
+    formats = Counter(_EXTENSION_FORMATS.get(os.path.splitext(image)[1].lower(), 'unknown') for image, _ in readable)
+    return ImageStats(widths, heights, formats, unreadable, [image for image, _ in readable])
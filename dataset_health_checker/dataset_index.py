@@ -0,0 +1,145 @@
+"""
+Dataset Directory Index
+
+Scans the `images/` and `labels/` folders of a split once each with
+`os.scandir` (recursively, so nested subdirectories are supported) and joins
+them by stem in memory, instead of probing the label file of every image with
+`os.path.exists`.
+
+The stem of a file is its path relative to the scanned folder, without
+extension and with `/` separators, so `images/a/b.jpg` matches `labels/a/b.txt`.
+The size and mtime of every label file come from the same scan and are reused
+downstream (they key the label cache), so no file is stat'ed twice.
+
+A split inside a zip or tar archive is listed from the member index of the
+archive instead (see `archives/archive_reader.py`), nothing is extracted.
+"""
+
+import os
+import sys
+import logging
+from collections import namedtuple
+
+# Archive members are read like files (shared with the converter)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+LABEL_EXTENSION = '.txt'
+
+# `name` is the path relative to the labels folder
+LabelFile = namedtuple('LabelFile', ['path', 'name', 'size', 'mtime_ns'])
+
+
+class SplitIndex:
+    """
+    Result of `index_split`.
+
+    Attributes:
+        images (list): Image paths relative to `images/`, sorted.
+        label_files (list): `LabelFile` of every image that has one, in image
+            order (a label file shared by several images is listed, and
+            counted, once per image, like the original per-image pass did).
+        labeled_images (list): The image of every entry of `label_files`.
+        missing (list): Images without a label file.
+        orphans (list): Label files (relative to `labels/`) without an image.
+        duplicates (list): Images sharing their label file with an earlier
+            image (e.g. `a.jpg` and `a.png` both use `a.txt`).
+        label_store (LabelStore): Binary label store the boxes are read from
+            (see `store_source.py`), None when they are in label files.
+    """
+
+    def __init__(self, images, label_files, labeled_images, missing, orphans, duplicates, label_store=None):
+        self.images = images
+        self.label_files = label_files
+        self.labeled_images = labeled_images
+        self.missing = missing
+        self.orphans = orphans
+        self.duplicates = duplicates
+        self.label_store = label_store
+
+
+def scan_tree(root: str, extensions: tuple, with_stat: bool = False) -> list:
+    """
+    Lists the files under `root` whose lowercase extension is in `extensions`.
+
+    Parameters:
+        root (str): Folder to scan recursively (or a folder inside an archive).
+        extensions (tuple): Accepted lowercase extensions (with the dot).
+        with_stat (bool): Also return the `os.stat_result` of every file
+            (an `archive_reader.MemberStat` for archive members).
+
+    Returns:
+        list: (relative path with '/' separators, path, stat or None) tuples.
+    """
+    if archive_reader.split_archive_path(root) is not None:
+        # The stats come with the member index, they cost nothing
+        return archive_reader.scan_tree(root, extensions)
+    found = []
+    stack = [(root, '')]
+    while stack:
+        folder, prefix = stack.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                rel_path = prefix + entry.name
+                if entry.is_dir():
+                    stack.append((entry.path, rel_path + '/'))
+                elif entry.name.lower().endswith(extensions) and entry.is_file():
+                    found.append((rel_path, entry.path, entry.stat() if with_stat else None))
+    return found
+
+
+def list_images(split_path: str) -> list:
+    """Image paths of a split, relative to its `images/` folder, sorted."""
+    return sorted(rel_path for rel_path, _, _ in scan_tree(os.path.join(split_path, 'images'), IMAGE_EXTENSIONS))
+
+
+def index_split(split_path: str) -> SplitIndex:
+    """
+    Indexes the `images/` and `labels/` folders of a split.
+
+    Parameters:
+        split_path (str): Split folder (containing `images/` and `labels/`),
+            possibly inside an archive.
+
+    Returns:
+        SplitIndex: Images, their label files, and the unmatched files.
+    """
+    images = list_images(split_path)
+    labels_path = os.path.join(split_path, 'labels')
+    labels = {}
+    if archive_reader.isdir(labels_path):
+        for rel_path, path, stat in scan_tree(labels_path, (LABEL_EXTENSION,), with_stat=True):
+            labels[os.path.splitext(rel_path)[0]] = LabelFile(path, rel_path, stat.st_size, stat.st_mtime_ns)
+    else:
+        logging.warning(f'Labels folder not found: {labels_path}')
+    return join_split(images, labels)
+
+
+def join_split(images: list, labels: dict) -> SplitIndex:
+    """
+    Joins the images of a split with their label files by stem.
+
+    Parameters:
+        images (list): Image paths relative to `images/`, sorted.
+        labels (dict): Stem -> `LabelFile`.
+
+    Returns:
+        SplitIndex: Images, their label files, and the unmatched files.
+    """
+    label_files, labeled_images, missing, duplicates = [], [], [], []
+    matched = set()
+    for image in images:
+        stem = os.path.splitext(image)[0]
+        label_file = labels.get(stem)
+        if label_file is None:
+            missing.append(image)
+            continue
+        if stem in matched:
+            duplicates.append(image)
+        matched.add(stem)
+        label_files.append(label_file)
+        labeled_images.append(image)
+
+    orphans = sorted(label_file.name for stem, label_file in labels.items() if stem not in matched)
+    return SplitIndex(images, label_files, labeled_images, missing, orphans, duplicates)
@@ -0,0 +1,97 @@
+"""
+Heatmap Engine
+
+Builds the bounding-box footprint heatmap and the bounding-box center heatmap
+for a whole batch of boxes at once.
+
+- **Center heatmap**: one `np.bincount` over the flattened cell index of every
+  center.
+- **Footprint heatmap**: a 2D difference array. Each box adds +1/-1 at its four
+  corners (scatter-add with `np.bincount`), and two cumulative sums turn the
+  difference array into the per-cell box counts. The cost is O(1) per box plus
+  O(resolution^2) once, instead of O(box area) per box.
+
+Cells are computed exactly like the original per-box loop (truncation toward
+zero, clamping, and the slice semantics of `heatmap[y_min:y_max+1, x_min:x_max+1]`),
+so at the default resolution of 1000 the counts are identical.
+Heatmaps are returned as int64 counts, so partial heatmaps (and partial
+footprint difference arrays) can be summed exactly.
+"""
+
+import numpy as np
+
+DEFAULT_RESOLUTION = 1000
+
+
+def _to_cells(values: np.ndarray, resolution: int) -> np.ndarray:
+    # int() truncates toward zero, astype does the same
+    return (values * resolution).astype(np.int64)
+
+
+def _slice_bounds(low: np.ndarray, high: np.ndarray, resolution: int):
+    """
+    Start/stop of the slice `[max(low, 0) : min(high, resolution - 1) + 1]` on an
+    axis of length `resolution`, following Python's slicing rules (a negative
+    stop counts from the end).
+    """
+    start = np.minimum(np.maximum(low, 0), resolution)
+    stop = np.minimum(high, resolution - 1) + 1
+    stop = np.where(stop < 0, stop + resolution, stop)
+    stop = np.clip(stop, 0, resolution)
+    return start, stop
+
+
+def center_heatmap(xc, yc, resolution: int = DEFAULT_RESOLUTION) -> np.ndarray:
+    """
+    Counts box centers per cell of a `resolution x resolution` grid (row = y).
+    Centers outside [0, 1) are ignored.
+    """
+    xc = np.asarray(xc, dtype=np.float64)
+    yc = np.asarray(yc, dtype=np.float64)
+    finite = np.isfinite(xc) & np.isfinite(yc)
+    cx = _to_cells(xc[finite], resolution)
+    cy = _to_cells(yc[finite], resolution)
+    inside = (cx >= 0) & (cx < resolution) & (cy >= 0) & (cy < resolution)
+    cells = cy[inside] * resolution + cx[inside]
+    counts = np.bincount(cells, minlength=resolution * resolution)
+    return counts.reshape(resolution, resolution)
+
+
+def footprint_difference(xc, yc, w, h, resolution: int = DEFAULT_RESOLUTION) -> np.ndarray:
+    """
+    Difference array of the footprint heatmap, shape (resolution + 1, resolution + 1).
+    Difference arrays of different batches can be summed before integrating.
+    """
+    xc = np.asarray(xc, dtype=np.float64)
+    yc = np.asarray(yc, dtype=np.float64)
+    w = np.asarray(w, dtype=np.float64)
+    h = np.asarray(h, dtype=np.float64)
+    finite = np.isfinite(xc) & np.isfinite(yc) & np.isfinite(w) & np.isfinite(h)
+    xc, yc, w, h = xc[finite], yc[finite], w[finite], h[finite]
+
+    x0, x1 = _slice_bounds(_to_cells(xc - w / 2, resolution), _to_cells(xc + w / 2, resolution), resolution)
+    y0, y1 = _slice_bounds(_to_cells(yc - h / 2, resolution), _to_cells(yc + h / 2, resolution), resolution)
+    keep = (x1 > x0) & (y1 > y0)
+    x0, x1, y0, y1 = x0[keep], x1[keep], y0[keep], y1[keep]
+
+    # One extra row and column for the closing corners
+    side = resolution + 1
+    size = side * side
+    diff = np.bincount(y0 * side + x0, minlength=size) + np.bincount(y1 * side + x1, minlength=size)
+    diff -= np.bincount(y0 * side + x1, minlength=size) + np.bincount(y1 * side + x0, minlength=size)
+    return diff.reshape(side, side)
+
+
+def integrate_footprint(diff: np.ndarray) -> np.ndarray:
+    """Turns a footprint difference array into per-cell box counts."""
+    counts = np.cumsum(diff, axis=0)
+    np.cumsum(counts, axis=1, out=counts)
+    return counts[:-1, :-1]
+
+
+def footprint_heatmap(xc, yc, w, h, resolution: int = DEFAULT_RESOLUTION) -> np.ndarray:
+    """
+    Counts, for every cell of a `resolution x resolution` grid, the number of
+    boxes whose footprint covers it.
+    """
+    return integrate_footprint(footprint_difference(xc, yc, w, h, resolution))
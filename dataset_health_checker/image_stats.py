@@ -0,0 +1,199 @@
+"""
+Header-Only Image Statistics
+
+Reads the size and format of every image from its container header only,
+without decoding any pixel data:
+- **JPEG**: walks the marker segments (seeking over APPn/EXIF payloads) until
+  the first SOFn frame header, which holds the height and width
+- **PNG**: the IHDR chunk, which always directly follows the signature
+
+Files are recognized by their signature, not by their extension. A few hundred
+bytes are read per image, so the cost is dominated by the file open; headers are
+read in a thread pool to overlap the I/O latency (network storage). Images
+inside a compressed tar archive are read serially in archive order instead.
+"""
+
+import os
+import sys
+import struct
+import numpy as np
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Archive members are read like files (shared with the converter)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+DEFAULT_HEADER_WORKERS = 8
+# Images per thread pool task
+CHUNK_SIZE = 256
+PERCENTILES = (5, 50, 95)
+# Keys of `ImageStats.summary`, in `health_metrics.csv` column order
+SUMMARY_COLUMNS = (
+    ['mean_image_width', 'mean_image_height', 'median_aspect_ratio']
+    + [f'{name}_p{p}' for name in ('width', 'height', 'aspect_ratio') for p in PERCENTILES]
+    + ['unreadable_images']
+)
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# SOFn markers carry the frame size (C4 = DHT, C8 = JPG extension, CC = DAC are not frames)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers without a length field
+_JPEG_STANDALONE = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+def _jpeg_size(f):
+    """(width, height) from the first SOFn segment, `f` positioned after SOI."""
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        # Any number of 0xFF fill bytes may precede a marker
+        marker = f.read(1)
+        while marker == b'\xff':
+            marker = f.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code in _JPEG_STANDALONE or code == 0x00:
+            continue
+        if code == 0xD9:  # EOI
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if code in _JPEG_SOF:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>xHH', frame)
+            return width, height
+        f.seek(length - 2, 1)
+
+
+def read_image_header(path: str):
+    """
+    Reads the format and size of an image from its header.
+
+    Parameters:
+        path (str): Image file (or archive member).
+
+    Returns:
+        tuple: (format, width, height), or None when the file is not a readable JPEG or PNG.
+    """
+    try:
+        with archive_reader.open_binary(path) as f:
+            head = f.read(24)
+            if head[:2] == b'\xff\xd8':
+                f.seek(2)
+                size = _jpeg_size(f)
+                return ('JPEG',) + size if size else None
+            if head[:8] == _PNG_SIGNATURE and head[12:16] == b'IHDR':
+                width, height = struct.unpack('>II', head[16:24])
+                return 'PNG', width, height
+    except OSError:
+        pass
+    return None
+
+
+def _read_chunk(paths: list) -> list:
+    return [read_image_header(path) for path in paths]
+
+
+class ImageStats:
+    """
+    Sizes and formats of the images of a split.
+
+    Attributes:
+        widths (np.ndarray): Width of every readable image.
+        heights (np.ndarray): Height of every readable image.
+        formats (Counter): Number of images per format.
+        unreadable (list): Images whose header could not be read.
+        images (list): Every readable image, in `widths` order.
+    """
+
+    def __init__(self, widths, heights, formats, unreadable, images=None):
+        self.widths = widths
+        self.heights = heights
+        self.formats = formats
+        self.unreadable = unreadable
+        self.images = images or []
+
+    def image_sizes(self, images: list) -> np.ndarray:
+        """(n, 2) width and height of `images` (named as in `self.images`), NaN for unreadable ones."""
+        positions = {image: i for i, image in enumerate(self.images)}
+        sizes = np.full((len(images), 2), np.nan)
+        for row, image in enumerate(images):
+            i = positions.get(image)
+            if i is not None:
+                sizes[row] = self.widths[i], self.heights[i]
+        return sizes
+
+    def aspect_ratios(self) -> np.ndarray:
+        """Width / height of every readable image (images with a zero height are left out)."""
+        valid = self.heights > 0
+        return self.widths[valid] / self.heights[valid]
+
+    def resolution_counts(self) -> list:
+        """((width, height), count) pairs, most frequent first."""
+        pairs = Counter(zip(self.widths.tolist(), self.heights.tolist()))
+        return sorted(pairs.items(), key=lambda item: (-item[1], item[0]))
+
+    def summary(self) -> dict:
+        """Single-value parameters: mean size, median aspect ratio and percentiles."""
+        ratios = self.aspect_ratios()
+        summary = {
+            'mean_image_width': round(float(self.widths.mean()), 6) if len(self.widths) else 0.0,
+            'mean_image_height': round(float(self.heights.mean()), 6) if len(self.heights) else 0.0,
+            'median_aspect_ratio': round(float(np.median(ratios)), 6) if len(ratios) else 0.0,
+        }
+        for name, values in (('width', self.widths), ('height', self.heights), ('aspect_ratio', ratios)):
+            points = np.percentile(values, PERCENTILES) if len(values) else [0.0] * len(PERCENTILES)
+            for p, value in zip(PERCENTILES, points):
+                summary[f'{name}_p{p}'] = round(float(value), 6)
+        summary['unreadable_images'] = len(self.unreadable)
+        return summary
+
+
+def read_image_headers(image_paths: list, workers: int = DEFAULT_HEADER_WORKERS) -> list:
+    """
+    `read_image_header` of every image, in chunks spread over a thread pool
+    (`workers` 1 reads them in this thread). Returns the headers in
+    `image_paths` order.
+    """
+    order = archive_reader.sequential_order(image_paths)
+    if order is not None:
+        # A compressed tar stream only reads forward: one pass, in archive order
+        headers = [None] * len(image_paths)
+        for position in order:
+            headers[position] = read_image_header(image_paths[position])
+        return headers
+    chunks = [image_paths[i:i + CHUNK_SIZE] for i in range(0, len(image_paths), CHUNK_SIZE)]
+    if workers <= 1:
+        return [header for chunk in chunks for header in _read_chunk(chunk)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [header for chunk_headers in executor.map(_read_chunk, chunks) for header in chunk_headers]
+
+
+def collect_image_stats(image_paths: list, workers: int = DEFAULT_HEADER_WORKERS) -> ImageStats:
+    """
+    Reads the header of every image, in chunks spread over a thread pool.
+
+    Parameters:
+        image_paths (list): Image files.
+        workers (int): Number of threads (1 reads the headers in this thread).
+
+    Returns:
+        ImageStats: Sizes and formats, in `image_paths` order.
+    """
+    headers = read_image_headers(image_paths, workers)
+
+    readable = [(path, header) for path, header in zip(image_paths, headers) if header is not None]
+    unreadable = [path for path, header in zip(image_paths, headers) if header is None]
+    widths = np.array([header[1] for _, header in readable], dtype=np.int64)
+    heights = np.array([header[2] for _, header in readable], dtype=np.int64)
+    formats = Counter(header[0] for _, header in readable)
+    return ImageStats(widths, heights, formats, unreadable, [path for path, _ in readable])
@@ -0,0 +1,160 @@
+"""
+Persistent Label Cache
+
+On-disk cache of the parsed label files of a split, stored under
+`health/cache/<split>/` so a rerun only parses the label files that were
+added, changed or removed since the previous run.
+
+Per shard (see `aggregate.py`):
+- `shard_XXXX.npy`: the boxes of the shard (`BOX_DTYPE`, memory-mapped on
+  load), the `image` column holds the position of the file in the file index
+- `shard_XXXX.json`: the file index (name relative to the labels folder,
+  size, mtime_ns, number of boxes, empty flag) and the malformed lines
+
+Per split:
+- `state.json`: cache parameters, the signature and summary of every shard
+- `footprint_diff.npy`, `heatmap_centers.npy`: the int64 heatmap totals
+
+`state.json` is removed before the shard files are updated and written back
+last, so an interrupted run leaves a cache that is simply rebuilt.
+"""
+
+import os
+import json
+import numpy as np
+
+from label_loader import BOX_DTYPE
+
+# 2: box quality fields in the shard summaries
+# 3: box sizes from the image sizes, part of the shard signatures
+CACHE_VERSION = 3
+STATE_NAME = 'state.json'
+
+
+def _replace_json(path: str, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _replace_npy(path: str, array: np.ndarray):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class CachedShard:
+    """Cached boxes and file index of one shard."""
+
+    def __init__(self, boxes: np.ndarray, files: list, malformed: list):
+        self.boxes = boxes
+        self.files = files
+        self.malformed = malformed
+
+    def reuse(self, new_positions: np.ndarray) -> np.ndarray:
+        """
+        Boxes of the cached files whose new position is >= 0, with the `image`
+        column remapped to that position.
+        """
+        if len(self.boxes) == 0:
+            return np.zeros(0, dtype=BOX_DTYPE)
+        positions = new_positions[self.boxes['image']]
+        rows = np.array(self.boxes[positions >= 0])
+        rows['image'] = positions[positions >= 0]
+        return rows
+
+
+class ShardCache:
+    """Reads and writes the cache files of one shard."""
+
+    def __init__(self, cache_folder: str, shard_index: int):
+        self.boxes_path = os.path.join(cache_folder, f'shard_{shard_index:04d}.npy')
+        self.index_path = os.path.join(cache_folder, f'shard_{shard_index:04d}.json')
+
+    def load(self):
+        """Returns the `CachedShard`, or None when the shard is not cached."""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            boxes = np.load(self.boxes_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if boxes.dtype != BOX_DTYPE:
+            return None
+        return CachedShard(boxes, index['files'], [tuple(m) for m in index['malformed']])
+
+    def save(self, files: list, boxes: np.ndarray, empty_labels: list, malformed: list):
+        """
+        Stores the boxes of the shard and its file index. `files` are the
+        (label_path, label_name, size, mtime_ns) tuples in box `image` order.
+        """
+        rows = np.bincount(boxes['image'], minlength=len(files)) if len(boxes) else np.zeros(len(files), dtype=np.int64)
+        empty = set(empty_labels)
+        index = {
+            'files': [
+                [name, size, mtime_ns, int(n), name in empty]
+                for (_, name, size, mtime_ns), n in zip(files, rows)
+            ],
+            'malformed': [list(m) for m in malformed],
+        }
+        _replace_npy(self.boxes_path, boxes)
+        _replace_json(self.index_path, index)
+
+    @staticmethod
+    def load_state(cache_folder: str, params: dict):
+        """
+        Returns the cached split state (dict with 'signatures', 'shards',
+        'footprint_diff' and 'heatmap_centers'), or None when there is no valid
+        state for these parameters.
+        """
+        try:
+            with open(os.path.join(cache_folder, STATE_NAME), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('version') != CACHE_VERSION or state.get('params') != params:
+                return None
+            footprint_diff = np.load(os.path.join(cache_folder, 'footprint_diff.npy'))
+            heatmap_centers = np.load(os.path.join(cache_folder, 'heatmap_centers.npy'))
+        except (OSError, ValueError):
+            return None
+        # Every shard of the state must still have its cache files
+        for shard_index in state['signatures']:
+            cache = ShardCache(cache_folder, int(shard_index))
+            if not (os.path.exists(cache.boxes_path) and os.path.exists(cache.index_path)):
+                return None
+        return {
+            'signatures': {int(i): s for i, s in state['signatures'].items()},
+            'shards': {int(i): s for i, s in state['shards'].items()},
+            'footprint_diff': footprint_diff,
+            'heatmap_centers': heatmap_centers,
+        }
+
+    @staticmethod
+    def save_state(cache_folder: str, params: dict, signatures: dict, shards: dict,
+                   footprint_diff: np.ndarray, heatmap_centers: np.ndarray):
+        _replace_npy(os.path.join(cache_folder, 'footprint_diff.npy'), footprint_diff)
+        _replace_npy(os.path.join(cache_folder, 'heatmap_centers.npy'), heatmap_centers)
+        _replace_json(os.path.join(cache_folder, STATE_NAME), {
+            'version': CACHE_VERSION,
+            'params': params,
+            'signatures': {str(i): s for i, s in signatures.items()},
+            'shards': {str(i): s for i, s in shards.items()},
+        })
+
+    @staticmethod
+    def invalidate_state(cache_folder: str):
+        os.makedirs(cache_folder, exist_ok=True)
+        try:
+            os.remove(os.path.join(cache_folder, STATE_NAME))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def clear(cache_folder: str):
+        """Removes every cache file of the split (used before a full rebuild)."""
+        if not os.path.isdir(cache_folder):
+            return
+        for entry in os.scandir(cache_folder):
+            if entry.is_file() and entry.name.endswith(('.npy', '.json', '.tmp')):
+                os.remove(entry.path)
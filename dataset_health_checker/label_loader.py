@@ -0,0 +1,163 @@
+"""
+Bulk YOLO Label Loader
+
+Reads every label file of a split into one contiguous NumPy structured array
+(`BOX_DTYPE`: image index, class id, x_center, y_center, width, height).
+
+Instead of splitting and converting each line in Python, the raw bytes of all
+files are concatenated and tokenized with vectorized NumPy operations:
+- a byte-level scan finds line boundaries and token starts, which gives the
+  number of tokens on every line
+- the first 5 tokens of every line that has at least 5 are converted in bulk
+  (class id as integer, coordinates as float64); extra columns, such as
+  segment points or a confidence, are ignored
+- every other non-blank line, and any line whose first 5 tokens fail to
+  convert, is reported as malformed (file, line number, content) without affecting the
+  other lines of the same file
+
+Label files inside a zip or tar archive are read from the archive directly.
+"""
+
+import os
+import sys
+import numpy as np
+
+# Archive members are read like files (shared with the converter)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+BOX_DTYPE = np.dtype([
+    ('image', np.int32),
+    ('class_id', np.int32),
+    ('xc', np.float64),
+    ('yc', np.float64),
+    ('w', np.float64),
+    ('h', np.float64),
+])
+
+# ASCII whitespace, the same set `bytes.split()` splits on
+_WHITESPACE = np.array([9, 10, 11, 12, 13, 32], dtype=np.uint8)
+
+
+class ParsedLabels:
+    """
+    Result of `load_labels`.
+
+    Attributes:
+        boxes (np.ndarray): Structured array with `BOX_DTYPE`, in file and line order.
+        empty_images (np.ndarray): Image indices whose label file has no content.
+        malformed (list): (label_path, line_number, line) for every malformed line.
+    """
+
+    def __init__(self, boxes, empty_images, malformed):
+        self.boxes = boxes
+        self.empty_images = empty_images
+        self.malformed = malformed
+
+
+def _convert_lines(fields: np.ndarray):
+    """
+    Converts an (n, 5) array of byte tokens. Returns (class_ids, coords, ok)
+    where `ok` flags the rows that converted cleanly.
+    """
+    try:
+        class_ids = fields[:, 0].astype(np.int64)
+        coords = fields[:, 1:].astype(np.float64)
+        return class_ids, coords, np.ones(len(fields), dtype=bool)
+    except ValueError:
+        pass
+
+    # Slow path, only taken when a file contains garbage: convert row by row
+    class_ids = np.zeros(len(fields), dtype=np.int64)
+    coords = np.zeros((len(fields), 4), dtype=np.float64)
+    ok = np.zeros(len(fields), dtype=bool)
+    for i, row in enumerate(fields):
+        try:
+            class_ids[i] = int(row[0])
+            coords[i] = [float(v) for v in row[1:]]
+            ok[i] = True
+        except ValueError:
+            continue
+    return class_ids, coords, ok
+
+
+def load_labels(label_paths: list, image_indices=None) -> ParsedLabels:
+    """
+    Parses all `label_paths` in one vectorized pass.
+
+    Parameters:
+        label_paths (list): Paths of existing label files (or archive members).
+        image_indices (array-like): Image index stored for each file's boxes
+            (defaults to the position of the file in `label_paths`).
+
+    Returns:
+        ParsedLabels: Boxes, empty label files and malformed lines.
+    """
+    if image_indices is None:
+        image_indices = np.arange(len(label_paths), dtype=np.int32)
+    image_indices = np.asarray(image_indices, dtype=np.int32)
+
+    contents = []
+    for path in label_paths:
+        content = archive_reader.read_bytes(path)
+        if content and not content.endswith(b'\n'):
+            content += b'\n'
+        contents.append(content)
+
+    lines_per_file = np.array([c.count(b'\n') for c in contents], dtype=np.int64)
+    data = b''.join(contents)
+    n_lines = int(lines_per_file.sum())
+    if n_lines == 0:
+        return ParsedLabels(np.zeros(0, dtype=BOX_DTYPE), image_indices, [])
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    is_newline = buf == 10
+    # Line of every byte (the newline belongs to the line it ends)
+    line_of_byte = np.cumsum(is_newline) - is_newline
+    is_space = np.isin(buf, _WHITESPACE)
+    token_start = ~is_space
+    token_start[1:] &= is_space[:-1]
+    token_line = line_of_byte[token_start]
+    tokens_per_line = np.bincount(token_line, minlength=n_lines)
+
+    line_file = np.repeat(np.arange(len(label_paths)), lines_per_file)
+    line_image = image_indices[line_file]
+
+    # Only the first 5 tokens of a line are the box, extra columns (segment
+    # points, a confidence) are ignored
+    good_line = tokens_per_line >= 5
+    first_token = np.cumsum(tokens_per_line) - tokens_per_line
+    token_rank = np.arange(len(token_line)) - first_token[token_line]
+    tokens = np.array(data.split(), dtype=object)
+    fields = tokens[good_line[token_line] & (token_rank < 5)].astype(bytes).reshape(-1, 5)
+    class_ids, coords, ok = _convert_lines(fields)
+
+    good_line_ids = np.flatnonzero(good_line)
+    valid_line = np.zeros(n_lines, dtype=bool)
+    valid_line[good_line_ids[ok]] = True
+
+    boxes = np.zeros(int(ok.sum()), dtype=BOX_DTYPE)
+    boxes['image'] = line_image[valid_line]
+    boxes['class_id'] = class_ids[ok]
+    boxes['xc'] = coords[ok, 0]
+    boxes['yc'] = coords[ok, 1]
+    boxes['w'] = coords[ok, 2]
+    boxes['h'] = coords[ok, 3]
+
+    # Blank lines are ignored, any other line that did not parse is malformed
+    malformed_line = ~valid_line & (tokens_per_line > 0)
+    malformed = []
+    if malformed_line.any():
+        line_ends = np.flatnonzero(is_newline)
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+        first_line_of_file = np.concatenate(([0], np.cumsum(lines_per_file)[:-1]))
+        for line_id in np.flatnonzero(malformed_line):
+            file_id = line_file[line_id]
+            text = data[line_starts[line_id]:line_ends[line_id]].decode('utf-8', errors='replace').strip()
+            malformed.append((label_paths[file_id], int(line_id - first_line_of_file[file_id]) + 1, text))
+
+    # Files without a single non-blank line
+    lines_with_tokens = np.bincount(line_file, weights=tokens_per_line > 0, minlength=len(label_paths))
+    empty_images = image_indices[lines_with_tokens == 0]
+
+    return ParsedLabels(boxes, empty_images, malformed)
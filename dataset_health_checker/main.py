@@ -12,7 +12,11 @@ Health Metrics (Multidimensional)
 - **Heatmaps**:
   1. **Bounding Box Heatmap** (shows the spatial footprint of the entire box)
   2. **Bounding Box Centers Heatmap** (shows only the centers of boxes)
-- **Bounding Box Centers** (raw list in memory, if needed for extended analysis)
+- **Bounding Box Center Statistics** (moment sums and grid histogram, merged across shards)
+- **Malformed Label Lines** (file, line number, content): saved as CSV
+- **Image Resolutions** (width, height, aspect ratio, count): saved as CSV
+- **Boxes per Image** (number of boxes, number of images): saved as CSV
+- **Near-Duplicate Boxes** (file, box pair, class, IoU): saved as CSV
 
 --------------------------------------------------------------------
 Health Parameters (Unidimensional)
@@ -31,6 +35,13 @@ These are compiled into `health_metrics.csv`. Examples include:
   - Spatial Entropy of Object Locations
   - Standard Deviation of Object Centers
   - Distance from Center of Mass
+- **Number of Malformed Label Lines**
+- **Number of Orphan Label Files** (label files without an image)
+- **Box Quality Metrics**: mean/median/max boxes per image, small/medium/large
+  box counts, near-duplicate boxes and heavily overlapping box pairs (found
+  with a sort-and-sweep spatial index, see `box_quality.py`)
+- **Image Size Metrics** (from the image headers): average image size, median
+  aspect ratio, width/height/aspect ratio percentiles, unreadable images
 - Other single-value indicators relevant to dataset health
 
 --------------------------------------------------------------------
@@ -38,34 +49,72 @@ Additional Outputs
 --------------------------------------------------------------------
 - Bar chart plots for class distribution
 - Heatmaps for bounding boxes and bounding box centers
-- Logging information for each processing step (stored in `main.log`)
+  (`--fast-plots` writes the heatmaps straight from NumPy to PNG, without
+  matplotlib and without the bar charts; `--no-plots` writes only the CSVs)
+- Logging information for each processing step (appended to `main.log`, one
+  run after the other, each starting with the run id of its trace records)
+- Approximate mode (`--approximate`): the label metrics estimated from a
+  stratified random sample of label files, refined until their bootstrap
+  confidence intervals are narrow enough (`health_metrics_approximate.csv`)
+- Datasets (and COCO annotation files) can be read straight from zip, tar and
+  tar.gz archives: a path inside an archive is written as if the archive was
+  a folder (`coco.zip`, `coco.tar.gz/val2017`). Outputs go next to the
+  archive, where its extracted tree would be (`coco/health/`)
+- Splits converted with `--label_format bin` have a binary label store
+  (`label_store/`) instead of, or next to, the label files: it is memory-mapped
+  and read without parsing (see `store_source.py`), when the split has no
+  `labels/` folder or with `--label-store`
+- Per-stage timings, throughput and peak memory: summary table at the end of
+  the run, NDJSON trace appended to `trace.ndjson` (see `--trace` and
+  `--profile-stage` to capture a stage with cProfile or the stack sampler)
 
 --------------------------------------------------------------------
 Usage Example:
     python analyze_dataset.py /path/to/yolo_dataset
+    python analyze_dataset.py /path/to/variants/* --workers 4 --fast-plots --comparison variants.csv
+    python analyze_dataset.py --coco train=instances_train.json --coco val=instances_val.json --output health
+    python analyze_dataset.py /path/to/yolo_dataset.tar.gz --workers 4
+
+Library Example:
+    health = compute_health('/path/to/yolo_dataset')   # in memory, nothing written
+    health.splits['train'].metrics()['gini_index']
+    write_health_outputs(health, plots='fast')          # optional writers
+    health = compute_coco_health({'train': 'instances_train.json'})  # COCO, without converting it
 --------------------------------------------------------------------
 """
 
 import os
+import sys
 import yaml as pyyaml
 import csv
 import math
 import numpy as np
-from collections import Counter
-import matplotlib.pyplot as plt
 import argparse
 import logging
-from tqdm import tqdm
-
-# -------------------------------------------------------
-# Logging Configuration
-# -------------------------------------------------------
-logging.basicConfig(
-    filename='main.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filemode='w'
-)
+from concurrent.futures import ProcessPoolExecutor
+
+from heatmaps import DEFAULT_RESOLUTION
+from aggregate import aggregate_splits, aggregate_boxes, grid_histogram, grid_entropy
+from dataset_index import index_split
+from image_stats import collect_image_stats, DEFAULT_HEADER_WORKERS, SUMMARY_COLUMNS as IMAGE_STATS_COLUMNS
+from heatmap_png import save_heatmap_png
+from box_quality import SIZE_CLASSES
+from approximate import approximate_split, DEFAULT_PRECISION, DEFAULT_CONFIDENCE, DEFAULT_INITIAL_SAMPLE, \
+    DEFAULT_BOOTSTRAP
+from coco_source import read_coco, index_coco, coco_boxes, coco_image_stats
+from store_source import find_store, open_store, index_store, aggregate_store
+
+# Stage timers and profiling hooks shared with the other tools
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'profiling'))
+from stage_profiler import StageProfiler, PROFILERS
+
+# Archive members are read like files (shared with the converter)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+# matplotlib: figures with axes and colorbars, fast: heatmaps only, written
+# straight to PNG, none: CSV outputs only
+PLOT_MODES = ('matplotlib', 'fast', 'none')
 
 # -------------------------------------------------------
 # 1. Class Distribution Metrics
@@ -112,40 +161,35 @@ def compute_num_classes(class_counts: dict) -> int:
 
 # -------------------------------------------------------
 # 2. Spatial Distribution Metrics
+#    (batch versions; `analyze_dataset` computes the same metrics in a
+#    streaming way from the per-shard aggregates)
 # -------------------------------------------------------
 
-def compute_spatial_entropy(bboxes_centers: list, grid_size=10) -> float:
+def _centers_array(bboxes_centers) -> np.ndarray:
+    centers = np.asarray(bboxes_centers, dtype=np.float64).reshape(-1, 2)
+    return centers[np.isfinite(centers).all(axis=1)]
+
+def compute_spatial_entropy(bboxes_centers, grid_size=10) -> float:
     """
     Computes the entropy of object locations by dividing the image into
     a grid of size `grid_size x grid_size`. 
 
     Parameters:
-        bboxes_centers (list): List of (x_center, y_center) in normalized [0,1].
+        bboxes_centers (array-like): (x_center, y_center) pairs in normalized [0,1].
         grid_size (int): Number of grid cells per dimension.
 
     Returns:
         float: Spatial entropy. High if objects are spread out, low if concentrated.
     """
-    if not bboxes_centers:
+    centers = _centers_array(bboxes_centers)
+    if len(centers) == 0:
         return 0.0
 
-    # Create a grid of zeros (grid_size x grid_size)
-    grid = np.zeros((grid_size, grid_size), dtype=np.float32)
-
-    for (xc, yc) in bboxes_centers:
-        gx = int(xc * grid_size)
-        gy = int(yc * grid_size)
-        gx = min(gx, grid_size - 1)
-        gy = min(gy, grid_size - 1)
-        grid[gy, gx] += 1.0
+    # Vectorized grid histogram (grid_size x grid_size), same as the streaming aggregate
+    grid = grid_histogram(centers[:, 0], centers[:, 1], grid_size)
+    return grid_entropy(grid)
 
-    total_boxes = len(bboxes_centers)
-    grid_probs = grid.flatten() / (total_boxes + 1e-9)
-
-    entropy = -sum([p * math.log(p + 1e-9) for p in grid_probs])
-    return round(entropy, 6)
-
-def compute_std_object_centers(bboxes_centers: list) -> float:
+def compute_std_object_centers(bboxes_centers) -> float:
     """
     Computes the combined standard deviation of object center coordinates.
 
@@ -154,18 +198,15 @@ def compute_std_object_centers(bboxes_centers: list) -> float:
     If centers are clustered, this value will be low.
     If they are spread out, it will be high.
     """
-    if not bboxes_centers:
+    centers = _centers_array(bboxes_centers)
+    if len(centers) == 0:
         return 0.0
 
-    xs = [b[0] for b in bboxes_centers]
-    ys = [b[1] for b in bboxes_centers]
-
-    std_x = float(np.std(xs))
-    std_y = float(np.std(ys))
+    std_x, std_y = centers.std(axis=0)
     D = math.sqrt(std_x**2 + std_y**2)
     return round(D, 6)
 
-def compute_distance_from_center_of_mass(bboxes_centers: list) -> float:
+def compute_distance_from_center_of_mass(bboxes_centers) -> float:
     """
     Computes the average distance of object centers from the image center (0.5, 0.5).
     Alternatively, we could compute the distance from the 'center of mass' of 
@@ -173,261 +214,906 @@ def compute_distance_from_center_of_mass(bboxes_centers: list) -> float:
 
     D_cm = mean( sqrt( (x_i - 0.5)^2 + (y_i - 0.5)^2 ) )
     """
-    if not bboxes_centers:
+    centers = _centers_array(bboxes_centers)
+    if len(centers) == 0:
         return 0.0
 
-    distances = []
-    for (xc, yc) in bboxes_centers:
-        dist = math.sqrt((xc - 0.5)**2 + (yc - 0.5)**2)
-        distances.append(dist)
+    distances = np.hypot(centers[:, 0] - 0.5, centers[:, 1] - 0.5)
+    return round(float(distances.mean()), 6)
 
-    return round(float(np.mean(distances)), 6)
+# -------------------------------------------------------
+# 3. Box Quality Metrics
+#    (the counts come from the per-shard aggregates, see `box_quality.py`)
+# -------------------------------------------------------
+
+def compute_boxes_per_image_stats(histogram: dict) -> dict:
+    """
+    Mean, median and max number of boxes per image, from a histogram of the
+    number of boxes (boxes -> images).
+    """
+    images = sum(histogram.values())
+    if images == 0:
+        return {'mean_boxes_per_image': 0.0, 'median_boxes_per_image': 0.0, 'max_boxes_per_image': 0}
+    values = np.array(sorted(histogram), dtype=np.int64)
+    counts = np.array([histogram[v] for v in values], dtype=np.int64)
+    cumulative = np.cumsum(counts)
+    # Median of the expanded values, averaging the two middle ones for an even count
+    lower = values[np.searchsorted(cumulative, (images - 1) // 2, side='right')]
+    upper = values[np.searchsorted(cumulative, images // 2, side='right')]
+    return {
+        'mean_boxes_per_image': round(float((values * counts).sum() / images), 6),
+        'median_boxes_per_image': round((float(lower) + float(upper)) / 2, 6),
+        'max_boxes_per_image': int(values[-1]),
+    }
 
 # -------------------------------------------------------
-# Main Analysis Function
+# 4. Plots
 # -------------------------------------------------------
 
-def analyze_dataset(dataset_path: str):
+def _pyplot():
     """
-    Main function that analyzes a YOLO-format dataset at `dataset_path`.
-    - Generates raw CSV files with class distribution, etc.
-    - Computes and saves unidimensional metrics in `health_metrics.csv`.
-    - Generates plots and logs for manual inspection:
-      * Class distribution bar charts
-      * Full bounding-box heatmap (1000x1000)
-      * Bounding-box center heatmap (1000x1000)
+    Imports pyplot on first use, on the non-interactive Agg backend (the import
+    dominates the startup time, and figures are only ever saved to files).
     """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
 
-    dataset_path = dataset_path.replace('\\', '/')
-    logging.info(f'Starting dataset analysis at: {dataset_path}')
+def save_class_distribution_plot(class_counter: dict, title: str, path: str):
+    """
+    Saves the class distribution as a PNG bar chart.
+
+    Parameters:
+        class_counter (dict): Class id -> number of instances.
+        title (str): Figure title.
+        path (str): Output PNG file.
+    """
+    plt = _pyplot()
+    class_ids = sorted(class_counter.keys())
+    class_counts = [class_counter[cid] for cid in class_ids]
+    plt.figure(figsize=(8, 6))
+    plt.bar(class_ids, class_counts, color='blue')
+    plt.xlabel('Class ID')
+    plt.ylabel('Count')
+    plt.title(title)
+    plt.xticks(class_ids)  # might be cluttered if many classes
+    plt.savefig(path)
+    plt.close()
+
+def save_heatmap_plot(heatmap: np.ndarray, title: str, colorbar_label: str, path: str):
+    """
+    Saves a heatmap as a PNG figure ('hot' colormap, origin at the bottom left).
+
+    Parameters:
+        heatmap (np.ndarray): 2D array of counts.
+        title (str): Figure title.
+        colorbar_label (str): Label of the colorbar.
+        path (str): Output PNG file.
+    """
+    plt = _pyplot()
+    plt.figure(figsize=(6, 6))
+    plt.imshow(heatmap, cmap='hot', interpolation='nearest', origin='lower')
+    plt.title(title)
+    plt.colorbar(label=colorbar_label)
+    plt.savefig(path)
+    plt.close()
+
+# -------------------------------------------------------
+# 5. Result Objects
+# -------------------------------------------------------
+
+# We assume only train/val splits here, but can be extended if needed
+SPLITS = ('train', 'val')
+
+# Columns of health_metrics.csv (after `split`) and of the batch comparison table
+METRIC_COLUMNS = [
+    'total_images',
+    'total_annotations',
+    'images_without_annotation',
+    'empty_annotations',
+    'effective_num_classes',
+    'gini_index',
+    'entropy_class_dist',
+    'std_class_counts',
+    'spatial_entropy',
+    'std_object_centers',
+    'avg_distance_center_of_mass',
+    'malformed_lines',
+    'orphan_labels',
+    'mean_boxes_per_image',
+    'median_boxes_per_image',
+    'max_boxes_per_image',
+    *[f'{size}_boxes' for size in SIZE_CLASSES],
+    'duplicate_boxes',
+    'overlapping_pairs',
+    *IMAGE_STATS_COLUMNS
+]
+
+# Columns of health_metrics_approximate.csv: the label metrics estimated from a
+# sample (the image size metrics are not estimated)
+APPROXIMATE_COLUMNS = [
+    column for column in METRIC_COLUMNS
+    if column not in IMAGE_STATS_COLUMNS and column not in ('median_boxes_per_image', 'max_boxes_per_image')
+]
+# Metrics whose confidence interval decides when the approximate mode stops
+APPROXIMATE_TARGETS = ('gini_index', 'entropy_class_dist', 'spatial_entropy')
+
+class SplitHealth:
+    """
+    In-memory health of one split: counters, heatmaps, image sizes and the
+    scalar metrics of `health_metrics.csv`.
+
+    Attributes:
+        name (str): Split name.
+        split_path (str): Folder of the split (with images/ and labels/).
+        index (SplitIndex): Images and label files of the split.
+        aggregate (SplitAggregate): Class counts, heatmaps and center statistics.
+        image_stats (ImageStats): Image sizes (None when the stage is disabled).
+        labels_path (str): Folder the label names are relative to
+            (`<split_path>/labels` by default).
+    """
+
+    def __init__(self, name: str, split_path: str, index, aggregate, image_stats=None, labels_path: str = None):
+        self.name = name
+        self.split_path = split_path
+        self.index = index
+        self.aggregate = aggregate
+        self.image_stats = image_stats
+        self._labels_path = labels_path
+
+    @property
+    def labels_path(self) -> str:
+        if self._labels_path is not None:
+            return self._labels_path
+        return os.path.join(self.split_path, 'labels')
+
+    @property
+    def total_images(self) -> int:
+        return len(self.index.images)
+
+    @property
+    def total_annotations(self) -> int:
+        return self.aggregate.total_annotations
+
+    @property
+    def images_without_annotation(self) -> int:
+        return len(self.index.missing)
+
+    @property
+    def class_counts(self) -> dict:
+        return self.aggregate.class_counts
+
+    @property
+    def empty_label_files(self) -> list:
+        """Paths of the empty label files."""
+        return [os.path.join(self.labels_path, label_name) for label_name in self.aggregate.empty_labels]
+
+    @property
+    def malformed(self) -> list:
+        """(label file path, line number, line) of every malformed line."""
+        return [
+            (os.path.join(self.labels_path, label_name), line_number, line)
+            for label_name, line_number, line in self.aggregate.malformed
+        ]
+
+    @property
+    def boxes_per_image(self) -> dict:
+        """Number of boxes -> number of images (images without a label file have 0 boxes)."""
+        counts = dict(self.aggregate.boxes_per_image)
+        if self.images_without_annotation:
+            counts[0] = counts.get(0, 0) + self.images_without_annotation
+        return counts
+
+    @property
+    def duplicates(self) -> list:
+        """(label file path, box a, box b, class id, IoU) of every near-duplicate pair of boxes."""
+        return [
+            (os.path.join(self.labels_path, label_name), box_a, box_b, class_id, iou)
+            for label_name, box_a, box_b, class_id, iou in self.aggregate.duplicates
+        ]
+
+    def heatmap_bboxes(self) -> np.ndarray:
+        """Bounding-box footprint heatmap (int64 counts, resolution x resolution)."""
+        return self.aggregate.heatmap_bboxes()
+
+    @property
+    def heatmap_centers(self) -> np.ndarray:
+        """Bounding-box center heatmap (int64 counts, resolution x resolution)."""
+        return self.aggregate.heatmap_centers
+
+    def metrics(self) -> dict:
+        """Scalar metrics, keyed by `METRIC_COLUMNS` (image size metrics are empty without image stats)."""
+        class_counts = dict(self.class_counts)
+        moments = self.aggregate.center_moments()
+        image_summary = self.image_stats.summary() if self.image_stats is not None else {}
+        metrics = {
+            'total_images': self.total_images,
+            'total_annotations': self.total_annotations,
+            'images_without_annotation': self.images_without_annotation,
+            'empty_annotations': len(self.aggregate.empty_labels),
+            # Class distribution metrics
+            'effective_num_classes': compute_num_classes(class_counts),
+            'gini_index': compute_gini_index(class_counts),
+            'entropy_class_dist': compute_entropy_class_distribution(class_counts),
+            'std_class_counts': compute_std_class_counts(class_counts),
+            # Spatial metrics
+            'spatial_entropy': self.aggregate.spatial_entropy(),
+            'std_object_centers': round(moments.std(), 6),
+            'avg_distance_center_of_mass': round(moments.mean_distance(), 6),
+            'malformed_lines': len(self.aggregate.malformed),
+            'orphan_labels': len(self.index.orphans),
+            # Box quality metrics
+            **compute_boxes_per_image_stats(self.boxes_per_image),
+            **{f'{size}_boxes': count for size, count in zip(SIZE_CLASSES, self.aggregate.size_counts)},
+            'duplicate_boxes': len(self.aggregate.duplicates),
+            'overlapping_pairs': self.aggregate.overlapping_pairs,
+        }
+        for column in IMAGE_STATS_COLUMNS:
+            metrics[column] = image_summary.get(column, '')
+        return metrics
+
+class DatasetHealth:
+    """
+    In-memory health of a dataset, as returned by `compute_health` (YOLO) or
+    `compute_coco_health` (COCO).
+
+    Attributes:
+        dataset_path (str): Root of the dataset (folder of the first annotation file for COCO).
+        class_names (list): Class names from data.yaml (the categories for COCO).
+        splits (dict): Split name -> SplitHealth.
+        health_folder (str): Output folder of the writers (`<dataset_path>/health` by default).
+    """
+
+    def __init__(self, dataset_path: str, class_names: list, splits: dict, health_folder: str = None):
+        self.dataset_path = dataset_path
+        self.class_names = class_names
+        self.splits = splits
+        self._health_folder = health_folder
+
+    @property
+    def health_folder(self) -> str:
+        if self._health_folder is not None:
+            return self._health_folder
+        # Next to an archive, where its extracted tree would be
+        return os.path.join(archive_reader.extracted_path(self.dataset_path), 'health')
+
+    def metrics(self) -> dict:
+        """Split name -> scalar metrics."""
+        return {split_name: split.metrics() for split_name, split in self.splits.items()}
+
+# -------------------------------------------------------
+# 6. Writers
+# -------------------------------------------------------
+
+def write_split_csvs(split: SplitHealth, health_folder: str):
+    """
+    Saves the CSV files of one split: image sizes (when collected), malformed
+    label lines, boxes per image, near-duplicate boxes and class distribution.
+    """
+    split_name = split.name
+    if split.image_stats is not None:
+        csv_image_sizes = os.path.join(health_folder, f'image_sizes_{split_name}.csv')
+        with open(csv_image_sizes, 'w', newline='', encoding='utf-8') as f_csv:
+            writer = csv.writer(f_csv)
+            writer.writerow(['width', 'height', 'aspect_ratio', 'count'])
+            for (width, height), count in split.image_stats.resolution_counts():
+                aspect_ratio = round(width / height, 6) if height else ''
+                writer.writerow([width, height, aspect_ratio, count])
+        logging.info(f'Saved image sizes CSV for {split_name} -> {csv_image_sizes}')
+
+    csv_malformed = os.path.join(health_folder, f'malformed_labels_{split_name}.csv')
+    with open(csv_malformed, 'w', newline='', encoding='utf-8') as f_csv:
+        writer = csv.writer(f_csv)
+        writer.writerow(['label_file', 'line_number', 'line'])
+        writer.writerows(split.malformed)
+
+    csv_boxes_per_image = os.path.join(health_folder, f'boxes_per_image_{split_name}.csv')
+    with open(csv_boxes_per_image, 'w', newline='', encoding='utf-8') as f_csv:
+        writer = csv.writer(f_csv)
+        writer.writerow(['boxes', 'images'])
+        writer.writerows(sorted(split.boxes_per_image.items()))
+
+    csv_duplicates = os.path.join(health_folder, f'duplicate_boxes_{split_name}.csv')
+    with open(csv_duplicates, 'w', newline='', encoding='utf-8') as f_csv:
+        writer = csv.writer(f_csv)
+        writer.writerow(['label_file', 'box_a', 'box_b', 'class_id', 'iou'])
+        writer.writerows(split.duplicates)
+
+    csv_class_dist = os.path.join(health_folder, f'class_distribution_{split_name}.csv')
+    with open(csv_class_dist, 'w', newline='', encoding='utf-8') as f_csv:
+        writer = csv.writer(f_csv)
+        writer.writerow(['class_id', 'count'])
+        for cid, cnt in sorted(split.class_counts.items()):
+            writer.writerow([cid, cnt])
+    logging.info(f'Saved class distribution CSV for {split_name} -> {csv_class_dist}')
+
+def write_split_plots(split: SplitHealth, health_folder: str, plots: str, profiler: StageProfiler,
+                      label: str = None):
+    """
+    Saves the plots of one split in the given `PLOT_MODES` mode: class
+    distribution bar chart and both heatmaps (matplotlib), or only the heatmaps
+    written straight to PNG (fast). `label` names the profiler stages.
+    """
+    if plots == 'none':
+        return
+    split_name = split.name
+    label = label or split_name
+    # Heatmap for the entire bounding box footprint and for the centers only
+    # (heatmap_resolution x heatmap_resolution, only needed by the plots)
+    with profiler.stage(f'heatmap:{label}', items=split.total_annotations):
+        heatmap_bboxes = split.heatmap_bboxes().astype(np.float32)
+        heatmap_centers = split.heatmap_centers.astype(np.float32)
+
+    heatmap_file = os.path.join(health_folder, f'heatmap_bboxes_{split_name}.png')
+    center_heatmap_file = os.path.join(health_folder, f'heatmap_centers_{split_name}.png')
+    with profiler.stage(f'plots:{label}', mode=plots) as record:
+        if plots == 'fast':
+            # One pixel per cell, no axes or colorbar (the count range is in the PNG text chunks)
+            save_heatmap_png(heatmap_bboxes, heatmap_file, f'Annotation BBox Heatmap - {split_name}')
+            save_heatmap_png(heatmap_centers, center_heatmap_file, f'Annotation Centers Heatmap - {split_name}')
+            record['items'] = 2
+        else:
+            dist_plot_file = os.path.join(health_folder, f'class_distribution_{split_name}.png')
+            save_class_distribution_plot(split.class_counts, f'Class Distribution - {split_name}', dist_plot_file)
+            logging.info(f'Saved class distribution plot for {split_name} -> {dist_plot_file}')
+            save_heatmap_plot(heatmap_bboxes, f'Annotation BBox Heatmap - {split_name}',
+                              'Number of bounding boxes', heatmap_file)
+            save_heatmap_plot(heatmap_centers, f'Annotation Centers Heatmap - {split_name}',
+                              'Number of bounding box centers', center_heatmap_file)
+            record['items'] = 3
+    logging.info(f'Saved bounding-box footprint heatmap for {split_name} -> {heatmap_file}')
+    logging.info(f'Saved bounding-box center heatmap for {split_name} -> {center_heatmap_file}')
+
+def write_metrics_csv(health: DatasetHealth, path: str):
+    """Saves the scalar metrics of every split (`health_metrics.csv`)."""
+    with open(path, 'w', newline='', encoding='utf-8') as f_csv:
+        writer = csv.writer(f_csv)
+        writer.writerow(['split', *METRIC_COLUMNS])
+        for split_name, metrics in health.metrics().items():
+            writer.writerow([split_name, *[metrics[column] for column in METRIC_COLUMNS]])
+    logging.info(f'Saved unidimensional metrics in {path}')
+
+def write_comparison_csv(rows: list, path: str):
+    """
+    Saves the comparison table of a batch: one row per dataset and split.
+
+    Parameters:
+        rows (list): Dicts with `dataset`, `split` and the `METRIC_COLUMNS` keys.
+        path (str): Output CSV file.
+    """
+    with open(path, 'w', newline='', encoding='utf-8') as f_csv:
+        writer = csv.writer(f_csv)
+        writer.writerow(['dataset', 'split', *METRIC_COLUMNS])
+        for row in rows:
+            writer.writerow([row['dataset'], row['split'], *[row[column] for column in METRIC_COLUMNS]])
+    logging.info(f'Saved comparison of {len(rows)} splits in {path}')
+
+def write_approximate_csv(results: dict, path: str):
+    """
+    Saves the approximate metrics of every split: one row per split and
+    metric, with the estimate, its confidence interval and the sample size.
+    """
+    with open(path, 'w', newline='', encoding='utf-8') as f_csv:
+        writer = csv.writer(f_csv)
+        writer.writerow(['split', 'metric', 'estimate', 'ci_low', 'ci_high', 'sampled_files', 'label_files',
+                         'converged'])
+        for split_name, result in results.items():
+            for metric, estimate in result.estimates.items():
+                low, high = result.intervals[metric]
+                writer.writerow([split_name, metric, estimate, low, high, result.sampled_files, result.label_files,
+                                 result.converged])
+    logging.info(f'Saved approximate metrics in {path}')
+
+def write_health_outputs(health: DatasetHealth, plots: str = 'matplotlib', profiler: StageProfiler = None,
+                         label: str = None):
+    """
+    Writes every output of `analyze_dataset` under `health.health_folder`
+    (`<dataset>/health/`): the per-split CSVs and plots and `health_metrics.csv`.
+    """
+    if plots not in PLOT_MODES:
+        raise ValueError(f'Unknown plot mode {plots}, expected one of {PLOT_MODES}')
+    profiler = profiler or StageProfiler('health')
+    health_folder = health.health_folder
+    os.makedirs(health_folder, exist_ok=True)
+    for split_name, split in health.splits.items():
+        split_label = f'{label}/{split_name}' if label else split_name
+        write_split_csvs(split, health_folder)
+        write_split_plots(split, health_folder, plots, profiler, split_label)
+    with profiler.stage(f'metrics:{label}' if label else 'metrics', items=len(health.splits)):
+        write_metrics_csv(health, os.path.join(health_folder, 'health_metrics.csv'))
+
+# -------------------------------------------------------
+# Main Analysis Functions
+# -------------------------------------------------------
 
-    # Load data.yaml
+def load_class_names(dataset_path: str) -> list:
+    """Class names from `<dataset_path>/data.yaml`."""
     data_yaml_path = os.path.join(dataset_path, 'data.yaml').replace('\\', '/')
     try:
-        with open(data_yaml_path, 'r') as f_yaml:
+        with archive_reader.open_text(data_yaml_path) as f_yaml:
             yaml_data = pyyaml.safe_load(f_yaml)
         logging.info('Loaded data.yaml successfully.')
     except Exception as e:
         logging.error(f'Error loading data.yaml: {e}')
         raise
+    return yaml_data.get('names', [])
 
-    class_names = yaml_data.get('names', [])
-    # We assume only train/val splits here, but can be extended if needed
-    splits = {
-        'train': os.path.join(dataset_path, 'train'),
-        'val': os.path.join(dataset_path, 'val')
-    }
+def _split_store(split_path: str, label_store: str):
+    """
+    Label store folder a split is read from, None for its label files.
+    `label_store` is 'auto' (only when the split has no `labels/` folder),
+    'prefer' (whenever it has a store) or 'never'.
+    """
+    if label_store == 'never':
+        return None
+    store_path = find_store(split_path)
+    if store_path is None or (label_store == 'auto' and archive_reader.isdir(os.path.join(split_path, 'labels'))):
+        return None
+    return store_path
+
+def _index_splits(dataset_path: str, profiler: StageProfiler, label: str = None, label_store: str = 'auto') -> dict:
+    """
+    Lists the images and label files of every split, returns split name -> SplitIndex.
+    One scandir pass over images/ and labels/, joined by stem (the label sizes
+    and mtimes come from the same pass and key the cache). The label files of
+    a split read from its binary label store (see `_split_store`) come from
+    the store shards instead.
+    """
+    split_indexes = {}
+    for split_name in SPLITS:
+        logging.info(f'Listing split: {split_name}')
+        split_label = f'{label}/{split_name}' if label else split_name
+        split_path = os.path.join(dataset_path, split_name)
+        with profiler.stage(f'index:{split_label}') as record:
+            store_path = _split_store(split_path, label_store)
+            if store_path is not None:
+                logging.info(f'Reading the labels of split {split_name} from the label store {store_path}')
+                split_index = index_store(split_path, open_store(store_path))
+            else:
+                split_index = index_split(split_path)
+            record['items'] = len(split_index.images) + len(split_index.label_files)
+        for img_file in split_index.missing:
+            logging.warning(f'Missing annotation for image: {img_file}')
+        for label_name in split_index.orphans:
+            logging.warning(f'Orphan label file (no image): {label_name}')
+        for img_file in split_index.duplicates:
+            logging.warning(f'Image shares its label file with another image (counted for both): {img_file}')
+        split_indexes[split_name] = split_index
+    return split_indexes
+
+def _log_split_counters(split: SplitHealth):
+    """Logs the empty label files, malformed lines and counters of a split."""
+    split_name = split.name
+    for label_file in split.empty_label_files:
+        logging.info(f'Empty annotation for label file: {label_file}')
+    for label_file, line_number, line in split.malformed:
+        logging.warning(f'Malformed line {line_number} in {label_file}: {line!r}')
+
+    logging.info(f'{split_name} - Images: {split.total_images}')
+    logging.info(f'{split_name} - Annotations: {split.total_annotations}')
+    logging.info(f'{split_name} - Images w/o annotation: {split.images_without_annotation}')
+    logging.info(f'{split_name} - Empty annotations: {len(split.aggregate.empty_labels)}')
+    logging.info(f'{split_name} - Malformed lines: {len(split.aggregate.malformed)}')
+    logging.info(f'{split_name} - Orphan label files: {len(split.index.orphans)}')
+    logging.info(f'{split_name} - Box sizes (small, medium, large): {split.aggregate.size_counts}')
+    logging.info(f'{split_name} - Near-duplicate boxes: {len(split.aggregate.duplicates)}, '
+                 f'overlapping pairs: {split.aggregate.overlapping_pairs}')
+
+def _log_image_stats(split: SplitHealth):
+    for img_file in split.image_stats.unreadable:
+        logging.warning(f'Unreadable image header: {img_file}')
+    logging.info(f'{split.name} - Image formats: {dict(split.image_stats.formats)}')
+
+def _read_image_stats(split_path: str, split_index, header_workers: int, profiler: StageProfiler, label: str):
+    """
+    Reads the image sizes of a split from the image headers, returns
+    (ImageStats, (n, 2) width and height of the image of every label file).
+    """
+    images_path = os.path.join(split_path, 'images')
+    with profiler.stage(f'image_stats:{label}', items=len(split_index.images)):
+        image_stats = collect_image_stats(
+            [os.path.join(images_path, img_file) for img_file in split_index.images],
+            workers=header_workers,
+        )
+    label_sizes = image_stats.image_sizes(
+        [os.path.join(images_path, img_file) for img_file in split_index.labeled_images]
+    )
+    return image_stats, label_sizes
+
+def _build_split(split_name: str, split_path: str, split_index, aggregate, image_stats) -> SplitHealth:
+    """Logs the counters and image formats of a split (`image_stats` None when the stage is disabled)."""
+    logging.info(f'Analyzing split: {split_name}')
+    # The label files of a store are reported relative to it
+    labels_path = split_index.label_store.path if split_index.label_store is not None else None
+    split = SplitHealth(split_name, split_path, split_index, aggregate, image_stats, labels_path)
+    _log_split_counters(split)
+    if image_stats is not None:
+        _log_image_stats(split)
+    return split
+
+def iter_health(dataset_paths: list, heatmap_resolution: int = DEFAULT_RESOLUTION, workers: int = 1,
+                use_cache: bool = True, image_stats: bool = True, header_workers: int = DEFAULT_HEADER_WORKERS,
+                profiler: StageProfiler = None, labels: list = None, label_store: bool = False):
+    """
+    Computes the health of several YOLO datasets, one at a time, without writing
+    any output (except the label cache with `use_cache`). Yields a
+    `DatasetHealth` per dataset, in order.
+
+    With `workers > 1` all the datasets share one process pool, so it is
+    started once for the whole batch. Only the dataset being yielded is held in
+    memory (a 1000x1000 heatmap pair per split).
+    `labels` (one per dataset) prefix the profiler stage names.
+    See `analyze_dataset` for the other parameters.
+    """
+    profiler = profiler or StageProfiler('health')
+    dataset_paths = [dataset_path.replace('\\', '/') for dataset_path in dataset_paths]
+    if len({os.path.abspath(dataset_path) for dataset_path in dataset_paths}) < len(dataset_paths):
+        # They would share (and corrupt) the same label cache
+        raise ValueError('The same dataset is listed more than once')
+    labels = labels or [None] * len(dataset_paths)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(dataset_paths) > 1 else None
+    try:
+        for dataset_path, label in zip(dataset_paths, labels):
+            logging.info(f'Starting dataset analysis at: {dataset_path}')
+            location = archive_reader.split_archive_path(dataset_path)
+            if location is not None:
+                # The member index is built once here, every later read goes through it
+                with profiler.stage(f'archive:{label}' if label else 'archive') as record:
+                    record['items'] = len(archive_reader.get_archive(location[0]).members)
+            class_names = load_class_names(dataset_path)
+            split_indexes = _index_splits(dataset_path, profiler, label, 'prefer' if label_store else 'auto')
+
+            # Image sizes first, the box sizes are measured in the image of every box
+            split_stats, image_sizes = {}, {}
+            if image_stats:
+                for split_name, split_index in split_indexes.items():
+                    split_stats[split_name], image_sizes[split_name] = _read_image_stats(
+                        os.path.join(dataset_path, split_name), split_index, header_workers, profiler,
+                        f'{label}/{split_name}' if label else split_name,
+                    )
+
+            # Parse and aggregate the label files, shard by shard
+            # (all splits share the same worker pool when workers > 1,
+            # unchanged shards are taken from the cache)
+            cache_folders = None
+            if use_cache:
+                cache_folders = {
+                    split_name: os.path.join(archive_reader.extracted_path(dataset_path), 'health', 'cache', split_name)
+                    for split_name in SPLITS
+                }
+            label_files = {
+                split_name: split_index.label_files
+                for split_name, split_index in split_indexes.items() if split_index.label_store is None
+            }
+            aggregates = {}
+            if label_files:
+                with profiler.stage(f'aggregate:{label}' if label else 'aggregate',
+                                    items=sum(len(files) for files in label_files.values()), workers=workers):
+                    aggregates = aggregate_splits(
+                        label_files,
+                        workers=workers,
+                        resolution=heatmap_resolution,
+                        cache_folders=cache_folders,
+                        executor=executor,
+                        image_sizes=image_sizes,
+                    )
+            # Splits read from their label store, already in memory
+            for split_name, split_index in split_indexes.items():
+                if split_index.label_store is not None:
+                    split_label = f'{label}/{split_name}' if label else split_name
+                    with profiler.stage(f'store:{split_label}', items=split_index.label_store.boxes):
+                        aggregates[split_name] = aggregate_store(
+                            split_index, heatmap_resolution, image_sizes=image_sizes.get(split_name),
+                        )
+
+            splits = {}
+            for split_name in SPLITS:
+                splits[split_name] = _build_split(
+                    split_name, os.path.join(dataset_path, split_name), split_indexes[split_name],
+                    aggregates[split_name], split_stats.get(split_name),
+                )
+            yield DatasetHealth(dataset_path, class_names, splits)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def compute_health(dataset_path: str, heatmap_resolution: int = DEFAULT_RESOLUTION, workers: int = 1,
+                   use_cache: bool = True, image_stats: bool = True, header_workers: int = DEFAULT_HEADER_WORKERS,
+                   profiler: StageProfiler = None, label_store: bool = False) -> DatasetHealth:
+    """
+    Computes the health of a YOLO dataset in memory, without writing any output
+    (except the label cache with `use_cache`). See `analyze_dataset` for the
+    parameters, and `write_health_outputs` to save the result.
+    """
+    return next(iter_health([dataset_path], heatmap_resolution, workers, use_cache, image_stats,
+                            header_workers, profiler, label_store=label_store))
 
-    # Dictionary to store results for each split
-    results = {}
+def analyze_dataset(dataset_path: str, heatmap_resolution: int = DEFAULT_RESOLUTION, workers: int = 1,
+                    use_cache: bool = True, image_stats: bool = True,
+                    header_workers: int = DEFAULT_HEADER_WORKERS, plots: str = 'matplotlib',
+                    profiler: StageProfiler = None, label_store: bool = False) -> DatasetHealth:
+    """
+    Main function that analyzes a YOLO-format dataset at `dataset_path`.
+    - Generates raw CSV files with class distribution, etc.
+    - Computes and saves unidimensional metrics in `health_metrics.csv`.
+    - Generates plots and logs for manual inspection:
+      * Class distribution bar charts
+      * Full bounding-box heatmap (heatmap_resolution x heatmap_resolution, 1000x1000 by default)
+      * Bounding-box center heatmap (heatmap_resolution x heatmap_resolution)
+    With `workers > 1` the label files are parsed and aggregated in a process
+    pool; the outputs are identical to the serial run.
+    With `use_cache` the parsed labels are cached under `health/cache/<split>/`
+    and a rerun only parses the label files added, changed or removed since the
+    previous run; the outputs are identical to a run without cache.
+    With `image_stats` the size of every image is read from its header (no
+    pixel decoding) by `header_workers` threads; the small/medium/large box
+    counts then measure every box in its own image (without it, every image is
+    taken as square).
+    A split without a `labels/` folder is read from its binary label store
+    (`label_store/`, written by the converter), with `label_store` every split
+    that has one is (see `store_source.py`).
+    `plots` is one of `PLOT_MODES`: matplotlib figures, heatmaps written
+    straight to PNG (`fast`), or no plots at all (`none`, the metrics are the
+    same in every mode).
+    Every stage is timed by `profiler` (a new one without trace by default,
+    finished here; a profiler passed by the caller is left open).
+    Returns the in-memory `DatasetHealth` (the same as `compute_health`).
+    """
 
-    # Create 'health' folder to store artifacts
-    health_folder = os.path.join(dataset_path, 'health')
-    os.makedirs(health_folder, exist_ok=True)
+    if plots not in PLOT_MODES:
+        raise ValueError(f'Unknown plot mode {plots}, expected one of {PLOT_MODES}')
+    owns_profiler = profiler is None
+    if owns_profiler:
+        profiler = StageProfiler('health')
 
-    for split_name, split_path in splits.items():
-        logging.info(f'Analyzing split: {split_name}')
-        images_path = os.path.join(split_path, 'images')
-        labels_path = os.path.join(split_path, 'labels')
-
-        total_images = 0
-        total_annotations = 0
-        images_without_annotation = 0
-        empty_annotations = 0
-        class_counter = Counter()
-
-        # We'll store bounding box centers (x, y) in normalized coords
-        bbox_centers = []
-
-        # 1000x1000 heatmap for the entire bounding box footprint
-        heatmap_bboxes = np.zeros((1000, 1000), dtype=np.float32)
-        # 1000x1000 heatmap specifically for bounding box centers
-        heatmap_centers = np.zeros((1000, 1000), dtype=np.float32)
-
-        image_files = [
-            f for f in os.listdir(images_path)
-            if f.lower().endswith(('.jpg', '.png', '.jpeg'))
-        ]
+    health = compute_health(dataset_path, heatmap_resolution, workers, use_cache, image_stats, header_workers,
+                            profiler, label_store)
+    write_health_outputs(health, plots, profiler)
 
-        for img_file in tqdm(image_files, desc=f'Processing {split_name}', unit='img'):
-            total_images += 1
-            label_file = os.path.join(
-                labels_path, os.path.splitext(img_file)[0] + '.txt'
-            )
+    logging.info('Analysis completed successfully.')
+    if owns_profiler:
+        print(profiler.finish())
+    print('✅ Analysis completed. Results are stored in the health folder.')
+    return health
 
-            if not os.path.exists(label_file):
-                images_without_annotation += 1
-                logging.warning(f'Missing annotation for image: {img_file}')
-                continue
-
-            try:
-                with open(label_file, 'r') as lf:
-                    lines = lf.readlines()
-                    if not lines:
-                        empty_annotations += 1
-                        logging.info(f'Empty annotation for image: {img_file}')
-                        continue
-
-                    for line in lines:
-                        total_annotations += 1
-                        data = line.strip().split()
-                        class_id = int(data[0])
-                        class_counter[class_id] += 1
-
-                        x_center = float(data[1])
-                        y_center = float(data[2])
-                        w = float(data[3])
-                        h = float(data[4])
-
-                        # Store normalized center for spatial metrics
-                        bbox_centers.append((x_center, y_center))
-
-                        # Convert center to integer for the center heatmap
-                        cx = int(x_center * 1000)
-                        cy = int(y_center * 1000)
-                        if 0 <= cx < 1000 and 0 <= cy < 1000:
-                            heatmap_centers[cy, cx] += 1.0
-
-                        # Convert bounding box footprint to integer coords
-                        x_min = int((x_center - w / 2) * 1000)
-                        x_max = int((x_center + w / 2) * 1000)
-                        y_min = int((y_center - h / 2) * 1000)
-                        y_max = int((y_center + h / 2) * 1000)
-
-                        # Clamp to avoid out-of-bounds
-                        x_min = max(x_min, 0)
-                        x_max = min(x_max, 999)
-                        y_min = max(y_min, 0)
-                        y_max = min(y_max, 999)
-
-                        # Increment bounding box footprint
-                        heatmap_bboxes[y_min:y_max+1, x_min:x_max+1] += 1.0
-
-            except Exception as e:
-                logging.warning(f'Error processing file {img_file}: {e}')
-
-        # Prepare result dictionary for this split
-        results[split_name] = {
-            'total_images': total_images,
-            'total_annotations': total_annotations,
-            'images_without_annotation': images_without_annotation,
-            'empty_annotations': empty_annotations,
-            'class_counts': dict(class_counter),
-            'bbox_centers': bbox_centers  # used to compute spatial metrics
-        }
+def analyze_datasets(dataset_paths: list, comparison_path: str = None, write_outputs: bool = True,
+                     heatmap_resolution: int = DEFAULT_RESOLUTION, workers: int = 1, use_cache: bool = True,
+                     image_stats: bool = True, header_workers: int = DEFAULT_HEADER_WORKERS,
+                     plots: str = 'matplotlib', profiler: StageProfiler = None, label_store: bool = False) -> list:
+    """
+    Batch analysis of several YOLO datasets (e.g. the variants of one source
+    dataset) in one process, with one shared worker pool.
 
-        logging.info(f'{split_name} - Images: {total_images}')
-        logging.info(f'{split_name} - Annotations: {total_annotations}')
-        logging.info(f'{split_name} - Images w/o annotation: {images_without_annotation}')
-        logging.info(f'{split_name} - Empty annotations: {empty_annotations}')
+    Parameters:
+        dataset_paths (list): Roots of the datasets.
+        comparison_path (str): CSV file of the combined comparison table
+            (one row per dataset and split), not written when None.
+        write_outputs (bool): Also write the outputs of `analyze_dataset` under
+            every `<dataset>/health/` folder.
+        See `analyze_dataset` for the other parameters.
 
-        # -------------------------------------------------------
-        # Save class distribution as CSV
-        # -------------------------------------------------------
-        csv_class_dist = os.path.join(health_folder, f'class_distribution_{split_name}.csv')
-        with open(csv_class_dist, 'w', newline='', encoding='utf-8') as f_csv:
-            writer = csv.writer(f_csv)
-            writer.writerow(['class_id', 'count'])
-            for cid, cnt in sorted(class_counter.items()):
-                writer.writerow([cid, cnt])
-        logging.info(f'Saved class distribution CSV for {split_name} -> {csv_class_dist}')
-
-        # -------------------------------------------------------
-        # Plot and save class distribution as PNG
-        # -------------------------------------------------------
-        class_ids = sorted(class_counter.keys())
-        class_counts = [class_counter[cid] for cid in class_ids]
-        plt.figure(figsize=(8, 6))
-        plt.bar(class_ids, class_counts, color='blue')
-        plt.xlabel('Class ID')
-        plt.ylabel('Count')
-        plt.title(f'Class Distribution - {split_name}')
-        plt.xticks(class_ids)  # might be cluttered if many classes
-        dist_plot_file = os.path.join(health_folder, f'class_distribution_{split_name}.png')
-        plt.savefig(dist_plot_file)
-        plt.close()
-        logging.info(f'Saved class distribution plot for {split_name} -> {dist_plot_file}')
-
-        # -------------------------------------------------------
-        # Save bounding-box footprint heatmap as PNG
-        # -------------------------------------------------------
-        plt.figure(figsize=(6, 6))
-        plt.imshow(heatmap_bboxes, cmap='hot', interpolation='nearest', origin='lower')
-        plt.title(f'Annotation BBox Heatmap - {split_name}')
-        plt.colorbar(label='Number of bounding boxes')
-        heatmap_file = os.path.join(health_folder, f'heatmap_bboxes_{split_name}.png')
-        plt.savefig(heatmap_file)
-        plt.close()
-        logging.info(f'Saved bounding-box footprint heatmap for {split_name} -> {heatmap_file}')
-
-        # -------------------------------------------------------
-        # Save bounding-box center heatmap as PNG
-        # -------------------------------------------------------
-        plt.figure(figsize=(6, 6))
-        plt.imshow(heatmap_centers, cmap='hot', interpolation='nearest', origin='lower')
-        plt.title(f'Annotation Centers Heatmap - {split_name}')
-        plt.colorbar(label='Number of bounding box centers')
-        center_heatmap_file = os.path.join(health_folder, f'heatmap_centers_{split_name}.png')
-        plt.savefig(center_heatmap_file)
-        plt.close()
-        logging.info(f'Saved bounding-box center heatmap for {split_name} -> {center_heatmap_file}')
-
-
-
-    # -------------------------------------------------------
-    # Compute unidimensional metrics and save in health_metrics.csv
-    # -------------------------------------------------------
-    metrics_csv_path = os.path.join(health_folder, 'health_metrics.csv')
-    with open(metrics_csv_path, 'w', newline='', encoding='utf-8') as f_csv:
-        writer = csv.writer(f_csv)
-        writer.writerow([
-            'split',
-            'total_images',
-            'total_annotations',
-            'images_without_annotation',
-            'empty_annotations',
-            'effective_num_classes',
-            'gini_index',
-            'entropy_class_dist',
-            'std_class_counts',
-            'spatial_entropy',
-            'std_object_centers',
-            'avg_distance_center_of_mass'
-        ])
-
-        for split_name, info in results.items():
-            c_counts = info['class_counts']
-            centers = info['bbox_centers']
+    Returns:
+        list: Comparison rows, dicts with `dataset`, `split` and the `METRIC_COLUMNS` keys.
+    """
+    if plots not in PLOT_MODES:
+        raise ValueError(f'Unknown plot mode {plots}, expected one of {PLOT_MODES}')
+    owns_profiler = profiler is None
+    if owns_profiler:
+        profiler = StageProfiler('health')
+
+    # Dataset folder names label the stages (the full path when names repeat)
+    names = [os.path.basename(os.path.normpath(dataset_path)) for dataset_path in dataset_paths]
+    if len(set(names)) < len(names):
+        names = [dataset_path.replace('\\', '/') for dataset_path in dataset_paths]
+
+    rows = []
+    for name, health in zip(names, iter_health(dataset_paths, heatmap_resolution, workers, use_cache, image_stats,
+                                               header_workers, profiler, labels=names,
+                                               label_store=label_store)):
+        if write_outputs:
+            write_health_outputs(health, plots, profiler, label=name)
+        for split_name, metrics in health.metrics().items():
+            rows.append({'dataset': health.dataset_path, 'split': split_name, **metrics})
+
+    if comparison_path:
+        write_comparison_csv(rows, comparison_path)
+    logging.info(f'Batch analysis of {len(dataset_paths)} datasets completed successfully.')
+    if owns_profiler:
+        print(profiler.finish())
+    return rows
+
+def _metrics_from_totals(totals: dict, split_index) -> dict:
+    """
+    `APPROXIMATE_COLUMNS` metrics from the (weighted) totals of a label file
+    sample, see `approximate.SampleBoxes.weighted_totals`. The image counts come
+    from the split index.
+    """
+    class_counts = totals['class_counts']
+    centers = totals['centers']
+    std_centers, mean_distance = 0.0, 0.0
+    if centers > 0:
+        m2 = totals['sum_x2'] - totals['sum_x'] ** 2 / centers + totals['sum_y2'] - totals['sum_y'] ** 2 / centers
+        std_centers = math.sqrt(max(m2, 0.0) / centers)
+        mean_distance = totals['sum_dist'] / centers
+    total_images = len(split_index.images)
+    metrics = {
+        'total_images': total_images,
+        'total_annotations': round(totals['total_annotations'], 6),
+        'images_without_annotation': len(split_index.missing),
+        'empty_annotations': round(totals['empty_annotations'], 6),
+        'effective_num_classes': compute_num_classes(class_counts),
+        'gini_index': compute_gini_index(class_counts),
+        'entropy_class_dist': compute_entropy_class_distribution(class_counts),
+        'std_class_counts': compute_std_class_counts(class_counts),
+        'spatial_entropy': grid_entropy(totals['spatial_grid']),
+        'std_object_centers': round(std_centers, 6),
+        'avg_distance_center_of_mass': round(mean_distance, 6),
+        'malformed_lines': round(totals['malformed_lines'], 6),
+        'orphan_labels': len(split_index.orphans),
+        'mean_boxes_per_image': round(totals['total_annotations'] / total_images, 6) if total_images else 0.0,
+        **{f'{size}_boxes': round(count, 6) for size, count in zip(SIZE_CLASSES, totals['size_counts'])},
+        'duplicate_boxes': round(totals['duplicate_boxes'], 6),
+        'overlapping_pairs': round(totals['overlapping_pairs'], 6),
+    }
+    return {column: metrics[column] for column in APPROXIMATE_COLUMNS}
 
-            # Class distribution metrics
-            effective_num_classes = compute_num_classes(c_counts)
-            gini_index = compute_gini_index(c_counts)
-            entropy_class_dist = compute_entropy_class_distribution(c_counts)
-            std_class = compute_std_class_counts(c_counts)
+def compute_approximate_health(dataset_path: str, precision: float = DEFAULT_PRECISION,
+                               confidence: float = DEFAULT_CONFIDENCE, initial_sample: int = DEFAULT_INITIAL_SAMPLE,
+                               max_sample: int = None, bootstrap: int = DEFAULT_BOOTSTRAP, seed: int = 0,
+                               targets: tuple = APPROXIMATE_TARGETS, profiler: StageProfiler = None) -> dict:
+    """
+    Estimates the label metrics of a YOLO dataset from a seeded, stratified
+    random sample of its label files (see `approximate.py`), without writing
+    any output.
+
+    Parameters:
+        dataset_path (str): Root of the dataset.
+        precision (float): The sample grows until the confidence interval
+            half-width of every `targets` metric is at most this.
+        confidence (float): Confidence level of the bootstrap intervals.
+        initial_sample (int): Label files sampled in the first round, per split.
+        max_sample (int): Largest sample per split (default: every label file).
+        bootstrap (int): Bootstrap replicates per round.
+        seed (int): Seed of the sample and of the bootstrap.
+        targets (tuple): Metrics of `APPROXIMATE_COLUMNS` the precision applies to.
+        profiler (StageProfiler): Stage timer (default: a new one without trace).
+
+    Returns:
+        dict: Split name -> ApproximateMetrics (`APPROXIMATE_COLUMNS` estimates and intervals).
+    """
+    unknown = set(targets) - set(APPROXIMATE_COLUMNS)
+    if unknown:
+        raise ValueError(f'Unknown target metrics {sorted(unknown)}, expected some of {APPROXIMATE_COLUMNS}')
+    if precision <= 0:
+        raise ValueError(f'The precision must be positive, got {precision}')
+    profiler = profiler or StageProfiler('health')
+    dataset_path = dataset_path.replace('\\', '/')
+    logging.info(f'Starting approximate dataset analysis at: {dataset_path}')
+    # Sampling only applies to label files
+    split_indexes = _index_splits(dataset_path, profiler, label_store='never')
+    results = {}
+    for split_name, split_index in split_indexes.items():
+        with profiler.stage(f'approximate:{split_name}') as record:
+            images_path = os.path.join(dataset_path, split_name, 'images')
+            result = approximate_split(
+                split_index.label_files, lambda totals: _metrics_from_totals(totals, split_index), targets,
+                precision, confidence, initial_sample, max_sample, bootstrap, seed,
+                image_paths=[os.path.join(images_path, img_file) for img_file in split_index.labeled_images],
+            )
+            record['items'] = result.sampled_files
+            record['rounds'] = len(result.rounds)
+        if not result.converged:
+            logging.warning(f'{split_name}: precision {precision} not reached with {result.sampled_files} label files')
+        for metric in targets:
+            low, high = result.intervals[metric]
+            logging.info(f'{split_name} - {metric}: {result.estimates[metric]} [{low}, {high}]')
+        results[split_name] = result
+    return results
+
+def analyze_dataset_approximate(dataset_path: str, profiler: StageProfiler = None, **options) -> dict:
+    """
+    Approximate `analyze_dataset`: estimates the label metrics with
+    `compute_approximate_health` (same keyword options) and saves them to
+    `<dataset>/health/health_metrics_approximate.csv`.
+    """
+    owns_profiler = profiler is None
+    if owns_profiler:
+        profiler = StageProfiler('health')
+    results = compute_approximate_health(dataset_path, profiler=profiler, **options)
+    health_folder = os.path.join(archive_reader.extracted_path(dataset_path), 'health')
+    os.makedirs(health_folder, exist_ok=True)
+    write_approximate_csv(results, os.path.join(health_folder, 'health_metrics_approximate.csv'))
+    if owns_profiler:
+        print(profiler.finish())
+    print(f'✅ Approximate analysis completed. Results are stored in {health_folder}.')
+    return results
+
+def compute_coco_health(annotation_paths: dict, images_folders: dict = None, health_folder: str = None,
+                        heatmap_resolution: int = DEFAULT_RESOLUTION, image_stats: bool = True,
+                        header_workers: int = DEFAULT_HEADER_WORKERS, streaming: bool = False,
+                        profiler: StageProfiler = None) -> DatasetHealth:
+    """
+    Computes the health of a COCO dataset in memory, straight from its
+    annotation files (see `coco_source.py`): the metrics, heatmaps and CSVs are
+    the same as for the YOLO dataset `coco_to_yolo_converter` would write.
+
+    Parameters:
+        annotation_paths (dict): Split name -> COCO annotation json file.
+        images_folders (dict): Split name -> images folder (optional). Image
+            sizes missing from the annotations are read from the image
+            headers, and the image size metrics come from the headers too;
+            without it they come from the `images` table.
+        health_folder (str): Output folder of `write_health_outputs`
+            (default: `health/` next to the first annotation file).
+        streaming (bool): Decode the annotation files one element at a time
+            (bounded memory) instead of loading them whole.
+        See `analyze_dataset` for the other parameters.
+    """
+    profiler = profiler or StageProfiler('health')
+    images_folders = images_folders or {}
+    annotation_paths = {split_name: path.replace('\\', '/') for split_name, path in annotation_paths.items()}
+    if not annotation_paths:
+        raise ValueError('No COCO annotation file given')
+    dataset_path = os.path.dirname(next(iter(annotation_paths.values()))) or '.'
+
+    class_names = None
+    splits = {}
+    for split_name, annotations_path in annotation_paths.items():
+        logging.info(f'Reading COCO annotations of split {split_name}: {annotations_path}')
+        images_folder = images_folders.get(split_name)
+        with profiler.stage(f'read:{split_name}', bytes_read=archive_reader.stat(annotations_path).st_size,
+                            streaming=streaming) as record:
+            coco = read_coco(annotations_path, streaming)
+            record['items'] = len(coco.image_ids)
+        names = list(coco.categories.values())
+        if class_names is None:
+            class_names = names
+        elif names != class_names:
+            logging.warning(f'Categories of split {split_name} differ from the first split, keeping the first ones')
+
+        with profiler.stage(f'aggregate:{split_name}', items=len(coco.image_ids)):
+            split_index = index_coco(coco)
+            boxes, image_sizes, _ = coco_boxes(coco, split_index, images_folder, header_workers)
+            aggregate = aggregate_boxes(split_index, boxes, heatmap_resolution, image_sizes=image_sizes)
+
+        logging.info(f'Analyzing split: {split_name}')
+        # The label files are virtual, they are reported by name
+        split = SplitHealth(split_name, annotations_path, split_index, aggregate, labels_path='')
+        _log_split_counters(split)
+        if image_stats:
+            with profiler.stage(f'image_stats:{split_name}', items=split.total_images):
+                split.image_stats = coco_image_stats(coco, split_index, images_folder, header_workers)
+            _log_image_stats(split)
+        splits[split_name] = split
+        # Only the aggregate of a split is kept
+        del coco, boxes, image_sizes
+
+    return DatasetHealth(dataset_path, class_names, splits, health_folder)
+
+def analyze_coco(annotation_paths: dict, images_folders: dict = None, health_folder: str = None,
+                 heatmap_resolution: int = DEFAULT_RESOLUTION, image_stats: bool = True,
+                 header_workers: int = DEFAULT_HEADER_WORKERS, streaming: bool = False, plots: str = 'matplotlib',
+                 profiler: StageProfiler = None) -> DatasetHealth:
+    """
+    `analyze_dataset` for a COCO dataset: computes its health with
+    `compute_coco_health` and writes the outputs to `health_folder`.
+    """
+    if plots not in PLOT_MODES:
+        raise ValueError(f'Unknown plot mode {plots}, expected one of {PLOT_MODES}')
+    owns_profiler = profiler is None
+    if owns_profiler:
+        profiler = StageProfiler('health')
+
+    health = compute_coco_health(annotation_paths, images_folders, health_folder, heatmap_resolution, image_stats,
+                                 header_workers, streaming, profiler)
+    write_health_outputs(health, plots, profiler)
 
-            # Spatial metrics
-            spatial_entropy_val = compute_spatial_entropy(centers, grid_size=10)
-            std_centers = compute_std_object_centers(centers)
-            distance_cm = compute_distance_from_center_of_mass(centers)
-
-            writer.writerow([
-                split_name,
-                info['total_images'],
-                info['total_annotations'],
-                info['images_without_annotation'],
-                info['empty_annotations'],
-                effective_num_classes,
-                gini_index,
-                entropy_class_dist,
-                std_class,
-                spatial_entropy_val,
-                std_centers,
-                distance_cm
-            ])
-
-    logging.info(f'Saved unidimensional metrics in {metrics_csv_path}')
     logging.info('Analysis completed successfully.')
-    print('✅ Analysis completed. Results are stored in the health folder.')
+    if owns_profiler:
+        print(profiler.finish())
+    print(f'✅ Analysis completed. Results are stored in {health.health_folder}.')
+    return health
 
 
 # -------------------------------------------------------
@@ -435,6 +1121,127 @@ def analyze_dataset(dataset_path: str):
 # -------------------------------------------------------
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='YOLO Dataset Health Analysis')
-    parser.add_argument('dataset_path', type=str, help='Path to the YOLO dataset')
+    parser.add_argument('dataset_path', type=str, nargs='*',
+                        help='Path to the YOLO dataset, a folder or a zip/tar/tar.gz archive (or a folder inside '
+                             'one, e.g. data.zip/yolo), several paths run a batch in one process')
+    parser.add_argument('--coco', type=str, action='append', default=[], metavar='SPLIT=PATH',
+                        help='Analyze a COCO annotation file directly instead of a YOLO dataset, '
+                             'repeatable (e.g. --coco train=instances_train.json --coco val=instances_val.json), '
+                             'the file may be inside an archive (coco.zip/annotations/instances_val.json)')
+    parser.add_argument('--coco-images', type=str, action='append', default=[], metavar='SPLIT=FOLDER',
+                        help='Images folder of a COCO split: image sizes missing from the annotation file and '
+                             'the image size metrics are read from the image headers (default: images table)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Output folder of a COCO analysis (default: health/ next to the first annotation file)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Decode the COCO annotation files incrementally instead of loading them whole '
+                             '(bounded memory)')
+    parser.add_argument('--comparison', type=str, default='health_comparison.csv',
+                        help='Combined comparison table of a batch, one row per dataset and split '
+                             '(default: health_comparison.csv)')
+    parser.add_argument('--heatmap-resolution', type=int, default=DEFAULT_RESOLUTION,
+                        help='Number of heatmap cells per side (default: 1000)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to parse and aggregate label files (default: 1)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Parse every label file instead of using (and updating) the health/cache folder')
+    parser.add_argument('--label-store', action='store_true',
+                        help='Read the labels from the binary label store of a split (label_store/, written by the '
+                             'converter with --label_format bin or both) even when it also has a labels/ folder')
+    parser.add_argument('--no-image-stats', action='store_true',
+                        help='Skip reading the image headers (image size and aspect ratio metrics, the box '
+                             'sizes then take every image as square)')
+    parser.add_argument('--header-workers', type=int, default=DEFAULT_HEADER_WORKERS,
+                        help=f'Number of threads reading image headers (default: {DEFAULT_HEADER_WORKERS})')
+    plot_group = parser.add_mutually_exclusive_group()
+    plot_group.add_argument('--fast-plots', action='store_true',
+                            help='Write the heatmaps straight to PNG (no matplotlib, no axes, colorbar or bar charts)')
+    plot_group.add_argument('--no-plots', action='store_true',
+                            help='Skip the plots (and the heatmaps), only write the CSV metrics')
+    parser.add_argument('--approximate', action='store_true',
+                        help='Estimate the label metrics from a random sample of label files, with confidence '
+                             'intervals, instead of an exact pass (writes health_metrics_approximate.csv)')
+    parser.add_argument('--precision', type=float, default=DEFAULT_PRECISION,
+                        help='Approximate mode: largest accepted confidence interval half-width of the Gini index, '
+                             f'class entropy and spatial entropy (default: {DEFAULT_PRECISION})')
+    parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE,
+                        help=f'Approximate mode: confidence level of the intervals (default: {DEFAULT_CONFIDENCE})')
+    parser.add_argument('--initial-sample', type=int, default=DEFAULT_INITIAL_SAMPLE,
+                        help='Approximate mode: label files sampled in the first round, the sample then grows '
+                             f'until the precision is reached (default: {DEFAULT_INITIAL_SAMPLE})')
+    parser.add_argument('--max-sample', type=int, default=None,
+                        help='Approximate mode: largest sample per split (default: every label file)')
+    parser.add_argument('--bootstrap', type=int, default=DEFAULT_BOOTSTRAP,
+                        help=f'Approximate mode: bootstrap replicates per round (default: {DEFAULT_BOOTSTRAP})')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Approximate mode: seed of the sample and of the bootstrap (default: 0)')
+    parser.add_argument('--trace', type=str, default='trace.ndjson',
+                        help='NDJSON file the per-stage timings, throughput and peak memory are appended to '
+                             '(default: trace.ndjson, an empty string disables it)')
+    parser.add_argument('--profile-stage', type=str, action='append', default=[],
+                        help='Stage captured with --profiler (archive, index, read, aggregate, store, heatmap, '
+                             'image_stats, plots, metrics, optionally with a split as in plots:val), repeatable, '
+                             '"all" for every stage')
+    parser.add_argument('--profiler', type=str, default='cprofile', choices=PROFILERS,
+                        help='cprofile writes a .prof file, sample writes collapsed stacks (.folded) '
+                             'with a lower overhead (default: cprofile)')
+    parser.add_argument('--profile-folder', type=str, default='profiles',
+                        help='Folder of the profile files (default: profiles)')
     args = parser.parse_args()
-    analyze_dataset(args.dataset_path)
+    if bool(args.dataset_path) == bool(args.coco):
+        parser.error('give either YOLO dataset paths or --coco annotation files')
+    if args.approximate and args.coco:
+        parser.error('--approximate only applies to YOLO datasets')
+    if args.approximate and args.label_store:
+        parser.error('--approximate samples label files, it does not read the label store')
+    if args.precision <= 0:
+        parser.error(f'--precision must be positive, got {args.precision}')
+    if args.coco and (args.workers != 1 or args.no_cache or args.label_store):
+        parser.error('--workers, --no-cache and --label-store only apply to YOLO datasets, '
+                     'a COCO annotation file is read in this process without cache')
+
+    def split_pairs(values: list, option: str) -> dict:
+        pairs = {}
+        for value in values:
+            split_name, sep, path = value.partition('=')
+            if not sep or not split_name or not path:
+                parser.error(f'{option} expects SPLIT=PATH, got {value!r}')
+            pairs[split_name] = path
+        return pairs
+
+    coco_paths = split_pairs(args.coco, '--coco')
+    coco_images = split_pairs(args.coco_images, '--coco-images')
+
+    # Configured here and not at import time, so importing this module (library
+    # use, spawned workers) never touches the log of a running analysis. Runs
+    # are appended, the run id of each matches its records in the trace
+    logging.basicConfig(
+        filename='main.log',
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filemode='a'
+    )
+    profiler = StageProfiler('health', args.trace, args.profile_stage, args.profiler, args.profile_folder)
+    logging.info(f'Run id: {profiler.run_id}')
+    options = dict(
+        heatmap_resolution=args.heatmap_resolution, workers=args.workers, use_cache=not args.no_cache,
+        image_stats=not args.no_image_stats, header_workers=args.header_workers,
+        plots='none' if args.no_plots else 'fast' if args.fast_plots else 'matplotlib', profiler=profiler,
+        label_store=args.label_store,
+    )
+    if args.approximate:
+        for dataset_path in args.dataset_path:
+            analyze_dataset_approximate(
+                dataset_path, profiler=profiler, precision=args.precision, confidence=args.confidence,
+                initial_sample=args.initial_sample, max_sample=args.max_sample, bootstrap=args.bootstrap,
+                seed=args.seed,
+            )
+    elif coco_paths:
+        del options['workers'], options['use_cache'], options['label_store']
+        analyze_coco(coco_paths, coco_images, args.output, streaming=args.streaming, **options)
+    elif len(args.dataset_path) == 1:
+        analyze_dataset(args.dataset_path[0], **options)
+    else:
+        analyze_datasets(args.dataset_path, comparison_path=args.comparison, **options)
+        print(f'✅ Analyzed {len(args.dataset_path)} datasets. Comparison table: {args.comparison}')
+    print(profiler.finish())
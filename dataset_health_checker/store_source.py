@@ -0,0 +1,224 @@
+"""
+Binary Label Store Source
+
+Reads the labels of a split from the binary label store `coco_to_yolo_converter`
+writes with `--label_format bin` (`<split>/label_store/`, see
+`coco_to_yolo_converter/label_store.py`) instead of one label file per image:
+a few shard files, each with an image offset index and fixed-width records.
+
+Every shard file is memory-mapped and viewed in place as NumPy arrays (the
+offset index as uint64, the records as `RECORD_DTYPE`), nothing is parsed and
+nothing is loaded up front. A store inside an archive is read into memory
+instead.
+
+The records are in store order (store shard, then label file name), the
+aggregates need them grouped by the shards of `aggregate.py`, so they are
+gathered from the mapped arrays anyway. The gather goes chunk by chunk, a few
+aggregate shards and about `STORE_CHUNK_BOXES` boxes at a time, and casts the
+gathered records to `BOX_DTYPE` (float64 coordinates): the summaries and
+heatmaps then share their code with the label files and COCO, and only one
+chunk is ever copied, so memory does not grow with the size of the store.
+
+The result is the same `SplitIndex` and `SplitAggregate` the label files give:
+- the label files are virtual (no path, size or mtime), named as in the store,
+  so the shards and the file order within a shard are the same
+- the coordinates are stored as float32, so the metrics match the label files
+  up to float32 rounding
+- there are no malformed lines, and the label cache is not used (there is
+  nothing to parse)
+"""
+
+import os
+import sys
+import json
+import mmap
+import numpy as np
+
+from label_loader import BOX_DTYPE
+from dataset_index import SplitIndex, LabelFile, list_images, join_split
+from aggregate import SplitAggregate, aggregate_boxes, label_file_shards, DEFAULT_GRID_SIZE, NUM_SHARDS
+from heatmaps import DEFAULT_RESOLUTION
+
+# Store format shared with the converter
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'coco_to_yolo_converter'))
+from label_store import STORE_FOLDER, STORE_META, STORE_VERSION, read_header, shard_layout, shard_path
+
+# Archive members are read like files (shared with the converter)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archives'))
+import archive_reader
+
+# Same layout as `label_store.RECORD`
+RECORD_DTYPE = np.dtype([
+    ('class_id', '<i4'),
+    ('xc', '<f4'),
+    ('yc', '<f4'),
+    ('w', '<f4'),
+    ('h', '<f4'),
+])
+# Boxes gathered and cast to `BOX_DTYPE` at a time (at least one aggregate shard)
+STORE_CHUNK_BOXES = 1_000_000
+
+
+class LabelStore:
+    """
+    Result of `open_store`.
+
+    Attributes:
+        path (str): Store folder.
+        shards (list): (label names, offsets, records) of every shard file:
+            the sorted label file names, the uint64 image offset index and the
+            `RECORD_DTYPE` records, both views of the mapped file.
+    """
+
+    def __init__(self, path, shards):
+        self.path = path
+        self.shards = shards
+
+    @property
+    def label_files(self) -> int:
+        return sum(len(names) for names, _, _ in self.shards)
+
+    @property
+    def boxes(self) -> int:
+        return sum(len(records) for _, _, records in self.shards)
+
+
+def find_store(split_path: str):
+    """The label store folder of a split, None when it has no complete store."""
+    store_path = os.path.join(split_path, STORE_FOLDER)
+    try:
+        # Written last by the converter
+        archive_reader.stat(os.path.join(store_path, STORE_META))
+    except OSError:
+        return None
+    return store_path
+
+
+def _map_file(path: str):
+    """Read-only memory map of a file (the content of an archive member)."""
+    if archive_reader.split_archive_path(path) is not None:
+        return archive_reader.read_bytes(path)
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def open_store(store_path: str) -> LabelStore:
+    """
+    Maps every shard file of a label store.
+
+    Parameters:
+        store_path (str): Store folder (or a folder inside an archive).
+
+    Returns:
+        LabelStore: Names, offset index and records of every shard.
+    """
+    with archive_reader.open_text(os.path.join(store_path, STORE_META)) as f:
+        meta = json.load(f)
+    if meta.get('version') != STORE_VERSION:
+        raise ValueError(f'Label store {store_path} has version {meta.get("version")}, expected {STORE_VERSION}')
+    shards = []
+    for shard in range(meta['shards']):
+        path = shard_path(store_path, shard)
+        data = _map_file(path)
+        num_images, num_boxes, names_size = read_header(data, path)
+        offsets_start, records_start, names_start = shard_layout(num_images, num_boxes)
+        # The arrays keep the map open
+        offsets = np.frombuffer(data, dtype='<u8', count=num_images + 1, offset=offsets_start)
+        records = np.frombuffer(data, dtype=RECORD_DTYPE, count=num_boxes, offset=records_start)
+        names = data[names_start:names_start + names_size].decode('utf-8').split('\n')[:-1]
+        shards.append((names, offsets, records))
+    return LabelStore(store_path, shards)
+
+
+def index_store(split_path: str, store: LabelStore) -> SplitIndex:
+    """
+    Joins the images of a split with the label files of its store, like
+    `index_split` does with the `labels/` folder.
+    """
+    labels = {}
+    for names, _, _ in store.shards:
+        for name in names:
+            labels[os.path.splitext(name)[0]] = LabelFile(None, name, 0, 0)
+    index = join_split(list_images(split_path), labels)
+    index.label_store = store
+    return index
+
+
+def _store_files(index: SplitIndex) -> list:
+    """
+    (store file, label file position) pairs of every shard of the store: the
+    label files of `index` each store file is read for (orphans are left out).
+    """
+    positions = {}
+    for p, label_file in enumerate(index.label_files):
+        positions.setdefault(label_file.name, []).append(p)
+    pairs = []
+    for names, _, _ in index.label_store.shards:
+        files = [(i, p) for i, name in enumerate(names) for p in positions.get(name, ())]
+        pairs.append(np.array(files, dtype=np.int64).reshape(-1, 2))
+    return pairs
+
+
+def iter_store_boxes(index: SplitIndex, file_shards: np.ndarray, chunk_boxes: int = STORE_CHUNK_BOXES):
+    """
+    Boxes of the label files of `index`, a group of aggregate shards at a time.
+
+    Parameters:
+        index (SplitIndex): Result of `index_store`.
+        file_shards (np.ndarray): Aggregate shard of every label file.
+        chunk_boxes (int): Boxes gathered at a time (whole shards, so a chunk
+            may hold more).
+
+    Yields:
+        tuple: (aggregate shards of the chunk, their boxes with `BOX_DTYPE` in
+            label file and line order, `image` is the position of their file
+            in `index.label_files`).
+    """
+    store_files = _store_files(index)
+    counts = [np.diff(offsets).astype(np.int64) for _, offsets, _ in index.label_store.shards]
+    shard_boxes = np.zeros(NUM_SHARDS, dtype=np.int64)
+    for pairs, file_counts in zip(store_files, counts):
+        np.add.at(shard_boxes, file_shards[pairs[:, 1]], file_counts[pairs[:, 0]])
+
+    chunk, chunk_size = [], 0
+    groups = []
+    for shard_index in np.unique(file_shards).tolist():
+        chunk.append(shard_index)
+        chunk_size += int(shard_boxes[shard_index])
+        if chunk_size >= chunk_boxes:
+            groups.append(chunk)
+            chunk, chunk_size = [], 0
+    if chunk:
+        groups.append(chunk)
+
+    for group in groups:
+        parts = [np.zeros(0, dtype=BOX_DTYPE)]
+        for (_, offsets, records), pairs, file_counts in zip(index.label_store.shards, store_files, counts):
+            pairs = pairs[np.isin(file_shards[pairs[:, 1]], group)]
+            lengths = file_counts[pairs[:, 0]]
+            # Record rows of the selected files: one range per file, concatenated
+            starts = offsets[:-1].astype(np.int64)[pairs[:, 0]]
+            rows = np.arange(int(lengths.sum())) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            boxes = np.empty(len(rows), dtype=BOX_DTYPE)
+            boxes['image'] = np.repeat(pairs[:, 1], lengths)
+            for field in RECORD_DTYPE.names:
+                boxes[field] = records[field][rows]
+            parts.append(boxes)
+        boxes = np.concatenate(parts)
+        # Label file order, the stable sort keeps the line order within each file
+        yield group, boxes[np.argsort(boxes['image'], kind='stable')]
+
+
+def aggregate_store(index: SplitIndex, resolution: int = DEFAULT_RESOLUTION,
+                    grid_size: int = DEFAULT_GRID_SIZE, image_sizes: np.ndarray = None) -> SplitAggregate:
+    """
+    `SplitAggregate` of a split indexed by `index_store`, `image_sizes` are the
+    sizes of the images of its label files (see `aggregate_boxes`). The store
+    is reduced chunk by chunk (see `iter_store_boxes`).
+    """
+    file_shards = label_file_shards(index)
+    aggregate = SplitAggregate(resolution, grid_size)
+    for group, boxes in iter_store_boxes(index, file_shards):
+        chunk_shards = np.where(np.isin(file_shards, group), file_shards, -1)
+        aggregate.merge(aggregate_boxes(index, boxes, resolution, grid_size, image_sizes, chunk_shards))
+    return aggregate
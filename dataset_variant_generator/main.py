@@ -0,0 +1,247 @@
+"""
+YOLO Dataset Variant Generator
+
+Derives controlled variants of a YOLO-format dataset (the layout consumed by
+`dataset_health_checker/main.py`: `data.yaml`, `train/` and `val/`, each with
+`images/` and `labels/`), as described in the README methodology:
+- **Number of classes** (e.g. 10, 20, 40, 80)
+- **Instance distribution** (uniform vs. skewed)
+- **Instance density per image** (sparse vs. dense)
+- **Spatial distribution** (concentrated vs. spread)
+
+Every split is indexed once in memory (see `variant_index.py`) and all the
+variants are derived from that index with seeded sampling (see `variants.py`
+for the variant keys). Each variant is written to `<output_path>/<name>/` as a
+YOLO dataset: images are hardlinked (falling back to reflink, then copy, like
+the converter) and only the label files are rewritten, so dozens of variants
+take seconds and almost no extra disk.
+
+--------------------------------------------------------------------
+Usage Example:
+    python main.py /path/to/yolo_dataset /path/to/variants --preset readme
+    python main.py /path/to/yolo_dataset /path/to/variants --spec variants.yaml --seed 1
+
+variants.yaml example:
+```
+seed: 0
+variants:
+  - name: uniform_10
+    num_classes: 10
+    balance: uniform
+  - name: dense_center
+    min_boxes: 5
+    spatial: concentrated
+```
+--------------------------------------------------------------------
+"""
+
+import os
+import sys
+import csv
+import time
+import shutil
+import argparse
+import logging
+import yaml as pyyaml
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+# Shared modules of the other tools (YOLO label loading and directory index,
+# image hardlinking with fallbacks)
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(_REPO_ROOT, 'dataset_health_checker'))
+sys.path.append(os.path.join(_REPO_ROOT, 'coco_to_yolo_converter'))
+
+from image_materializer import ImageMaterializer, STRATEGIES, DEFAULT_COPY_WORKERS
+from variant_index import VariantIndex, DEFAULT_SPATIAL_GRID
+from variants import VariantSpec, readme_preset, select_classes, class_map_for, select_images
+
+SPLITS = ('train', 'val')
+
+
+def load_class_names(dataset_path: str) -> list:
+    """Class names of `data.yaml` (list, or dict of id -> name)."""
+    with open(os.path.join(dataset_path, 'data.yaml'), 'r') as f_yaml:
+        names = (pyyaml.safe_load(f_yaml) or {}).get('names', [])
+    if isinstance(names, dict):
+        size = max(int(k) for k in names) + 1 if names else 0
+        return [names.get(i, names.get(str(i), f'class_{i}')) for i in range(size)]
+    return list(names)
+
+
+def load_specs(spec_path: str, preset: str, num_classes: int, seed: int):
+    """Returns (specs, seed) from a YAML spec file or a preset."""
+    if spec_path is not None:
+        with open(spec_path, 'r') as f_yaml:
+            data = pyyaml.safe_load(f_yaml) or {}
+        specs = [VariantSpec.from_dict(entry) for entry in data.get('variants', [])]
+        seed = data.get('seed', seed)
+    elif preset == 'readme':
+        specs = readme_preset(num_classes)
+    else:
+        raise ValueError(f'Unknown preset: {preset}')
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError('Variant names must be unique')
+    return specs, seed
+
+
+def _write_label_files(jobs: list):
+    for label_path, content in jobs:
+        with open(label_path, 'w') as f:
+            f.write(content)
+
+
+def write_labels(labels_folder: str, index: VariantIndex, image_ids: np.ndarray, box_mask: np.ndarray,
+                 class_map: np.ndarray, workers: int = DEFAULT_COPY_WORKERS) -> int:
+    """
+    Writes the label file of every selected image, with the kept boxes and the
+    new class ids. Files are written by `workers` threads (creating many small
+    files is bound by the filesystem latency). Returns the number of boxes.
+    """
+    selected = np.zeros(len(index), dtype=bool)
+    selected[image_ids] = True
+    boxes = index.boxes[box_mask & selected[index.boxes['image']]]
+    # Boxes are in image order, so each image is a contiguous run
+    ends = np.cumsum(np.bincount(boxes['image'], minlength=len(index))).tolist()
+    classes = class_map[boxes['class_id']].tolist()
+    coords = np.column_stack((boxes['xc'], boxes['yc'], boxes['w'], boxes['h'])).tolist()
+    lines = [f'{c} {xc} {yc} {w} {h}\n' for c, (xc, yc, w, h) in zip(classes, coords)]
+
+    jobs = []
+    for image_id in image_ids.tolist():
+        label_path = os.path.join(labels_folder, index.label_names[image_id])
+        start = ends[image_id - 1] if image_id else 0
+        jobs.append((label_path, ''.join(lines[start:ends[image_id]])))
+    for folder in {os.path.dirname(label_path) for label_path, _ in jobs}:
+        os.makedirs(folder, exist_ok=True)
+
+    chunks = [jobs[i:i + 256] for i in range(0, len(jobs), 256)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(_write_label_files, chunks))
+    return len(boxes)
+
+
+def generate_variants(dataset_path: str, output_path: str, specs: list, seed: int = 0,
+                      image_mode: str = 'auto', copy_workers: int = DEFAULT_COPY_WORKERS,
+                      spatial_grid: int = DEFAULT_SPATIAL_GRID) -> list:
+    """
+    Builds the index of every split once and writes every variant.
+
+    Parameters:
+        dataset_path (str): Source YOLO dataset.
+        output_path (str): Folder receiving one sub-folder per variant.
+        specs (list): `VariantSpec` of every variant.
+        seed (int): Default seed of the variants.
+        image_mode (str): Image materialization strategy (see the converter's `--image_mode`).
+        copy_workers (int): Threads materializing images.
+        spatial_grid (int): Cells per side of the grid of the spatial filters (odd).
+
+    Returns:
+        list: One summary row (variant, split, images, boxes, classes, seconds) per variant and split.
+    """
+    if spatial_grid % 2 == 0:
+        raise ValueError('The spatial grid needs a central cell, use an odd size')
+    source_path = os.path.abspath(dataset_path)
+    for spec in specs:
+        variant_path = os.path.abspath(os.path.join(output_path, spec.name))
+        if os.path.commonpath([source_path, variant_path]) in (source_path, variant_path):
+            raise ValueError(f'Variant folder {variant_path} overlaps the source dataset {source_path}')
+    class_names = load_class_names(dataset_path)
+
+    start = time.perf_counter()
+    indexes = {}
+    for split_name in SPLITS:
+        split_path = os.path.join(dataset_path, split_name)
+        if not os.path.isdir(split_path):
+            logging.warning(f'Split not found: {split_path}')
+            continue
+        indexes[split_name] = VariantIndex(split_path, spatial_grid)
+        logging.info(f'Indexed {split_name}: {len(indexes[split_name])} images, '
+                     f'{len(indexes[split_name].boxes)} boxes')
+    logging.info(f'Indexes built in {time.perf_counter() - start:.2f}s')
+    if not indexes:
+        raise FileNotFoundError(f'No split found in {dataset_path}')
+
+    reference = indexes[next(iter(indexes))]
+    num_source_classes = max(len(class_names), len(reference.class_counts))
+    reference_counts = np.zeros(num_source_classes, dtype=np.int64)
+    reference_counts[:len(reference.class_counts)] = reference.class_counts
+
+    summary = []
+    for spec in tqdm(specs, desc='Variants', unit='variant'):
+        variant_start = time.perf_counter()
+        variant_seed = spec.seed if spec.seed is not None else seed
+        kept = select_classes(spec, reference_counts, class_names, np.random.default_rng(variant_seed))
+        class_map = class_map_for(kept, num_source_classes)
+
+        variant_path = os.path.join(output_path, spec.name)
+        # Leftovers of a previous generation would leak into the variant
+        shutil.rmtree(variant_path, ignore_errors=True)
+        os.makedirs(variant_path)
+
+        reference_boxes = None
+        for split_position, (split_name, index) in enumerate(indexes.items()):
+            split_boxes = int(np.isin(index.boxes['class_id'], kept).sum())
+            if reference_boxes is None:
+                reference_boxes = split_boxes
+            scale = split_boxes / reference_boxes if reference_boxes else 1.0
+            rng = np.random.default_rng([variant_seed, split_position])
+            image_ids, box_mask = select_images(spec, index, class_map, rng, scale)
+
+            split_out = os.path.join(variant_path, split_name)
+            ImageMaterializer(os.path.join(split_out, 'images'), image_mode, copy_workers).materialize(
+                [index.images[i] for i in image_ids], os.path.join(index.split_path, 'images')
+            )
+            num_boxes = write_labels(os.path.join(split_out, 'labels'), index, image_ids, box_mask, class_map,
+                                     copy_workers)
+            summary.append([spec.name, split_name, len(image_ids), num_boxes, len(kept),
+                            round(time.perf_counter() - variant_start, 3)])
+            logging.info(f'{spec.name}/{split_name}: {len(image_ids)} images, {num_boxes} boxes')
+
+        names = [class_names[c] if c < len(class_names) else f'class_{c}' for c in kept.tolist()]
+        data_yaml = {'names': names, 'nc': len(names)}
+        data_yaml.update({split_name: f'{split_name}/images' for split_name in indexes})
+        with open(os.path.join(variant_path, 'data.yaml'), 'w') as f_yaml:
+            pyyaml.safe_dump(data_yaml, f_yaml, sort_keys=False)
+
+    with open(os.path.join(output_path, 'variants.csv'), 'w', newline='', encoding='utf-8') as f_csv:
+        writer = csv.writer(f_csv)
+        writer.writerow(['variant', 'split', 'images', 'boxes', 'classes', 'seconds'])
+        writer.writerows(summary)
+    logging.info(f'{len(specs)} variants generated in {time.perf_counter() - start:.2f}s')
+    return summary
+
+
+# -------------------------------------------------------
+# Entry Point
+# -------------------------------------------------------
+if __name__ == '__main__':
+    logging.basicConfig(
+        filename='main.log',
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filemode='w'
+    )
+    parser = argparse.ArgumentParser(description='YOLO Dataset Variant Generator')
+    parser.add_argument('dataset_path', type=str, help='Path to the source YOLO dataset')
+    parser.add_argument('output_path', type=str, help='Folder receiving one YOLO dataset per variant')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--spec', type=str, help='YAML file listing the variants (see variants.py)')
+    source.add_argument('--preset', type=str, choices=['readme'],
+                        help='Built-in variant set (readme: the variants of the README methodology)')
+    parser.add_argument('--seed', type=int, default=0, help='Default seed of the variants (default: 0)')
+    parser.add_argument('--image-mode', type=str, default='auto', choices=STRATEGIES,
+                        help='How images are put in the variants: auto tries hardlink, then reflink, then copy')
+    parser.add_argument('--copy-workers', type=int, default=DEFAULT_COPY_WORKERS,
+                        help=f'Number of threads materializing images (default: {DEFAULT_COPY_WORKERS})')
+    parser.add_argument('--spatial-grid', type=int, default=DEFAULT_SPATIAL_GRID,
+                        help=f'Cells per side of the grid used by the spatial filters (default: {DEFAULT_SPATIAL_GRID})')
+    args = parser.parse_args()
+
+    specs, seed = load_specs(args.spec, args.preset, len(load_class_names(args.dataset_path)), args.seed)
+    os.makedirs(args.output_path, exist_ok=True)
+    generate_variants(args.dataset_path, args.output_path, specs, seed=seed, image_mode=args.image_mode,
+                      copy_workers=args.copy_workers, spatial_grid=args.spatial_grid)
+    print('✅ Variants generated.')
@@ -0,0 +1,86 @@
+"""
+Variant Index
+
+In-memory index of one split of a YOLO dataset, built once and shared by every
+variant:
+- all boxes in one structured array (`BOX_DTYPE`, `image` = position of the
+  image in `images`), parsed in bulk by the health checker's label loader
+- class -> images and image -> per-class box counts (CSR arrays)
+- image -> box count
+- box -> spatial cell of its center, image -> occupied cells
+
+A variant is then only a class mapping plus a selection of image indices, both
+computed with NumPy on these arrays.
+"""
+
+import numpy as np
+
+from dataset_index import index_split
+from label_loader import load_labels
+
+DEFAULT_SPATIAL_GRID = 3
+
+
+class VariantIndex:
+    """
+    Index of one split (folder with `images/` and `labels/`).
+
+    Attributes:
+        split_path (str): Split folder.
+        images (list): Image paths (relative to `images/`) that have a label file.
+        label_names (list): Label file of every image (relative to `labels/`).
+        boxes (np.ndarray): Every valid box of the split, in image and line order.
+        box_counts (np.ndarray): Number of boxes of every image.
+        class_counts (np.ndarray): Number of boxes of every class id.
+    """
+
+    def __init__(self, split_path: str, spatial_grid: int = DEFAULT_SPATIAL_GRID):
+        self.split_path = split_path
+        split_index = index_split(split_path)
+        self.images = split_index.labeled_images
+        self.label_names = [label_file.name for label_file in split_index.label_files]
+
+        parsed = load_labels([label_file.path for label_file in split_index.label_files])
+        boxes = parsed.boxes
+        self.boxes = boxes[boxes['class_id'] >= 0]
+        self.malformed = parsed.malformed
+        self.box_counts = np.bincount(self.boxes['image'], minlength=len(self.images))
+        self.class_counts = np.bincount(self.boxes['class_id'])
+
+        # Spatial cell of every box center (row-major, clamped to the grid)
+        self.spatial_grid = spatial_grid
+        gx = np.clip((self.boxes['xc'] * spatial_grid).astype(np.int64), 0, spatial_grid - 1)
+        gy = np.clip((self.boxes['yc'] * spatial_grid).astype(np.int64), 0, spatial_grid - 1)
+        self.box_cells = gy * spatial_grid + gx
+
+    def __len__(self):
+        return len(self.images)
+
+    def image_class_counts(self, box_mask: np.ndarray):
+        """
+        Per-image class histogram of the boxes in `box_mask`, as CSR arrays.
+
+        Returns:
+            tuple: (offsets, class_ids, counts), the classes of image `i` are
+            `class_ids[offsets[i]:offsets[i + 1]]`.
+        """
+        images = self.boxes['image'][box_mask].astype(np.int64)
+        classes = self.boxes['class_id'][box_mask].astype(np.int64)
+        num_classes = int(classes.max()) + 1 if len(classes) else 1
+        pairs, counts = np.unique(images * num_classes + classes, return_counts=True)
+        pair_images = pairs // num_classes
+        offsets = np.zeros(len(self.images) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_images, minlength=len(self.images)), out=offsets[1:])
+        return offsets, pairs % num_classes, counts
+
+    def occupied_cells(self, box_mask: np.ndarray) -> np.ndarray:
+        """Number of distinct spatial cells occupied by the boxes in `box_mask`, per image."""
+        cells = self.spatial_grid * self.spatial_grid
+        pairs = np.unique(self.boxes['image'][box_mask].astype(np.int64) * cells + self.box_cells[box_mask])
+        return np.bincount(pairs // cells, minlength=len(self.images))
+
+    def outside_center(self, box_mask: np.ndarray) -> np.ndarray:
+        """Number of boxes in `box_mask` whose center is outside the central cell, per image."""
+        center = (self.spatial_grid * self.spatial_grid) // 2
+        outside = box_mask & (self.box_cells != center)
+        return np.bincount(self.boxes['image'][outside], minlength=len(self.images))
@@ -0,0 +1,237 @@
+"""
+Variant Specifications and Selection
+
+A variant is described by a dict (one entry of the YAML spec file or of a
+preset). Every key is optional except `name`:
+
+- `num_classes` (int): keep this many classes, chosen by `class_selection`
+  (`top`: most frequent in the first split, `random`: seeded sample).
+  `classes` (list of names or ids) selects them explicitly instead. Kept
+  classes are renumbered from 0, boxes of the other classes are dropped.
+- `balance` (`uniform` | `skewed`): image sampling so that every kept class
+  reaches the same number of boxes (`uniform`, the count of the rarest class
+  or `instances_per_class`), or a Zipf-like profile where the class of rank r
+  gets `top / r^skew` boxes (`skewed`, `skew` defaults to 1.0).
+- `min_boxes` / `max_boxes` (int): density filter on the kept boxes per image
+  (sparse vs. dense images).
+- `spatial` (`concentrated` | `spread`): keep images whose boxes all have their
+  center in the central cell of a `spatial_grid x spatial_grid` grid, or whose
+  boxes occupy at least `min_cells` cells (default 3).
+- `max_images` (int): seeded sample of the selected images.
+- `seed` (int): overrides the global seed for this variant.
+
+`instances_per_class` and `max_images` apply to the first split (train); the
+other splits get them scaled by their relative size.
+Images left without any box are never part of a variant.
+"""
+
+import numpy as np
+
+BALANCES = ('uniform', 'skewed')
+SPATIAL_MODES = ('concentrated', 'spread')
+CLASS_SELECTIONS = ('top', 'random')
+DEFAULT_MIN_CELLS = 3
+README_CLASS_COUNTS = (10, 20, 40, 80)
+
+
+class VariantSpec:
+    """Validated variant description (see the module docstring for the keys)."""
+
+    KEYS = (
+        'name', 'num_classes', 'class_selection', 'classes', 'balance', 'skew', 'instances_per_class',
+        'min_boxes', 'max_boxes', 'spatial', 'min_cells', 'max_images', 'seed',
+    )
+
+    def __init__(self, name, num_classes=None, class_selection='top', classes=None, balance=None, skew=1.0,
+                 instances_per_class=None, min_boxes=None, max_boxes=None, spatial=None,
+                 min_cells=DEFAULT_MIN_CELLS, max_images=None, seed=None):
+        if not name or '/' in str(name) or '\\' in str(name):
+            raise ValueError(f'Invalid variant name: {name!r}')
+        if class_selection not in CLASS_SELECTIONS:
+            raise ValueError(f'{name}: class_selection must be one of {CLASS_SELECTIONS}')
+        if balance is not None and balance not in BALANCES:
+            raise ValueError(f'{name}: balance must be one of {BALANCES}')
+        if spatial is not None and spatial not in SPATIAL_MODES:
+            raise ValueError(f'{name}: spatial must be one of {SPATIAL_MODES}')
+        self.name = str(name)
+        self.num_classes = num_classes
+        self.class_selection = class_selection
+        self.classes = classes
+        self.balance = balance
+        self.skew = float(skew)
+        self.instances_per_class = instances_per_class
+        self.min_boxes = min_boxes
+        self.max_boxes = max_boxes
+        self.spatial = spatial
+        self.min_cells = min_cells
+        self.max_images = max_images
+        self.seed = seed
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'VariantSpec':
+        unknown = set(data) - set(cls.KEYS)
+        if unknown:
+            raise ValueError(f'Unknown variant keys {sorted(unknown)} in {data.get("name")!r}')
+        return cls(**data)
+
+
+def readme_preset(num_classes: int) -> list:
+    """
+    The variants of the README methodology: class subsets (10/20/40/80, as far
+    as the dataset has classes), uniform vs. skewed instance distribution,
+    sparse vs. dense images and concentrated vs. spread objects.
+    """
+    specs = [
+        VariantSpec(f'classes_{n}', num_classes=n)
+        for n in README_CLASS_COUNTS if n <= num_classes
+    ]
+    specs += [
+        VariantSpec('balance_uniform', balance='uniform'),
+        VariantSpec('balance_skewed', balance='skewed'),
+        VariantSpec('density_sparse', max_boxes=3),
+        VariantSpec('density_dense', min_boxes=10),
+        VariantSpec('spatial_concentrated', spatial='concentrated'),
+        VariantSpec('spatial_spread', spatial='spread'),
+    ]
+    return specs
+
+
+def select_classes(spec: VariantSpec, class_counts: np.ndarray, class_names: list, rng) -> np.ndarray:
+    """
+    Class ids kept by a variant, in their new order.
+
+    Parameters:
+        spec (VariantSpec): Variant.
+        class_counts (np.ndarray): Boxes per class id in the reference split.
+        class_names (list): Names of the source classes (index = class id).
+        rng (np.random.Generator): Seeded generator.
+
+    Returns:
+        np.ndarray: Source class ids, new class id = position.
+    """
+    present = np.flatnonzero(class_counts)
+    if spec.classes is not None:
+        kept = []
+        for entry in spec.classes:
+            if isinstance(entry, str):
+                if entry not in class_names:
+                    raise ValueError(f'{spec.name}: unknown class {entry!r}')
+                entry = class_names.index(entry)
+            kept.append(int(entry))
+        return np.array(kept, dtype=np.int64)
+    if spec.num_classes is None:
+        return present
+    if spec.class_selection == 'top':
+        # Most frequent first, ties by class id
+        order = present[np.argsort(-class_counts[present], kind='stable')]
+        return np.sort(order[:spec.num_classes])
+    return np.sort(rng.choice(present, size=min(spec.num_classes, len(present)), replace=False))
+
+
+def class_map_for(kept: np.ndarray, num_source_classes: int) -> np.ndarray:
+    """Source class id -> variant class id (-1 when dropped)."""
+    class_map = np.full(max(num_source_classes, int(kept.max()) + 1 if len(kept) else 0), -1, dtype=np.int64)
+    class_map[kept] = np.arange(len(kept))
+    return class_map
+
+
+def _balance_targets(spec: VariantSpec, available: np.ndarray, kept: np.ndarray, scale: float) -> np.ndarray:
+    """Box target per source class id for `spec.balance`."""
+    targets = np.zeros(len(available), dtype=np.int64)
+    kept = kept[available[kept] > 0]
+    if len(kept) == 0:
+        return targets
+    cap = None
+    if spec.instances_per_class is not None:
+        cap = max(1, int(round(spec.instances_per_class * scale)))
+    if spec.balance == 'uniform':
+        target = int(available[kept].min())
+        targets[kept] = target if cap is None else min(target, cap)
+    else:
+        ranked = kept[np.argsort(-available[kept], kind='stable')]
+        top = int(available[ranked[0]]) if cap is None else min(int(available[ranked[0]]), cap)
+        profile = np.maximum(1, np.round(top / np.arange(1, len(ranked) + 1) ** spec.skew)).astype(np.int64)
+        targets[ranked] = np.minimum(profile, available[ranked])
+    return targets
+
+
+def _balance(candidates: np.ndarray, csr, targets: np.ndarray, rng) -> np.ndarray:
+    """
+    Greedy image sampling: classes are filled from the rarest to the most
+    frequent until every class reaches its target. The candidate images of a
+    class are shuffled, then taken by decreasing share of that class among
+    their boxes, which limits the overshoot of co-occurring classes.
+    Returns the selected mask.
+    """
+    offsets, pair_classes, pair_counts = csr
+    selected = np.zeros(len(candidates), dtype=bool)
+    totals = np.zeros(len(targets), dtype=np.int64)
+    pair_images = np.repeat(np.arange(len(candidates)), np.diff(offsets))
+    image_boxes = np.bincount(pair_images, weights=pair_counts, minlength=len(candidates))
+    usable = candidates[pair_images] & (pair_classes < len(targets))
+    pair_images, classes_of_pairs = pair_images[usable], pair_classes[usable]
+    shares = pair_counts[usable] / image_boxes[pair_images]
+
+    available = np.bincount(classes_of_pairs, minlength=len(targets))
+    for class_id in np.argsort(available, kind='stable'):
+        if targets[class_id] == 0:
+            continue
+        of_class = classes_of_pairs == class_id
+        order = rng.permutation(np.count_nonzero(of_class))
+        order = order[np.argsort(-shares[of_class][order], kind='stable')]
+        images = pair_images[of_class][order]
+        for image in images[~selected[images]]:
+            if totals[class_id] >= targets[class_id]:
+                break
+            selected[image] = True
+            start, end = offsets[image], offsets[image + 1]
+            totals[pair_classes[start:end]] += pair_counts[start:end]
+    return selected
+
+
+def select_images(spec: VariantSpec, index, class_map: np.ndarray, rng, scale: float = 1.0):
+    """
+    Images and boxes of one split kept by a variant.
+
+    Parameters:
+        spec (VariantSpec): Variant.
+        index (VariantIndex): Index of the split.
+        class_map (np.ndarray): Source class id -> variant class id (-1 = dropped).
+        rng (np.random.Generator): Seeded generator.
+        scale (float): Size of this split relative to the first one.
+
+    Returns:
+        tuple: (sorted image indices, box mask over `index.boxes`).
+    """
+    class_ids = index.boxes['class_id']
+    box_mask = class_ids < len(class_map)
+    box_mask[box_mask] = class_map[class_ids[box_mask]] >= 0
+
+    kept_counts = np.bincount(index.boxes['image'][box_mask], minlength=len(index))
+    candidates = kept_counts > 0
+    if spec.min_boxes is not None:
+        candidates &= kept_counts >= spec.min_boxes
+    if spec.max_boxes is not None:
+        candidates &= kept_counts <= spec.max_boxes
+    if spec.spatial == 'concentrated':
+        candidates &= index.outside_center(box_mask) == 0
+    elif spec.spatial == 'spread':
+        candidates &= index.occupied_cells(box_mask) >= spec.min_cells
+
+    if spec.balance is not None:
+        csr = index.image_class_counts(box_mask)
+        offsets, pair_classes, pair_counts = csr
+        pair_images = np.repeat(np.arange(len(index)), np.diff(offsets))
+        in_candidates = candidates[pair_images]
+        available = np.bincount(pair_classes[in_candidates], weights=pair_counts[in_candidates],
+                                minlength=len(class_map)).astype(np.int64)
+        kept = np.flatnonzero(class_map >= 0)
+        targets = _balance_targets(spec, available, kept, scale)
+        candidates = _balance(candidates, csr, targets, rng)
+
+    image_ids = np.flatnonzero(candidates)
+    if spec.max_images is not None:
+        limit = max(1, int(round(spec.max_images * scale)))
+        if len(image_ids) > limit:
+            image_ids = np.sort(rng.choice(image_ids, size=limit, replace=False))
+    return image_ids, box_mask
@@ -0,0 +1,293 @@
+"""
+Stage Profiler
+
+Per-stage instrumentation shared by the tools. Every stage of a run records
+its wall and CPU time, items/s, bytes read and written, and peak memory. The
+records are appended to an NDJSON trace (one JSON event per line, tagged with
+the run id) and logged as a summary table at the end of the run.
+
+Bytes read and written default to the I/O counters of the process
+(`/proc/self/io`: every read/write call, page cache hits included) when the
+stage does not report them itself. The peak resident set size of a stage is
+the high-water mark (`VmHWM`), reset at the start of every stage on Linux;
+elsewhere it is the peak since the process started. Work done in child
+processes is not part of either counter.
+
+Any stage can be captured by a profiler without editing code:
+- `cprofile`: deterministic profile, saved as `<tool>_<stage>.prof`
+  (`python -m pstats`, snakeviz)
+- `sample`: a thread samples the stack of the profiled thread every few
+  milliseconds, saved as `<tool>_<stage>.folded` (collapsed stacks, the
+  input of flamegraph.pl and speedscope). Much lower overhead than cProfile.
+
+Stages do not nest.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import logging
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+PROFILERS = ('cprofile', 'sample')
+ALL_STAGES = 'all'
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+
+def reset_peak_rss() -> bool:
+    """Resets the peak RSS of this process (Linux only). Returns False when not supported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(children: bool = False):
+    """
+    Peak resident set size in MB, None if not available.
+
+    Parameters:
+        children (bool): Peak of the largest finished child process instead of this process.
+    """
+    if not children:
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def io_counters():
+    """(bytes read, bytes written) by this process so far, None if not available (Linux only)."""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class StackSampler:
+    """Samples the stack of one thread at a fixed interval and counts the collapsed stacks."""
+
+    def __init__(self, thread_id: int, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class StageProfiler:
+    """
+    Records the stages of one run of a tool.
+
+    Parameters:
+        tool (str): Tool name, written in every trace event.
+        trace_path (str): NDJSON file the events are appended to (None: no trace).
+        profile_stages (iterable): Stages captured by `profiler` ('all': every stage).
+            A name also matches the labelled variants of a stage
+            ('image_stats' matches 'image_stats:train').
+        profiler (str): One of `PROFILERS`.
+        profile_folder (str): Folder of the profile files.
+
+    Usage:
+        profiler = StageProfiler('health', trace_path='trace.ndjson')
+        with profiler.stage('parse', items=len(files)) as record:
+            ...
+            record['bytes_read'] = total_size  # optional, overrides the I/O counters
+        profiler.finish()
+    """
+
+    def __init__(self, tool: str, trace_path: str = None, profile_stages=(), profiler: str = 'cprofile',
+                 profile_folder: str = 'profiles'):
+        if profiler not in PROFILERS:
+            raise ValueError(f'Unknown profiler {profiler}, expected one of {PROFILERS}')
+        self.tool = tool
+        self.trace_path = trace_path
+        self.profile_stages = set(profile_stages or ())
+        self.profiler = profiler
+        self.profile_folder = profile_folder
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+        self.finished = False
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._peak_rss = 0.0
+        self._emit({
+            'event': 'run_start', 'time': round(time.time(), 3), 'pid': os.getpid(), 'host': socket.gethostname(),
+            'python': sys.version.split()[0], 'argv': sys.argv,
+        })
+
+    def _emit(self, event: dict):
+        if not self.trace_path:
+            return
+        event = {'tool': self.tool, 'run_id': self.run_id, **event}
+        with open(self.trace_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event) + '\n')
+
+    def _is_profiled(self, name: str) -> bool:
+        return ALL_STAGES in self.profile_stages or name in self.profile_stages \
+            or name.split(':', 1)[0] in self.profile_stages
+
+    def _profile_path(self, name: str, extension: str) -> str:
+        os.makedirs(self.profile_folder, exist_ok=True)
+        file_stem = f'{self.tool}_{name}'.replace(':', '_').replace('/', '_')
+        return os.path.join(self.profile_folder, f'{file_stem}.{extension}')
+
+    def _note_peak(self):
+        peak = peak_rss_mb()
+        if peak is not None:
+            self._peak_rss = max(self._peak_rss, peak)
+        return peak
+
+    @contextmanager
+    def stage(self, name: str, items: int = None, bytes_read: int = None, bytes_written: int = None, **fields):
+        """
+        Times the enclosed block as stage `name`.
+
+        `items`, `bytes_read` and `bytes_written` may also be set on the yielded
+        record inside the block; extra keyword arguments are written as-is in
+        the trace.
+        """
+        self._note_peak()
+        reset_peak_rss()
+        record = {'stage': name, 'items': items, 'bytes_read': bytes_read, 'bytes_written': bytes_written, **fields}
+        profile = sampler = None
+        if self._is_profiled(name):
+            if self.profiler == 'cprofile':
+                profile = cProfile.Profile()
+            else:
+                sampler = StackSampler(threading.get_ident())
+        io_start = io_counters()
+        wall = time.time()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile is not None:
+            profile.enable()
+        if sampler is not None:
+            sampler.start()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = repr(e)
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+            if sampler is not None:
+                sampler.stop()
+            seconds = time.perf_counter() - start
+            io_end = io_counters()
+            record['start'] = round(wall, 3)
+            record['seconds'] = round(seconds, 6)
+            record['cpu_seconds'] = round(time.process_time() - cpu_start, 6)
+            if io_start is not None and io_end is not None:
+                if record['bytes_read'] is None:
+                    record['bytes_read'] = io_end[0] - io_start[0]
+                if record['bytes_written'] is None:
+                    record['bytes_written'] = io_end[1] - io_start[1]
+            if seconds > 0:
+                if record['items'] is not None:
+                    record['items_per_s'] = round(record['items'] / seconds, 3)
+                if record['bytes_read'] is not None:
+                    record['read_mb_per_s'] = round(record['bytes_read'] / seconds / (1024 * 1024), 3)
+                if record['bytes_written'] is not None:
+                    record['write_mb_per_s'] = round(record['bytes_written'] / seconds / (1024 * 1024), 3)
+            record['peak_rss_mb'] = self._note_peak()
+            if profile is not None:
+                record['profile'] = self._profile_path(name, 'prof')
+                profile.dump_stats(record['profile'])
+            if sampler is not None:
+                record['profile'] = self._profile_path(name, 'folded')
+                sampler.save(record['profile'])
+            if 'profile' in record:
+                logging.info(f'Profile of stage {name} saved to {record["profile"]}')
+            self.records.append(record)
+            self._emit({'event': 'stage', **record})
+
+    def run_peak_rss_mb(self):
+        """Peak RSS of the whole run so far in MB (the per-stage resets do not hide it), None if not available."""
+        self._note_peak()
+        return self._peak_rss or None
+
+    def summary_table(self) -> str:
+        """Fixed-width table of the stages: seconds, share of the run, items/s, MB read and written, peak RSS."""
+        total = time.perf_counter() - self._start
+        width = max([24] + [len(r['stage']) for r in self.records])
+        header = f'{"stage":<{width}} {"seconds":>9} {"%":>6} {"items/s":>13} {"read MB":>9} {"write MB":>9} {"peak MB":>9}'
+        lines = [header, '-' * len(header)]
+        for r in self.records:
+            items_per_s = f'{r["items_per_s"]:,.0f}' if r.get('items_per_s') is not None else '-'
+            read_mb = f'{r["bytes_read"] / (1024 * 1024):.1f}' if r['bytes_read'] is not None else '-'
+            write_mb = f'{r["bytes_written"] / (1024 * 1024):.1f}' if r['bytes_written'] is not None else '-'
+            peak = f'{r["peak_rss_mb"]:.1f}' if r['peak_rss_mb'] is not None else '-'
+            share = 100 * r['seconds'] / total if total > 0 else 0.0
+            lines.append(f'{r["stage"]:<{width}} {r["seconds"]:>9.3f} {share:>6.1f} {items_per_s:>13} '
+                         f'{read_mb:>9} {write_mb:>9} {peak:>9}')
+        lines.append('-' * len(header))
+        lines.append(f'{"total":<{width}} {total:>9.3f} {100.0:>6.1f}')
+        return '\n'.join(lines)
+
+    def finish(self) -> str:
+        """Ends the run: logs the summary table, emits the `run_end` event and returns the table."""
+        table = self.summary_table()
+        if self.finished:
+            return table
+        self.finished = True
+        for line in table.splitlines():
+            logging.info(line)
+        children = peak_rss_mb(children=True)
+        self._emit({
+            'event': 'run_end',
+            'seconds': round(time.perf_counter() - self._start, 6),
+            'cpu_seconds': round(time.process_time() - self._cpu_start, 6),
+            'stages': len(self.records),
+            'peak_rss_mb': self.run_peak_rss_mb(),
+            'peak_rss_children_mb': children or None,
+        })
+        return table